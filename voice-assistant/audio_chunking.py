@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Parallel chunked transcription for long recordings
+One Whisper call decodes a clip serially, so latency grows with its length.
+Long clips are split at pauses (Silero VAD from faster-whisper, or frame
+energy if that is unavailable) into chunks that are decoded concurrently on
+the model's worker replicas and joined back in order. Where no pause is
+found the cut is hard and the chunks overlap slightly; words repeated across
+such a boundary are dropped from the later chunk.
+
+Usage:
+    python audio_chunking.py bench clip.wav [clip2.wav ...]   # latency vs. length, 5-120 s
+"""
+
+import logging
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional
+
+import numpy as np
+
+from transcriber import Transcript
+
+logger = logging.getLogger('VoiceAssistant.chunking')
+
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 480  # 30 ms energy frames
+
+
+class Chunk(NamedTuple):
+    start: int         # Sample offsets into the clip
+    end: int
+    overlapped: bool   # Starts before the previous chunk ended (hard cut, no pause)
+
+
+def find_pauses(audio: np.ndarray, min_silence_ms: int = 300) -> List[int]:
+    """Sample offsets in the middle of each pause between speech"""
+    try:
+        from faster_whisper.vad import VadOptions, get_speech_timestamps
+        speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=min_silence_ms))
+        return [(a['end'] + b['start']) // 2 for a, b in zip(speech, speech[1:])]
+    except ImportError:
+        return _energy_pauses(audio, min_silence_ms)
+
+
+def _energy_pauses(audio: np.ndarray, min_silence_ms: int) -> List[int]:
+    """Pauses from 30 ms frame RMS, relative to the clip's own loudness"""
+    frames = len(audio) // FRAME_SAMPLES
+    if frames < 2:
+        return []
+    rms = np.sqrt(np.mean(audio[:frames * FRAME_SAMPLES].reshape(frames, FRAME_SAMPLES) ** 2, axis=1))
+    silent = rms < max(np.percentile(rms, 90) * 0.1, 1e-4)
+    min_frames = max(1, min_silence_ms * SAMPLE_RATE // 1000 // FRAME_SAMPLES)
+    # Start/end frame of each run of silent frames
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [
+        int((s + e) // 2) * FRAME_SAMPLES
+        for s, e in zip(starts, ends)
+        if e - s >= min_frames and s > 0 and e < frames  # Leading/trailing silence is not a pause
+    ]
+
+
+def merge_texts(texts: List[str], overlapped: List[bool], max_overlap_words: int = 8) -> str:
+    """Join chunk texts, dropping words repeated across overlapping boundaries"""
+    words: List[str] = []
+    for text, overlap in zip(texts, overlapped):
+        incoming = text.split()
+        if overlap and words:
+            tail = [_norm(w) for w in words[-max_overlap_words:]]
+            head = [_norm(w) for w in incoming[:max_overlap_words]]
+            for k in range(min(len(tail), len(head)), 0, -1):
+                if tail[-k:] == head[:k]:
+                    incoming = incoming[k:]
+                    break
+        words.extend(incoming)
+    return " ".join(words)
+
+
+def _norm(word: str) -> str:
+    return re.sub(r"[^\w']", '', word.lower())
+
+
+class AudioChunker:
+    """Splits long clips at pauses and decodes the chunks concurrently"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_seconds: float = 20.0,
+        target_seconds: float = 15.0,
+        max_seconds: float = 28.0,
+        min_chunk_seconds: float = 5.0,
+        overlap_seconds: float = 1.0,
+        min_silence_ms: int = 300,
+        max_parallel: int = 2,
+    ):
+        self.enabled = enabled
+        self.min_seconds = min_seconds
+        self.target_seconds = target_seconds
+        self.max_seconds = max_seconds
+        self.min_chunk_seconds = min_chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.min_silence_ms = min_silence_ms
+        self.max_parallel = max(1, max_parallel)
+        # Shared by all turns: no more concurrent decodes than model replicas
+        self._pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='whisper-chunk')
+        self._lock = threading.Lock()
+        self._stats = {'clips': 0, 'chunks': 0, 'hard_cuts': 0, 'audio_seconds': 0.0, 'wall_seconds': 0.0}
+
+    @classmethod
+    def from_config(cls, config: Optional[dict], num_workers: int) -> "AudioChunker":
+        """Build from the `chunked_transcription` section; auto parallelism = Whisper num_workers"""
+        config = config or {}
+        max_parallel = config.get('max_parallel', 'auto')
+        return cls(
+            enabled=config.get('enabled', True),
+            min_seconds=config.get('min_seconds', 20.0),
+            target_seconds=config.get('target_seconds', 15.0),
+            max_seconds=config.get('max_seconds', 28.0),
+            min_chunk_seconds=config.get('min_chunk_seconds', 5.0),
+            overlap_seconds=config.get('overlap_seconds', 1.0),
+            min_silence_ms=config.get('min_silence_ms', 300),
+            max_parallel=num_workers if max_parallel in (None, 'auto') else int(max_parallel),
+        )
+
+    def should_split(self, duration: float) -> bool:
+        return self.enabled and self.max_parallel > 1 and duration >= self.min_seconds
+
+    def split(self, audio: np.ndarray) -> List[Chunk]:
+        """Chunks of about target_seconds, cut at the pause nearest the target"""
+        total = len(audio)
+        target = int(self.target_seconds * SAMPLE_RATE)
+        longest = int(self.max_seconds * SAMPLE_RATE)
+        shortest = int(self.min_chunk_seconds * SAMPLE_RATE)
+        overlap = int(self.overlap_seconds * SAMPLE_RATE)
+        pauses = find_pauses(audio, self.min_silence_ms)
+
+        chunks = []
+        start, overlapped = 0, False
+        while total - start > longest:
+            candidates = [p for p in pauses if start + shortest <= p <= start + longest]
+            if candidates:
+                cut = min(candidates, key=lambda p: abs(p - start - target))
+                chunks.append(Chunk(start, cut, overlapped))
+                start, overlapped = cut, False
+            else:
+                # Continuous speech: hard cut, and let the next chunk re-hear the edge
+                cut = start + longest
+                chunks.append(Chunk(start, cut, overlapped))
+                start, overlapped = cut - overlap, True
+        chunks.append(Chunk(start, total, overlapped))
+        return chunks
+
+    def transcribe(self, audio: np.ndarray, decode: Callable[[np.ndarray], Transcript],
+                   token=None) -> Transcript:
+        """Decode chunks in parallel with decode(samples) and stitch them in order"""
+        start = time.perf_counter()
+        chunks = self.split(audio)
+        futures = [self._pool.submit(decode, audio[c.start:c.end]) for c in chunks]
+        try:
+            parts = [f.result() for f in futures]
+        except BaseException:
+            # Cancelled or failed: drop chunks that have not started yet
+            for f in futures:
+                f.cancel()
+            raise
+        if token is not None:
+            token.check()
+        wall = time.perf_counter() - start
+
+        hard_cuts = sum(c.overlapped for c in chunks)
+        with self._lock:
+            self._stats['clips'] += 1
+            self._stats['chunks'] += len(chunks)
+            self._stats['hard_cuts'] += hard_cuts
+            self._stats['audio_seconds'] += len(audio) / SAMPLE_RATE
+            self._stats['wall_seconds'] += wall
+        logger.debug("Decoded %.1fs clip as %d chunks (%d hard cuts) in %.2fs",
+                     len(audio) / SAMPLE_RATE, len(chunks), hard_cuts, wall)
+
+        logprobs = [p.avg_logprob for p in parts if p.avg_logprob is not None]
+        no_speech = [p.no_speech_prob for p in parts if p.no_speech_prob is not None]
+        return Transcript(
+            text=merge_texts([p.text for p in parts], [c.overlapped for c in chunks]),
+            duration=len(audio) / SAMPLE_RATE,
+            decode_seconds=wall,
+            fallback=any(p.fallback for p in parts),
+            avg_logprob=min(logprobs, default=None),
+            no_speech_prob=max(no_speech, default=None),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        return {
+            'enabled': self.enabled,
+            'max_parallel': self.max_parallel,
+            'clips': s['clips'],
+            'chunks': s['chunks'],
+            'hard_cuts': s['hard_cuts'],
+            'rtf': round(s['wall_seconds'] / s['audio_seconds'], 4) if s['audio_seconds'] else None,
+        }
+
+
+def build_input(clips: List[np.ndarray], seconds: float) -> np.ndarray:
+    """Concatenate clips (with short gaps) until the input is `seconds` long"""
+    gap = np.zeros(int(0.4 * SAMPLE_RATE), dtype=np.float32)
+    parts, length, i = [], 0, 0
+    while length < seconds * SAMPLE_RATE:
+        clip = clips[i % len(clips)]
+        parts.extend((clip, gap))
+        length += len(clip) + len(gap)
+        i += 1
+    return np.concatenate(parts)[:int(seconds * SAMPLE_RATE)]
+
+
+def bench(clip_paths: List[str], lengths=(5, 10, 20, 30, 60, 90, 120), repeats: int = 3):
+    """Wall-clock latency vs. input length, serial vs. chunked"""
+    from faster_whisper import decode_audio
+    from launcher import load_config
+    from resource_planner import configure_process
+    from transcriber import Transcriber
+    from whisper_router import configured_default_model, configured_loader
+
+    config = load_config()
+    plan = configure_process(config)
+    model_name = configured_default_model(config)
+    model = configured_loader(config.get('whisper'), plan)(model_name)
+    transcriber = Transcriber.from_config(model, config.get('whisper'))
+    chunker = AudioChunker.from_config(config.get('chunked_transcription'), plan.num_workers)
+    clips = [decode_audio(p, sampling_rate=SAMPLE_RATE) for p in clip_paths]
+    transcriber.transcribe(clips[0])  # Warm-up
+
+    def timed(fn):
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    print(f"model={model_name} cpu_threads={plan.cpu_threads} "
+          f"num_workers={plan.num_workers} max_parallel={chunker.max_parallel}\n")
+    print(f"{'length':>7} {'chunks':>7} {'serial':>8} {'chunked':>8} {'speedup':>8}")
+    for seconds in lengths:
+        audio = build_input(clips, seconds)
+        serial = timed(lambda: transcriber.transcribe(audio))
+        chunks = chunker.split(audio)
+        chunked = timed(lambda: chunker.transcribe(audio, transcriber.transcribe))
+        print(f"{seconds:>6}s {len(chunks):>7} {serial:>7.2f}s {chunked:>7.2f}s {serial / chunked:>7.2f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "bench":
+        bench(sys.argv[2:])
+    else:
+        print(__doc__)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Audio preprocessing between ingestion and Whisper
+Replaces the per-clip `ffmpeg -ar 16000 -ac 1` subprocess (and its silent
+fallback to the raw WebM file). Uploads are decoded to PCM in-process (WAV
+with the wave module, anything else with PyAV, which faster-whisper already
+installs), then downmixed, resampled to 16 kHz with a polyphase FIR filter,
+DC-corrected and normalized in NumPy. The work happens in place on buffer
+pairs checked out of a small pool for the length of a turn (decode through
+transcription) and returned afterwards; they grow to the longest clip seen,
+so a steady stream of turns does not allocate per clip. Filter banks are
+designed once per input rate.
+
+Usage:
+    python audio_preprocess.py bench [--seconds 30]   # audio-seconds per CPU-second
+"""
+
+import argparse
+import io
+import logging
+import sys
+import threading
+import time
+import wave
+from contextlib import contextmanager
+from math import gcd
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+logger = logging.getLogger('VoiceAssistant.preprocess')
+
+SAMPLE_RATE = 16000
+
+# Full scale of each integer sample type (uint8 is offset binary)
+_SCALE = {np.dtype(np.int16): 1 / 32768.0, np.dtype(np.int32): 1 / 2147483648.0,
+          np.dtype(np.uint8): 1 / 128.0}
+
+
+class AudioDecodeError(Exception):
+    """The upload could not be decoded to PCM"""
+
+
+def decode_pcm(source) -> Tuple[np.ndarray, int]:
+    """(frames x channels array, sample rate) from a path, bytes or file object"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        return _decode_wav(source)
+    except (wave.Error, EOFError):
+        # Compressed (WebM/Opus, Ogg, MP3...) or float WAV
+        if hasattr(source, 'seek'):
+            source.seek(0)
+    try:
+        import av
+    except ImportError:
+        raise AudioDecodeError("Not a PCM WAV file and PyAV is not installed to decode it")
+    try:
+        return _decode_av(av, source)
+    except av.AVError as e:
+        raise AudioDecodeError(f"Could not decode audio: {e}") from e
+
+
+def _decode_wav(source) -> Tuple[np.ndarray, int]:
+    with wave.open(source, 'rb') as wav:
+        width = wav.getsampwidth()
+        if width not in (1, 2, 4):
+            raise AudioDecodeError(f"Unsupported WAV sample width: {width * 8} bits")
+        dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=dtype)
+        return pcm.reshape(-1, wav.getnchannels()), wav.getframerate()
+
+
+def _decode_av(av, source) -> Tuple[np.ndarray, int]:
+    """Decoded frames at the stream's own rate and layout (no av resampler)"""
+    with av.open(source, mode='r', metadata_errors='ignore') as container:
+        if not container.streams.audio:
+            raise AudioDecodeError("No audio stream in upload")
+        stream = container.streams.audio[0]
+        parts, rate = [], stream.codec_context.sample_rate
+        for frame in container.decode(stream):
+            samples = frame.to_ndarray()
+            channels = len(frame.layout.channels)
+            # Planar formats come as (channels, samples), packed as (1, samples * channels)
+            parts.append(samples.T if frame.format.is_planar else samples.reshape(-1, channels))
+            rate = frame.sample_rate
+    if not parts:
+        raise AudioDecodeError("Upload contains no audio frames")
+    return np.concatenate(parts), rate
+
+
+def design_filter(up: int, down: int, half_taps: int = 16,
+                  beta: float = 8.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Kaiser-windowed sinc low-pass for resampling by up/down
+
+    Returns the (up, taps) polyphase bank and, per output phase, the first
+    input sample its window reads (in the zero-padded work buffer).
+    """
+    factor = max(up, down)
+    taps = 2 * half_taps * factor + 1
+    cutoff = 0.95 / (2 * factor)  # Cycles per upsampled sample, just under the lower Nyquist
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(taps, beta) * up
+    per_phase = -(-taps // up)
+    h = np.concatenate((h, np.zeros(per_phase * up - taps)))
+
+    # Output n reads upsampled position t = n * down + delay; its phase repeats every `up` outputs
+    delay = (taps - 1) // 2
+    bank = np.empty((up, per_phase), dtype=np.float32)
+    offsets = np.empty(up, dtype=np.int64)
+    for p in range(up):
+        t = p * down + delay
+        phase = t % up
+        # Reversed so a forward strided window over the input lines up with the taps
+        bank[p] = h[phase + np.arange(per_phase - 1, -1, -1) * up]
+        offsets[p] = t // up
+    return bank, offsets
+
+
+class _Buffers:
+    """Work arrays of one turn, grown on demand and reused through the pool"""
+
+    def __init__(self):
+        self.mono = np.zeros(0, dtype=np.float32)
+        self.out = np.zeros(0, dtype=np.float32)
+
+
+class AudioPreprocessor:
+    """Any-rate, any-channel PCM -> normalized 16 kHz mono float32 for Whisper"""
+
+    def __init__(
+        self,
+        remove_dc: bool = True,
+        normalize: Optional[str] = 'peak',
+        peak_level: float = 0.9,
+        rms_dbfs: float = -20.0,
+        max_gain_db: float = 30.0,
+        half_taps: int = 16,
+        buffer_pool: int = 4,
+    ):
+        if normalize not in (None, 'peak', 'rms'):
+            raise ValueError(f"normalize must be 'peak', 'rms' or null, not {normalize!r}")
+        self.remove_dc = remove_dc
+        self.normalize = normalize
+        self.peak_level = peak_level
+        self.rms_level = 10 ** (rms_dbfs / 20)
+        self.max_gain = 10 ** (max_gain_db / 20)
+        self.half_taps = half_taps
+        self._filters: Dict[int, Tuple[int, int, np.ndarray, np.ndarray]] = {}
+        self.buffer_pool = buffer_pool
+        self._free: list = []  # Idle buffer pairs, at most buffer_pool
+        self._lock = threading.Lock()
+        self._stats = {'clips': 0, 'audio_seconds': 0.0, 'cpu_seconds': 0.0, 'rates': {},
+                       'allocations': 0}
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "AudioPreprocessor":
+        """Build from the `audio_preprocessing` section of config.yaml"""
+        config = config or {}
+        return cls(
+            remove_dc=config.get('remove_dc', True),
+            normalize=config.get('normalize', 'peak'),
+            peak_level=config.get('peak_level', 0.9),
+            rms_dbfs=config.get('rms_dbfs', -20.0),
+            max_gain_db=config.get('max_gain_db', 30.0),
+            half_taps=config.get('half_taps', 16),
+            buffer_pool=config.get('buffer_pool', 4),
+        )
+
+    def _filter(self, rate: int):
+        with self._lock:
+            cached = self._filters.get(rate)
+            if cached is None:
+                g = gcd(SAMPLE_RATE, rate)
+                up, down = SAMPLE_RATE // g, rate // g
+                bank, offsets = design_filter(up, down, self.half_taps)
+                cached = self._filters[rate] = (up, down, bank, offsets)
+                logger.debug("Designed %d/%d polyphase filter (%d taps per phase) for %d Hz",
+                             up, down, bank.shape[1], rate)
+            return cached
+
+    @contextmanager
+    def buffers(self):
+        """Check out a buffer pair for one turn; results stay valid inside the block"""
+        with self._lock:
+            buffers = self._free.pop() if self._free else _Buffers()
+        try:
+            yield buffers
+        finally:
+            with self._lock:
+                if len(self._free) < self.buffer_pool:
+                    self._free.append(buffers)
+
+    def _grow(self, buffers: _Buffers, name: str, size: int) -> np.ndarray:
+        current = getattr(buffers, name)
+        if len(current) < size:
+            # Headroom so slightly longer clips do not reallocate every time
+            current = np.zeros(int(size * 1.25), dtype=np.float32)
+            setattr(buffers, name, current)
+            with self._lock:
+                self._stats['allocations'] += 1
+        return current
+
+    def process(self, pcm: np.ndarray, rate: int, token=None,
+                buffers: Optional[_Buffers] = None) -> np.ndarray:
+        """16 kHz mono float32 from (frames,) or (frames, channels) PCM
+
+        With buffers from buffers() the work reuses them and the result is
+        a view into them, valid until they are returned. Without, fresh
+        arrays are allocated and the result is the caller's to keep.
+        """
+        start = time.process_time()
+        if pcm.ndim == 1:
+            pcm = pcm[:, None]
+        frames, channels = pcm.shape
+        if buffers is None:
+            buffers = _Buffers()
+        resample = rate != SAMPLE_RATE
+        if resample:
+            up, down, bank, offsets = self._filter(rate)
+            taps = bank.shape[1]
+            pad = taps - 1
+            n_groups = -(-frames // down)
+            length = max(frames + 2 * pad, int(offsets[-1]) + (n_groups - 1) * down + taps)
+        else:
+            pad, length = 0, frames
+
+        # Downmix into the middle of the work buffer; the zeroed edges feed the filter
+        work = self._grow(buffers, 'mono', length)
+        mono = work[pad:pad + frames]
+        work[:pad] = 0
+        work[pad + frames:length] = 0
+        np.copyto(mono, pcm[:, 0], casting='unsafe')
+        for c in range(1, channels):
+            np.add(mono, pcm[:, c], out=mono, casting='unsafe')
+        if pcm.dtype == np.uint8:
+            mono -= 128.0 * channels
+        np.multiply(mono, _SCALE.get(pcm.dtype, 1.0) / channels, out=mono)
+        if self.remove_dc and frames:
+            mono -= mono.mean()
+
+        if token is not None:
+            token.check()
+
+        if resample:
+            n_out = -(-frames * up // down)
+            grid = self._grow(buffers, 'out', n_groups * up)[:n_groups * up].reshape(n_groups, up)
+            step = work.strides[0]
+            for p in range(up):
+                # Rows: successive outputs of this phase, `down` input samples apart
+                window = as_strided(work[offsets[p]:], shape=(n_groups, taps), strides=(down * step, step))
+                np.matmul(window, bank[p], out=grid[:, p])
+            out = grid.reshape(-1)[:n_out]
+        else:
+            out = self._grow(buffers, 'out', frames)[:frames]
+            np.copyto(out, mono)
+
+        self._normalize(out)
+        elapsed = time.process_time() - start
+        with self._lock:
+            stats = self._stats
+            stats['clips'] += 1
+            stats['audio_seconds'] += frames / rate
+            stats['cpu_seconds'] += elapsed
+            stats['rates'][rate] = stats['rates'].get(rate, 0) + 1
+        return out
+
+    def _normalize(self, audio: np.ndarray):
+        if not len(audio) or self.normalize is None:
+            return
+        if self.normalize == 'peak':
+            level = float(np.max(np.abs(audio)))
+            target = self.peak_level
+        else:
+            level = float(np.sqrt(np.dot(audio, audio) / len(audio)))
+            target = self.rms_level
+        if level <= 0:
+            return
+        audio *= min(target / level, self.max_gain)
+        if self.normalize == 'rms':
+            np.clip(audio, -1.0, 1.0, out=audio)
+
+    def load(self, source, token=None, buffers: Optional[_Buffers] = None) -> np.ndarray:
+        """Decode an upload (path, bytes or file object) and preprocess it"""
+        pcm, rate = decode_pcm(source)
+        return self.process(pcm, rate, token, buffers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            rates = dict(s['rates'])
+        return {
+            'clips': s['clips'],
+            'audio_seconds': round(s['audio_seconds'], 1),
+            # Throughput: seconds of audio prepared per second of CPU time
+            'audio_seconds_per_cpu_second': round(s['audio_seconds'] / s['cpu_seconds'], 1) if s['cpu_seconds'] else None,
+            'input_rates': rates,
+            # Buffer growth: stays flat once the pool has seen the longest clips
+            'buffer_allocations': s['allocations'],
+            'idle_buffers': len(self._free),
+        }
+
+
+def bench(seconds: float = 30.0, repeats: int = 5):
+    """Audio-seconds per CPU-second for common capture formats"""
+    rng = np.random.default_rng(0)
+    preprocessor = AudioPreprocessor()
+    print(f"{seconds:.0f}s clips, best of {repeats}\n")
+    print(f"{'input':<18} {'cpu ms':>8} {'audio-s/cpu-s':>14}")
+    for rate in (8000, 16000, 22050, 44100, 48000):
+        for channels in (1, 2):
+            t = np.arange(int(seconds * rate)) / rate
+            tone = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(len(t))
+            pcm = (np.repeat(tone[:, None], channels, axis=1) * 32767).astype(np.int16)
+            best = None
+            with preprocessor.buffers() as buffers:
+                preprocessor.process(pcm, rate, buffers=buffers)  # Filter design and buffer growth
+                for _ in range(repeats):
+                    start = time.process_time()
+                    preprocessor.process(pcm, rate, buffers=buffers)
+                    elapsed = time.process_time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+            label = f"{rate} Hz x{channels}"
+            print(f"{label:<18} {best * 1000:>8.1f} {seconds / best if best else float('inf'):>14.0f}")
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Audio preprocessing benchmark")
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--seconds', type=float, default=30.0, help="Clip length")
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args(argv)
+    bench(args.seconds, args.repeats)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Shared-memory audio ring buffer between ingestion and ASR processes
+Passing NumPy arrays through a multiprocessing.Queue pickles them: every
+chunk is copied into the pipe and again out of it, and both sides allocate.
+AudioRing preallocates a fixed pool of frame slots in one SharedMemory
+block. The producer writes into a free slot in place, and ASR workers read
+it through a NumPy view by slot index (nothing is copied or allocated per
+chunk). When every slot is in use the producer blocks (or gets RingFull),
+so a slow ASR side pushes back on ingestion instead of growing a queue.
+Slots are read in the order they were written; a slot freed out of order
+(several ASR readers) goes back on a shared free list.
+
+Usage:
+    python audio_ring.py bench [--seconds 120] [--chunk-ms 100] [--consumers 2]
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# Slot metadata columns
+_LENGTH, _STREAM, _SEQ = 0, 1, 2
+# Counters: head/tail of the free and ready slot queues, then totals
+_FREE_HEAD, _FREE_TAIL, _READY_HEAD, _READY_TAIL, _WRITES, _FULL_WAITS = range(6)
+_COUNTERS = 6
+
+
+class RingFull(Exception):
+    """No free slot within the timeout: ASR is behind ingestion"""
+
+
+class RingEmpty(Exception):
+    """No filled slot within the timeout"""
+
+
+class AudioRing:
+    """Fixed pool of shared-memory frame slots, written and read in order"""
+
+    def __init__(self, slots: int = 64, slot_frames: int = SAMPLE_RATE, dtype='float32',
+                 ctx=None, _attach: Optional[dict] = None):
+        self.slots = slots
+        self.slot_frames = slot_frames
+        self.dtype = np.dtype(dtype)
+        if _attach is None:
+            ctx = ctx or multiprocessing.get_context()
+            self._data = shared_memory.SharedMemory(create=True, size=slots * slot_frames * self.dtype.itemsize)
+            self._meta = shared_memory.SharedMemory(create=True, size=(slots * 5 + _COUNTERS) * 8)
+            self._free = ctx.Semaphore(slots)
+            self._ready = ctx.Semaphore(0)
+            self._lock = ctx.Lock()
+            self._owner = True
+        else:
+            self._data = _attach['data']
+            self._meta = _attach['meta']
+            self._free, self._ready, self._lock = _attach['sync']
+            self._owner = False
+        self._map()
+        if self._owner:
+            self._slot_meta.fill(0)
+            self._free_q[:] = np.arange(self.slots)
+            self._ready_q.fill(0)
+            self._cursors.fill(0)
+            self._cursors[_FREE_TAIL] = self.slots
+
+    def _map(self):
+        # Views made once; reads and writes hand these out instead of new arrays
+        frames = np.ndarray((self.slots, self.slot_frames), dtype=self.dtype, buffer=self._data.buf)
+        n = self.slots
+        meta = np.ndarray((n * 5 + _COUNTERS,), dtype=np.int64, buffer=self._meta.buf)
+        self._frames = frames
+        self._slot_meta = meta[:n * 3].reshape(n, 3)
+        self._free_q = meta[n * 3:n * 4]    # Slot indices, circular
+        self._ready_q = meta[n * 4:n * 5]
+        self._cursors = meta[n * 5:]
+        self._views = [frames[i] for i in range(self.slots)]
+
+    def __getstate__(self):
+        # Only valid while starting a child process (the semaphores require it)
+        return {
+            'slots': self.slots,
+            'slot_frames': self.slot_frames,
+            'dtype': self.dtype.str,
+            'data': self._data.name,
+            'meta': self._meta.name,
+            'sync': (self._free, self._ready, self._lock),
+        }
+
+    def __setstate__(self, state):
+        # Children share the parent's resource tracker; only the creator unlinks
+        data = shared_memory.SharedMemory(name=state['data'])
+        meta = shared_memory.SharedMemory(name=state['meta'])
+        self.__init__(state['slots'], state['slot_frames'], state['dtype'],
+                      _attach={'data': data, 'meta': meta, 'sync': state['sync']})
+
+    # Producer side
+
+    def acquire_write(self, timeout: Optional[float] = None) -> int:
+        """Claim the next free slot; blocks while all slots are in use"""
+        if not self._free.acquire(block=False):
+            with self._lock:
+                self._cursors[_FULL_WAITS] += 1
+            if not self._free.acquire(timeout=timeout):
+                raise RingFull(f"All {self.slots} slots in use")
+        with self._lock:
+            slot = int(self._free_q[self._cursors[_FREE_HEAD] % self.slots])
+            self._cursors[_FREE_HEAD] += 1
+        return slot
+
+    def commit(self, slot: int, length: int, stream: int = 0, seq: int = 0):
+        """Publish a written slot to the readers"""
+        meta = self._slot_meta[slot]
+        meta[_LENGTH] = length
+        meta[_STREAM] = stream
+        meta[_SEQ] = seq
+        with self._lock:
+            self._ready_q[self._cursors[_READY_TAIL] % self.slots] = slot
+            self._cursors[_READY_TAIL] += 1
+            self._cursors[_WRITES] += 1
+        self._ready.release()
+
+    def write(self, frames: np.ndarray, stream: int = 0, seq: int = 0,
+              timeout: Optional[float] = None) -> int:
+        """Copy frames into a slot (int16 PCM is scaled into float32 slots in the same pass)"""
+        length = len(frames)
+        if length > self.slot_frames:
+            raise ValueError(f"{length} frames do not fit a {self.slot_frames}-frame slot")
+        slot = self.acquire_write(timeout)
+        target = self._views[slot][:length]
+        if frames.dtype == np.int16 and self.dtype.kind == 'f':
+            np.multiply(frames, 1.0 / 32768.0, out=target, casting='unsafe')
+        else:
+            np.copyto(target, frames, casting='unsafe')
+        self.commit(slot, length, stream, seq)
+        return slot
+
+    # Consumer side
+
+    def acquire_read(self, timeout: Optional[float] = None) -> Tuple[int, int, int, int]:
+        """Next filled slot in write order: (slot, length, stream, seq)"""
+        if not self._ready.acquire(timeout=timeout):
+            raise RingEmpty("No audio within the timeout")
+        with self._lock:
+            slot = int(self._ready_q[self._cursors[_READY_HEAD] % self.slots])
+            self._cursors[_READY_HEAD] += 1
+        meta = self._slot_meta[slot]
+        return slot, int(meta[_LENGTH]), int(meta[_STREAM]), int(meta[_SEQ])
+
+    def view(self, slot: int) -> np.ndarray:
+        """The slot's full preallocated array (valid until release)"""
+        return self._views[slot]
+
+    def release(self, slot: int):
+        """Hand a read slot back to the producer"""
+        with self._lock:
+            self._free_q[self._cursors[_FREE_TAIL] % self.slots] = slot
+            self._cursors[_FREE_TAIL] += 1
+        self._free.release()
+
+    @contextmanager
+    def reading(self, timeout: Optional[float] = None):
+        """Yields (frames view, stream, seq) and frees the slot afterwards"""
+        slot, length, stream, seq = self.acquire_read(timeout)
+        try:
+            yield self._views[slot][:length], stream, seq
+        finally:
+            self.release(slot)
+
+    def stats(self) -> dict:
+        with self._lock:
+            writes = int(self._cursors[_WRITES])
+            return {
+                'slots': self.slots,
+                'slot_seconds': round(self.slot_frames / SAMPLE_RATE, 3),
+                'writes': writes,
+                'reads': int(self._cursors[_READY_HEAD]),
+                # Claimed by the producer or a reader, or waiting to be read
+                'in_use': int(self.slots - (self._cursors[_FREE_TAIL] - self._cursors[_FREE_HEAD])),
+                # Writes that found every slot busy and had to wait (backpressure)
+                'full_waits': int(self._cursors[_FULL_WAITS]),
+            }
+
+    def close(self):
+        """Detach; the creating process also frees the shared memory"""
+        self._views = []
+        self._frames = self._slot_meta = self._cursors = None
+        self._data.close()
+        self._meta.close()
+        if self._owner:
+            self._data.unlink()
+            self._meta.unlink()
+
+
+def _ring_consumer(ring: AudioRing, ready, totals):
+    """Bench reader: touch every chunk as an ASR worker would"""
+    ready.wait()
+    chunks, checksum = 0, 0.0
+    while True:
+        with ring.reading() as (frames, _stream, _seq):
+            if not len(frames):
+                break  # End of stream
+            checksum += float(frames[0])
+            chunks += 1
+    totals.put((chunks, checksum))
+
+
+def _queue_consumer(queue, ready, totals):
+    ready.wait()
+    chunks, checksum = 0, 0.0
+    while True:
+        frames = queue.get()
+        if frames is None:
+            break
+        checksum += float(frames[0])
+        chunks += 1
+    totals.put((chunks, checksum))
+
+
+def _run(ctx, target, channel, consumers: int, produce) -> Tuple[int, float]:
+    """Start consumers, time produce() until every chunk has been received"""
+    ready, totals = ctx.Barrier(consumers + 1), ctx.Queue()
+    workers = [ctx.Process(target=target, args=(channel, ready, totals)) for _ in range(consumers)]
+    for w in workers:
+        w.start()
+    ready.wait()  # Consumers are up: process start-up is not timed
+    start = time.perf_counter()
+    produce()
+    received = sum(totals.get()[0] for _ in workers)
+    elapsed = time.perf_counter() - start
+    for w in workers:
+        w.join()
+    return received, elapsed
+
+
+def bench(seconds: float = 120.0, chunk_ms: int = 100, consumers: int = 2, slots: int = 64):
+    """Ring vs. multiprocessing.Queue for the same int16 PCM stream"""
+    chunk = SAMPLE_RATE * chunk_ms // 1000
+    count = int(seconds * 1000 // chunk_ms)
+    pcm = (np.random.default_rng(0).standard_normal(chunk) * 3000).astype(np.int16)
+    end = pcm[:0]
+    ctx = multiprocessing.get_context('spawn')
+
+    ring = AudioRing(slots=slots, slot_frames=chunk, ctx=ctx)
+
+    def produce_ring():
+        for i in range(count):
+            ring.write(pcm, seq=i)
+        for _ in range(consumers):
+            ring.write(end)
+
+    received, ring_elapsed = _run(ctx, _ring_consumer, ring, consumers, produce_ring)
+    stats = ring.stats()
+    ring.close()
+
+    queue = ctx.Queue(maxsize=slots)
+
+    def produce_queue():
+        for _ in range(count):
+            queue.put(pcm.astype(np.float32) / 32768.0)  # What the ingestion side does today
+        for _ in range(consumers):
+            queue.put(None)
+
+    queue_received, queue_elapsed = _run(ctx, _queue_consumer, queue, consumers, produce_queue)
+
+    audio = count * chunk_ms / 1000
+    print(f"{count} chunks of {chunk_ms} ms ({audio:.0f}s audio), {consumers} consumers, {slots} slots\n")
+    print(f"{'path':<22} {'received':>9} {'seconds':>8} {'chunks/s':>10} {'audio-s/s':>10}")
+    for name, got, elapsed in (("shared-memory ring", received, ring_elapsed),
+                               ("multiprocessing.Queue", queue_received, queue_elapsed)):
+        print(f"{name:<22} {got:>9} {elapsed:>8.3f} {count / elapsed:>10.0f} {audio / elapsed:>10.0f}")
+    print(f"\nring: {stats['full_waits']} writes waited for a free slot (backpressure)")
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Shared-memory audio ring benchmark")
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--seconds', type=float, default=120.0, help="Audio to stream")
+    parser.add_argument('--chunk-ms', type=int, default=100)
+    parser.add_argument('--consumers', type=int, default=2)
+    parser.add_argument('--slots', type=int, default=64)
+    args = parser.parse_args(argv)
+    bench(args.seconds, args.chunk_ms, args.consumers, args.slots)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Whisper autotuning
+Benchmarks compute types, thread counts and model sizes on this machine
+with the fixture clips (synthesized with Piper from fixtures/phrases.jsonl
+on first run, or your own recordings). For every model the fastest
+configuration whose p95 real-time factor meets the target is kept; the
+largest model that has one wins and is written to config/config.yaml
+(whisper device / compute_type / cpu_threads and the default route model).
+
+Usage:
+    python autotune.py                              # benchmark and print the choice
+    python autotune.py --write                      # ...and update config.yaml
+    python autotune.py --rtf-target 0.5 --models tiny.en,base.en --audio-dir recordings/
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from launcher import CONFIG_PATH, load_config
+from resilience import percentile
+from resource_planner import read_topology
+from transcriber import Transcriber
+from whisper_router import SAMPLE_RATE, load_corpus, model_loader
+
+logger = logging.getLogger('VoiceAssistant.autotune')
+
+PROJECT_DIR = Path(__file__).parent
+FIXTURES_DIR = PROJECT_DIR / "fixtures"
+ENV_PATH = PROJECT_DIR / ".env"
+
+DEFAULT_MODELS = ("tiny.en", "base.en", "small.en")
+
+# Fastest first; only those CTranslate2 supports on the device are tried
+COMPUTE_TYPES = {
+    'cpu': ('int8', 'int8_float32', 'int16', 'float32'),
+    'cuda': ('int8_float16', 'float16', 'int8', 'float32'),
+}
+
+# .env entries that would override what is written to config.yaml
+ENV_OVERRIDES = ("WHISPER_MODEL", "WHISPER_DEVICE", "WHISPER_COMPUTE_TYPE")
+
+
+def synthesize_fixtures(out_dir: Path) -> bool:
+    """Render fixtures/phrases.jsonl to WAV with Piper; writes manifest.jsonl"""
+    piper = shutil.which("piper") or str(PROJECT_DIR / "bin" / "piper")
+    voice = os.getenv("PIPER_MODEL_PATH")
+    if not os.path.exists(piper) or not voice or not os.path.exists(voice):
+        logger.error("Piper or PIPER_MODEL_PATH not found; pass --audio-dir with recordings instead")
+        return False
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for line in (FIXTURES_DIR / "phrases.jsonl").read_text().splitlines():
+        if not line.strip():
+            continue
+        phrase = json.loads(line)
+        wav = out_dir / f"{phrase['name']}.wav"
+        subprocess.run([piper, "--model", voice, "--output_file", str(wav)],
+                       input=phrase['text'].encode(), check=True, capture_output=True)
+        manifest.append({'audio': wav.name, 'text': phrase['text'],
+                         'awaiting_confirmation': phrase.get('awaiting_confirmation', False)})
+    (out_dir / "manifest.jsonl").write_text("".join(json.dumps(m) + "\n" for m in manifest))
+    logger.info("Synthesized %d fixture clips into %s", len(manifest), out_dir)
+    return True
+
+
+def load_clips(audio_dir: Path) -> List[Tuple[str, object, float]]:
+    """(name, 16 kHz samples, seconds) for the manifest or every audio file in the folder"""
+    from faster_whisper import decode_audio
+
+    entries = load_corpus(str(audio_dir))
+    paths = [e['audio'] for e in entries] or sorted(
+        str(p) for p in audio_dir.iterdir() if p.suffix.lower() in {'.wav', '.flac', '.mp3', '.ogg', '.webm'}
+    )
+    clips = []
+    for path in paths:
+        samples = decode_audio(path, sampling_rate=SAMPLE_RATE)
+        clips.append((Path(path).stem, samples, len(samples) / SAMPLE_RATE))
+    return clips
+
+
+def detect_devices() -> Dict[str, List[str]]:
+    """Devices on this machine and the candidate compute types each supports"""
+    import ctranslate2
+
+    devices = {'cpu': ctranslate2.get_supported_compute_types('cpu')}
+    try:
+        if ctranslate2.get_cuda_device_count() > 0:
+            devices['cuda'] = ctranslate2.get_supported_compute_types('cuda')
+    except Exception:
+        pass
+    return {device: [c for c in COMPUTE_TYPES[device] if c in supported]
+            for device, supported in devices.items()}
+
+
+def thread_candidates(cores: int) -> List[int]:
+    """Powers of two up to the core count, plus the core count itself"""
+    counts = {cores}
+    n = 1
+    while n < cores:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def measure(model_name: str, device: str, compute_type: str, cpu_threads: int,
+            num_workers: int, clips, whisper_config: dict, rounds: int = 2) -> Optional[dict]:
+    """Per-clip RTF and throughput with every model replica busy; None if the model won't load"""
+    start = time.perf_counter()
+    try:
+        model = model_loader(cpu_threads, num_workers, device=device, compute_type=compute_type)(model_name)
+    except Exception as e:
+        logger.warning("Skipping %s %s/%s: %s", model_name, device, compute_type, e)
+        return None
+    load_seconds = time.perf_counter() - start
+    transcriber = Transcriber.from_config(model, whisper_config)
+
+    def run(clip):
+        _name, samples, seconds = clip
+        t = time.perf_counter()
+        transcriber.transcribe(samples, fallback_beam_size=0)  # First pass only
+        return (time.perf_counter() - t) / seconds
+
+    run(clips[0])  # Warm-up
+    jobs = clips * max(rounds, -(-2 * num_workers // len(clips)))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        rtfs = list(pool.map(run, jobs))
+    elapsed = time.perf_counter() - start
+    del transcriber, model
+    return {
+        'model': model_name,
+        'device': device,
+        'compute_type': compute_type,
+        'cpu_threads': cpu_threads,
+        'num_workers': num_workers,
+        'load_seconds': round(load_seconds, 2),
+        'rtf_p50': round(percentile(rtfs, 50), 4),
+        'rtf_p95': round(percentile(rtfs, 95), 4),
+        # Audio seconds transcribed per wall-clock second
+        'throughput': round(sum(clip[2] for clip in jobs) / elapsed, 2),
+    }
+
+
+def autotune(clips, models: List[str], rtf_target: float, whisper_config: dict,
+             devices: Optional[Dict[str, List[str]]] = None) -> Tuple[Optional[dict], List[dict]]:
+    """Benchmark every combination; returns (choice, all results)"""
+    devices = devices or detect_devices()
+    cores = len(read_topology())
+    results = []
+    for model_name in models:
+        for device, compute_types in devices.items():
+            for compute_type in compute_types:
+                # On CPU the replicas fill the cores, as num_workers: auto does
+                threads = thread_candidates(cores) if device == 'cpu' else [cores]
+                for cpu_threads in threads:
+                    num_workers = max(1, cores // cpu_threads) if device == 'cpu' else 1
+                    r = measure(model_name, device, compute_type, cpu_threads, num_workers,
+                                clips, whisper_config)
+                    if r is None:
+                        break  # Same model/compute type fails at every thread count
+                    r['meets_target'] = r['rtf_p95'] <= rtf_target
+                    results.append(r)
+                    print(f"  {model_name:<10} {device:<5} {compute_type:<13} threads={cpu_threads:<3} "
+                          f"workers={num_workers:<3} p95 RTF={r['rtf_p95']:.3f} "
+                          f"{r['throughput']:>7.1f} audio-s/s {'ok' if r['meets_target'] else ''}")
+
+    choice = None
+    for model_name in models:  # Smallest to largest: the last one meeting the target wins
+        passing = [r for r in results if r['model'] == model_name and r['meets_target']]
+        if passing:
+            choice = max(passing, key=lambda r: r['throughput'])
+    if choice is None and results:
+        choice = min(results, key=lambda r: r['rtf_p95'])
+        logger.warning("No configuration meets RTF %.2f; using the fastest (p95 RTF %.3f)",
+                       rtf_target, choice['rtf_p95'])
+    return choice, results
+
+
+_KEY_LINE = re.compile(r'^(\s*)([\w.\-]+):(.*)$')
+
+
+def _format(value) -> str:
+    if isinstance(value, str) and re.fullmatch(r'[\w.\-]+', value) and not re.fullmatch(r'[\d.]+', value):
+        return value
+    return json.dumps(value)
+
+
+def set_yaml_value(lines: List[str], keys: Tuple[str, ...], value) -> bool:
+    """Set a nested key in YAML text in place, keeping comments and layout
+
+    Replaces the value on an existing line (the trailing comment stays) or
+    inserts the key as the last child of its parent. False if the parent is missing.
+    """
+    stack: List[Tuple[int, str]] = []
+    parent_index = None
+    last_child = None
+    child_indent = None
+    for i, line in enumerate(lines):
+        match = _KEY_LINE.match(line)
+        if not match or line.lstrip().startswith('#'):
+            continue
+        indent, key, rest = len(match.group(1)), match.group(2), match.group(3)
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        path = tuple(k for _, k in stack) + (key,)
+        stack.append((indent, key))
+        if path == keys:
+            comment = re.search(r'\s+#.*$', rest)
+            new = f"{match.group(1)}{key}: {_format(value)}"
+            if comment:
+                width = len(line.rstrip('\n')) - len(comment.group(0))
+                new = new.ljust(width) + comment.group(0)
+            lines[i] = new + "\n"
+            return True
+        if path == keys[:-1]:
+            parent_index, last_child = i, i
+        elif parent_index is not None and path[:len(keys) - 1] == keys[:-1]:
+            last_child = i
+            if len(path) == len(keys):
+                child_indent = indent
+    if parent_index is None:
+        return False
+    if child_indent is None:
+        child_indent = len(_KEY_LINE.match(lines[parent_index]).group(1)) + 2
+    lines.insert(last_child + 1, f"{' ' * child_indent}{keys[-1]}: {_format(value)}\n")
+    return True
+
+
+def write_choice(choice: dict, config: dict, benchmarked: Dict[str, bool], path: Path = CONFIG_PATH):
+    """Write the chosen configuration into config.yaml"""
+    updates = {
+        ('whisper', 'device'): choice['device'],
+        ('whisper', 'compute_type'): choice['compute_type'],
+        ('whisper', 'cpu_threads'): choice['cpu_threads'],
+        ('whisper_routing', 'routes', 'default', 'model'): choice['model'],
+    }
+    # A dictation model that missed the target falls back to the chosen one
+    dictation = ((config.get('whisper_routing') or {}).get('routes') or {}).get('dictation')
+    if dictation and benchmarked.get(dictation.get('model')) is False:
+        updates[('whisper_routing', 'routes', 'dictation', 'model')] = choice['model']
+
+    lines = path.read_text().splitlines(keepends=True)
+    for keys, value in updates.items():
+        if not set_yaml_value(lines, keys, value):
+            logger.warning("No %s section in %s; skipped %s", keys[0], path, ".".join(keys))
+    path.write_text("".join(lines))
+    print(f"\nWrote {path}:")
+    for keys, value in updates.items():
+        print(f"  {'.'.join(keys)} = {value}")
+
+    # .env values win over config.yaml; comment ours out so the tuned ones apply
+    if ENV_PATH.exists():
+        env_lines = ENV_PATH.read_text().splitlines(keepends=True)
+        changed = False
+        for i, line in enumerate(env_lines):
+            if line.split('=', 1)[0].strip() in ENV_OVERRIDES:
+                env_lines[i] = "# " + line
+                changed = True
+        if changed:
+            ENV_PATH.write_text("".join(env_lines))
+            print(f"  commented out {', '.join(ENV_OVERRIDES)} in {ENV_PATH}")
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="Benchmark and pick Whisper settings for this machine")
+    parser.add_argument('--audio-dir', help="Clips to benchmark with (default: synthesized fixtures)")
+    parser.add_argument('--models', default=",".join(DEFAULT_MODELS),
+                        help="Comma-separated model sizes, smallest first")
+    parser.add_argument('--rtf-target', type=float, default=0.3,
+                        help="Maximum p95 decode seconds per audio second (default 0.3)")
+    parser.add_argument('--write', action='store_true', help="Update config/config.yaml")
+    parser.add_argument('--report', help="Write all results as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    load_dotenv(ENV_PATH)
+    config = load_config()
+
+    audio_dir = Path(args.audio_dir) if args.audio_dir else FIXTURES_DIR / "audio"
+    if not args.audio_dir and not (audio_dir / "manifest.jsonl").exists():
+        if not synthesize_fixtures(audio_dir):
+            return 1
+    clips = load_clips(audio_dir)
+    if not clips:
+        logger.error("No audio clips in %s", audio_dir)
+        return 1
+
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    print(f"{len(clips)} clips ({sum(c[2] for c in clips):.0f}s audio), "
+          f"{len(read_topology())} physical cores, target p95 RTF <= {args.rtf_target}\n")
+    choice, results = autotune(clips, models, args.rtf_target, config.get('whisper') or {})
+    if args.report:
+        Path(args.report).write_text(json.dumps({'choice': choice, 'results': results}, indent=2))
+    if choice is None:
+        logger.error("No model could be loaded")
+        return 1
+
+    print(f"\nChosen: {choice['model']} on {choice['device']} {choice['compute_type']}, "
+          f"cpu_threads={choice['cpu_threads']} (p95 RTF {choice['rtf_p95']:.3f}, "
+          f"{choice['throughput']:.1f} audio-s/s)")
+    if args.write:
+        benchmarked = {}
+        for r in results:
+            benchmarked[r['model']] = benchmarked.get(r['model'], False) or r['meets_target']
+        write_choice(choice, config, benchmarked)
+    else:
+        print("Run with --write to save it to config.yaml")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
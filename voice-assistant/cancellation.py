@@ -0,0 +1,292 @@
+"""
+Cancellation tokens for voice turns
+Each turn gets a fresh token. A barge-in (or a disconnect) cancels it, and
+every stage that can block checks the token or registers a callback that
+aborts its work: TTS processes are killed, preprocessing and Whisper stop
+between segments, upstream HTTP requests are shut down at the socket (see
+abortable_session). The handler is freed within one chunk instead of
+running the turn to the end.
+"""
+
+import asyncio
+import contextvars
+import logging
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('VoiceAssistant.cancellation')
+
+DEFAULT_HELPER_THREADS = 32
+
+# Helper threads for blocking calls a turn may stop waiting for (CancelToken.run)
+_helper_pool: Optional[ThreadPoolExecutor] = None
+_helper_threads = DEFAULT_HELPER_THREADS
+_helper_lock = threading.Lock()
+
+
+def configure_helpers(config: Optional[dict]):
+    """Size the helper pool from `server.helper_threads` (before first use)"""
+    global _helper_threads
+    _helper_threads = int((config or {}).get('helper_threads', DEFAULT_HELPER_THREADS))
+
+
+def submit(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """Run fn on a helper thread, in a copy of the caller's context"""
+    global _helper_pool
+    with _helper_lock:
+        if _helper_pool is None:
+            _helper_pool = ThreadPoolExecutor(max_workers=_helper_threads,
+                                              thread_name_prefix='cancellable')
+    return _helper_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class Cancelled(Exception):
+    """Raised inside a turn whose token was cancelled"""
+
+
+class CancelToken:
+    """Cancellation signal for one turn, shared by all of its stages"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: Dict[int, Callable[[], Any]] = {}
+        self._next_id = 0
+        self.reason: Optional[str] = None
+        self.cancelled_at: Optional[float] = None  # time.perf_counter()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "interrupt") -> bool:
+        """Cancel the turn and run abort callbacks; False if already cancelled"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self.cancelled_at = time.perf_counter()
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug("Cancel callback failed: %s", e)
+        return True
+
+    def check(self):
+        """Raise Cancelled if the turn was cancelled"""
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], Any]):
+        """Run callback if the token is cancelled while inside the block"""
+        with self._lock:
+            if not self._event.is_set():
+                key = self._next_id
+                self._next_id += 1
+                self._callbacks[key] = callback
+                registered = True
+            else:
+                registered = False
+        if not registered:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if registered:
+                    self._callbacks.pop(key, None)
+
+    def sleep(self, seconds: float):
+        """time.sleep that raises Cancelled as soon as the token is cancelled"""
+        if self._event.wait(seconds):
+            raise Cancelled(self.reason)
+
+    def wait(self, future: Future):
+        """Result of future, or Cancelled as soon as the token is cancelled"""
+        done = threading.Event()
+        future.add_done_callback(lambda _: done.set())
+        with self.on_cancel(done.set):
+            done.wait()
+        if future.done():
+            return future.result()
+        raise Cancelled(self.reason)
+
+    def run(self, fn: Callable[..., Any], *args, cleanup: Optional[Callable[[Any], Any]] = None, **kwargs):
+        """Call a blocking fn in a helper thread and stop waiting on cancel
+
+        fn keeps running to completion in the background (and holds its
+        helper thread); cleanup(result) is then called on whatever it
+        returns. Prefer making fn itself abortable (abortable_session).
+        """
+        self.check()
+        future = submit(fn, *args, **kwargs)
+        try:
+            return self.wait(future)
+        except Cancelled:
+            if cleanup is not None:
+                def orphan_done(f):
+                    if f.exception() is None:
+                        try:
+                            cleanup(f.result())
+                        except Exception as e:
+                            logger.debug("Cleanup after cancel failed: %s", e)
+                future.add_done_callback(orphan_done)
+            raise
+
+    async def arun(self, coro):
+        """Await coro, cancelling its task (and any request in it) on cancel"""
+        self.check()
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(coro)
+        with self.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel)):
+            try:
+                return await task
+            except asyncio.CancelledError:
+                if self.cancelled:
+                    raise Cancelled(self.reason)
+                raise
+
+
+def run_process(cmd: list, token: Optional[CancelToken] = None, input=None,
+                check: bool = True, **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run that kills the process when the token is cancelled"""
+    if token is None:
+        return subprocess.run(cmd, input=input, check=check, capture_output=True, **kwargs)
+    token.check()
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **kwargs,
+    )
+    with token.on_cancel(proc.kill):
+        stdout, stderr = proc.communicate(input)
+    token.check()
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def abort_response(response):
+    """Shut down the socket under a streaming `requests` response
+
+    A read blocked in another thread returns immediately and the server
+    (Ollama) sees the disconnect and stops generating.
+    """
+    raw = getattr(response, 'raw', None)
+    sock = getattr(getattr(raw, '_connection', None), 'sock', None)
+    if sock is None:
+        fp = getattr(getattr(raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    if sock is not None:
+        _shutdown(sock)
+
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class _AbortableAdapter(HTTPAdapter):
+    """Reports every socket its connection pools open"""
+
+    def __init__(self, on_connect: Callable[[socket.socket], None], **kwargs):
+        self._on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_connect = self._on_connect
+
+        def watched(pool_cls):
+            class Connection(pool_cls.ConnectionCls):
+                def connect(self):
+                    super().connect()
+                    on_connect(self.sock)
+            return type(pool_cls.__name__, (pool_cls,), {'ConnectionCls': Connection})
+
+        manager = self.poolmanager
+        manager.pool_classes_by_scheme = {
+            scheme: watched(cls) for scheme, cls in manager.pool_classes_by_scheme.items()
+        }
+
+
+@contextmanager
+def abortable_session(token: Optional[CancelToken]):
+    """requests.Session whose sockets are shut down when the token is cancelled
+
+    Unlike CancelToken.run, the blocking call itself is aborted: a request
+    waiting for headers or reading a stream fails at once, the server sees
+    the disconnect, and no thread is left behind on work nobody waits for.
+    The caller sees a requests.ConnectionError; check the token after it.
+    """
+    session = requests.Session()
+    if token is None:
+        with session:
+            yield session
+        return
+
+    token.check()
+    sockets = []
+    lock = threading.Lock()
+
+    def on_connect(sock):
+        with lock:
+            sockets.append(sock)
+        if token.cancelled:
+            _shutdown(sock)
+
+    def abort():
+        with lock:
+            opened = list(sockets)
+        for sock in opened:
+            _shutdown(sock)
+
+    adapter = _AbortableAdapter(on_connect)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    with session, token.on_cancel(abort):
+        yield session
+
+
+class TokenRegistry:
+    """Tokens of in-flight turns by client-supplied ID (for HTTP interrupt endpoints)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, CancelToken] = {}
+
+    @contextmanager
+    def turn(self, turn_id: Optional[str]):
+        token = CancelToken()
+        if turn_id:
+            with self._lock:
+                self._tokens[turn_id] = token
+        try:
+            yield token
+        finally:
+            if turn_id:
+                with self._lock:
+                    if self._tokens.get(turn_id) is token:
+                        del self._tokens[turn_id]
+
+    def cancel(self, turn_id: str, reason: str = "interrupt") -> bool:
+        with self._lock:
+            token = self._tokens.get(turn_id)
+        return token.cancel(reason) if token else False
@@ -0,0 +1,234 @@
+"""
+Bounded conversation history for voice sessions
+Ring buffer of compact turns with token-budgeted windowing
+"""
+
+import sys
+import time
+from collections import deque
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (~4 chars per token, at least 1 per word)"""
+    if not text:
+        return 0
+    return max(len(text.split()), (len(text) + 3) // 4)
+
+
+class HistoryTurn:
+    """Single conversation turn stored without a per-instance __dict__"""
+
+    __slots__ = ('role', 'content', 'timestamp', 'tokens')
+
+    def __init__(self, role: str, content: str, timestamp: float, tokens: int):
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp
+        self.tokens = tokens
+
+    def as_dict(self) -> dict:
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+
+def summarize_turns(turns: List[HistoryTurn], max_tokens: int) -> str:
+    """Extractive summary: first sentence of each evicted turn, newest last"""
+    parts = []
+    for turn in turns:
+        if turn.role == 'summary':
+            parts.append(turn.content)
+            continue
+        first = turn.content.strip().split('. ')[0].rstrip('.')
+        if first:
+            parts.append(f"{turn.role}: {first}")
+    summary = "; ".join(parts)
+    max_chars = max_tokens * 4
+    if len(summary) > max_chars:
+        # Keep the most recent part of the summary
+        summary = "..." + summary[-(max_chars - 3):]
+    return summary
+
+
+class ConversationHistory:
+    """Ring buffer of turns bounded by turn count and token budget"""
+
+    def __init__(
+        self,
+        max_turns: int = 20,
+        max_tokens: int = 1024,
+        summarize_evicted: bool = True,
+        summary_max_tokens: int = 120,
+        summarizer: Optional[Callable[[List[HistoryTurn], int], str]] = None,
+    ):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summarize_evicted = summarize_evicted
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer or summarize_turns
+        self.summary = ""
+        self.evicted_count = 0
+        self.total_tokens = 0
+        self.version = 0  # Incremented on every append
+        self.epoch = 0    # Incremented on clear()
+        self._turns: Deque[HistoryTurn] = deque()
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "ConversationHistory":
+        """Build from the `history` section of config.yaml"""
+        config = config or {}
+        return cls(
+            max_turns=config.get('max_turns', 20),
+            max_tokens=config.get('max_tokens', 1024),
+            summarize_evicted=config.get('summarize_evicted', True),
+            summary_max_tokens=config.get('summary_max_tokens', 120),
+        )
+
+    def append(self, role: str, content: str, timestamp: Optional[float] = None) -> HistoryTurn:
+        """Add a turn, evicting the oldest turns past the turn/token limits"""
+        turn = HistoryTurn(
+            role,
+            content,
+            time.time() if timestamp is None else timestamp,
+            estimate_tokens(content),
+        )
+        self._turns.append(turn)
+        self.total_tokens += turn.tokens
+        self.version += 1
+
+        evicted = []
+        # Always keep the newest turn, even if it alone exceeds the budget
+        while len(self._turns) > 1 and (
+            len(self._turns) > self.max_turns or self.total_tokens > self.max_tokens
+        ):
+            old = self._turns.popleft()
+            self.total_tokens -= old.tokens
+            evicted.append(old)
+
+        if evicted:
+            self._on_evict(evicted)
+        return turn
+
+    def _on_evict(self, evicted: List[HistoryTurn]):
+        self.evicted_count += len(evicted)
+        if not self.summarize_evicted:
+            return
+        if self.summary:
+            # Fold the previous summary in so older context is not lost
+            evicted = [HistoryTurn('summary', self.summary, 0.0, 0)] + evicted
+        self.summary = self.summarizer(evicted, self.summary_max_tokens) or self.summary
+
+    def window(self, max_tokens: Optional[int] = None) -> List[HistoryTurn]:
+        """Newest turns (oldest first) that fit within max_tokens"""
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        selected = []
+        used = 0
+        for turn in reversed(self._turns):
+            if used + turn.tokens > budget:
+                break
+            selected.append(turn)
+            used += turn.tokens
+        selected.reverse()
+        return selected
+
+    def clear(self):
+        self._turns.clear()
+        self.total_tokens = 0
+        self.summary = ""
+        self.epoch += 1
+
+    def to_list(self) -> List[dict]:
+        """Plain dict view (compatible with the old conversation_history list)"""
+        return [turn.as_dict() for turn in self._turns]
+
+    def to_state(self) -> dict:
+        """JSON-serializable snapshot (used by the shared session store)"""
+        return {
+            "turns": [[t.role, t.content, t.timestamp, t.tokens] for t in self._turns],
+            "summary": self.summary,
+            "evicted_count": self.evicted_count,
+        }
+
+    def load_state(self, state: dict):
+        """Restore turns from to_state() output"""
+        self.clear()
+        for role, content, timestamp, tokens in state.get("turns", []):
+            self._turns.append(HistoryTurn(role, content, timestamp, tokens))
+            self.total_tokens += tokens
+            self.version += 1
+        self.summary = state.get("summary", "")
+        self.evicted_count = state.get("evicted_count", 0)
+
+    def merge_state(self, state: dict) -> int:
+        """Add turns from another copy's to_state() that this copy is missing
+
+        Turns older than this copy's oldest were evicted here and stay out.
+        Returns the number of turns added.
+        """
+        known = {(t.role, t.content, t.timestamp) for t in self._turns}
+        oldest = self._turns[0].timestamp if self._turns else 0.0
+        missing = [
+            (role, content, timestamp)
+            for role, content, timestamp, _tokens in state.get("turns", [])
+            if (role, content, timestamp) not in known and timestamp >= oldest
+        ]
+        for role, content, timestamp in missing:
+            self.append(role, content, timestamp)
+        if missing:
+            self._turns = deque(sorted(self._turns, key=lambda t: t.timestamp))
+        return len(missing)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the stored turns"""
+        return deep_sizeof(self._turns) + sys.getsizeof(self.summary)
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def __iter__(self) -> Iterator[HistoryTurn]:
+        return iter(self._turns)
+
+    def __getitem__(self, index: int) -> HistoryTurn:
+        return self._turns[index]
+
+
+def deep_sizeof(obj, _seen=None) -> int:
+    """Recursive sys.getsizeof for dicts, sequences and __slots__ objects"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, deque)):
+        size += sum(deep_sizeof(item, _seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(
+            deep_sizeof(getattr(obj, slot), _seen)
+            for slot in obj.__slots__ if hasattr(obj, slot)
+        )
+    return size
+
+
+def measure_session_memory(turns: int = 500) -> Tuple[int, int]:
+    """Compare the old unbounded list of dicts with ConversationHistory"""
+    sample = "Sure, I can help with that. What time would you like the reminder for?"
+
+    legacy = []
+    history = ConversationHistory()
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "assistant"
+        legacy.append({"role": role, "content": sample, "timestamp": time.time()})
+        history.append(role, sample)
+
+    return deep_sizeof(legacy), history.memory_bytes()
+
+
+if __name__ == "__main__":
+    print("Per-session history memory (bytes)")
+    print(f"{'turns':>8} {'list[dict]':>12} {'bounded':>12}")
+    for n in (10, 100, 1000, 10000):
+        before, after = measure_session_memory(n)
+        print(f"{n:>8} {before:>12} {after:>12}")
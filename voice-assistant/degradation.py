@@ -0,0 +1,169 @@
+"""
+Load-adaptive degradation
+When the box is saturated every request stays slow. The controller watches
+the Ollama queue depth and recent p95 turn latency and steps down through
+configured tiers (smaller conversation model, fewer tokens, greedy Whisper
+decoding), then steps back up once load has cleared. Separate step-down and
+step-up thresholds plus a minimum time per tier keep it from flapping.
+"""
+
+import copy
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from resilience import percentile
+
+logger = logging.getLogger('VoiceAssistant.degradation')
+
+
+class DegradationController:
+    """Picks the current tier; tier 0 is config.yaml as written"""
+
+    def __init__(
+        self,
+        tiers: List[dict],
+        base_models: Optional[dict] = None,
+        queue_depth: Optional[Callable[[], int]] = None,
+        enabled: bool = True,
+        interval: float = 5.0,
+        window: float = 60.0,
+        down_queue_depth: int = 8,
+        down_p95_ms: float = 4000.0,
+        up_queue_depth: int = 2,
+        up_p95_ms: float = 2000.0,
+        hold: float = 30.0,
+        min_samples: int = 5,
+    ):
+        self.tiers = [{'name': 'full'}] + list(tiers)
+        self.base_models = base_models or {}
+        self.queue_depth = queue_depth or (lambda: 0)
+        self.enabled = enabled and len(self.tiers) > 1
+        self.interval = interval
+        self.window = window
+        self.down_queue_depth = down_queue_depth
+        self.down_p95_ms = down_p95_ms
+        self.up_queue_depth = up_queue_depth
+        self.up_p95_ms = up_p95_ms
+        self.hold = hold
+        self.min_samples = min_samples
+        self.tier = 0
+        self._lock = threading.Lock()
+        self._samples = deque()  # (time, seconds)
+        self._changed_at = time.monotonic()
+        self._evaluated_at = 0.0
+        self._time_in_tier = [0.0] * len(self.tiers)
+        self.transitions = deque(maxlen=50)
+        self.transition_count = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[dict], base_models: Optional[dict] = None,
+                    queue_depth: Optional[Callable[[], int]] = None) -> "DegradationController":
+        """Build from the `degradation` section of config.yaml"""
+        config = config or {}
+        down = config.get('step_down', {})
+        up = config.get('step_up', {})
+        return cls(
+            tiers=config.get('tiers', []),
+            base_models=base_models,
+            queue_depth=queue_depth,
+            enabled=config.get('enabled', True),
+            interval=config.get('interval', 5.0),
+            window=config.get('window', 60.0),
+            down_queue_depth=down.get('queue_depth', 8),
+            down_p95_ms=down.get('p95_ms', 4000.0),
+            up_queue_depth=up.get('queue_depth', 2),
+            up_p95_ms=up.get('p95_ms', 2000.0),
+            hold=config.get('hold', 30.0),
+            min_samples=config.get('min_samples', 5),
+        )
+
+    def observe(self, seconds: float):
+        """Latency of one finished turn / generation"""
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds))
+
+    def _p95_ms(self, now: float) -> Optional[float]:
+        while self._samples and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        if len(self._samples) < self.min_samples:
+            return None
+        return percentile((s for _, s in self._samples), 95) * 1000
+
+    def evaluate(self) -> int:
+        """Move at most one tier per interval; returns the current tier"""
+        if not self.enabled:
+            return self.tier
+        now = time.monotonic()
+        with self._lock:
+            if now - self._evaluated_at < self.interval:
+                return self.tier
+            self._evaluated_at = now
+            depth = self.queue_depth()
+            p95 = self._p95_ms(now)
+            overloaded = depth >= self.down_queue_depth or (p95 is not None and p95 >= self.down_p95_ms)
+            cleared = depth <= self.up_queue_depth and (p95 is None or p95 <= self.up_p95_ms)
+            target = self.tier
+            if overloaded and self.tier < len(self.tiers) - 1:
+                target = self.tier + 1
+            elif cleared and self.tier > 0 and now - self._changed_at >= self.hold:
+                target = self.tier - 1
+            if target != self.tier:
+                self._switch(target, now, depth, p95)
+            return self.tier
+
+    def _switch(self, target: int, now: float, depth: int, p95: Optional[float]):
+        """Change tier (lock held)"""
+        previous = self.tier
+        self._time_in_tier[previous] += now - self._changed_at
+        self.tier = target
+        self._changed_at = now
+        # Latencies measured on the old tier say little about the new one
+        self._samples.clear()
+        record = {
+            'ts': round(time.time(), 3),
+            'from': self.tiers[previous]['name'],
+            'to': self.tiers[target]['name'],
+            'queue_depth': depth,
+            'p95_ms': None if p95 is None else round(p95, 1),
+        }
+        self.transitions.append(record)
+        self.transition_count += 1
+        log = logger.warning if target > previous else logger.info
+        log("Degradation tier %s -> %s", record['from'], record['to'], extra=record)
+
+    @property
+    def tier_name(self) -> str:
+        return self.tiers[self.tier]['name']
+
+    def model(self, role: str) -> dict:
+        """Model config for a role (name, max_tokens, temperature) in the current tier"""
+        tier = self.tiers[self.evaluate()]
+        merged = copy.copy(self.base_models.get(role, {}))
+        merged.update((tier.get('models') or {}).get(role, {}))
+        return merged
+
+    def override(self, section: str, key: str, default):
+        """Current tier's value for e.g. ('whisper', 'beam_size'), else default"""
+        tier = self.tiers[self.evaluate()]
+        return (tier.get(section) or {}).get(key, default)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            time_in_tier = list(self._time_in_tier)
+            time_in_tier[self.tier] += now - self._changed_at
+            p95 = self._p95_ms(now)
+            return {
+                'enabled': self.enabled,
+                'tier': self.tier,
+                'tier_name': self.tier_name,
+                'queue_depth': self.queue_depth(),
+                'p95_ms': None if p95 is None else round(p95, 1),
+                'seconds_in_tier': round(now - self._changed_at, 1),
+                'time_in_tier': {t['name']: round(s, 1) for t, s in zip(self.tiers, time_in_tier)},
+                'transitions': self.transition_count,
+                'recent_transitions': list(self.transitions)[-10:],
+            }
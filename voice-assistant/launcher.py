@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the voice assistant web servers
+Forks N worker processes that share one port via SO_REUSEPORT.
+Each worker imports the server module (and loads Whisper) after fork,
+and a supervisor restarts workers that crash. With preloading, heavy
+imports and model files are loaded once in the parent before forking
+(see model_preload.py); per-worker USS/PSS is logged to verify sharing.
+
+Usage:
+    python launcher.py streaming --workers 4
+    python launcher.py web --port 5000
+    python launcher.py streaming --no-preload      # compare memory without it
+    kill -USR1 <launcher pid>                      # log worker memory now
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import yaml
+
+from logging_setup import setup_logging, shutdown_logging
+from resource_planner import (WORKER_COUNT_ENV, WORKER_SLOT_ENV, _auto, apply_plan,
+                              plan_workers, read_topology)
+
+logger = logging.getLogger('VoiceAssistant.launcher')
+
+BASE_DIR = Path(__file__).parent
+WEB_DIR = BASE_DIR / "web_test"
+CONFIG_PATH = BASE_DIR / "config" / "config.yaml"
+
+# Server name -> (module in web_test/, default port)
+SERVERS = {
+    "streaming": ("streaming_server", 5002),
+    "web": ("server", 5000),
+}
+
+
+def load_config(path: Path = CONFIG_PATH) -> dict:
+    try:
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def default_workers(config: dict) -> int:
+    """One worker per `whisper.cpu_threads` physical cores"""
+    cpu_threads = config.get('whisper', {}).get('cpu_threads', 4)
+    if cpu_threads in (None, 'auto'):
+        cpu_threads = 4
+    return max(1, len(read_topology()) // cpu_threads)
+
+
+def resolve_workers(value, config: dict) -> int:
+    if value in (None, "auto"):
+        return default_workers(config)
+    return max(1, int(value))
+
+
+def bind_reuseport(host: str, port: int, backlog: int = 128) -> socket.socket:
+    """Listening socket that several processes can bind at the same time"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(server: str, host: str, port: int):
+    """Worker body: load the app (and its models) then serve until killed"""
+    from werkzeug.serving import make_server
+
+    module_name, _ = SERVERS[server]
+    sock = bind_reuseport(host, port)
+
+    # Server modules expect to run from web_test/ (static files, imports)
+    os.chdir(WEB_DIR)
+    sys.path.insert(0, str(WEB_DIR))
+    module = importlib.import_module(module_name)
+
+    # Background tasks normally started from the module's __main__ block
+    start_tasks = getattr(module, 'start_background_tasks', None)
+    if start_tasks:
+        start_tasks()
+
+    httpd = make_server(host, port, module.app, threaded=True, fd=sock.fileno())
+    logger.info("Worker %d serving %s on %s:%s", os.getpid(), server, host, port)
+    httpd.serve_forever()
+
+
+class Supervisor:
+    """Forks workers and restarts them when they exit unexpectedly"""
+
+    # A worker that stayed up this long is considered healthy again
+    HEALTHY_AFTER = 60.0
+
+    def __init__(self, server: str, host: str, port: int, workers: int,
+                 restart_delay: float = 1.0, max_restart_delay: float = 30.0,
+                 preloaded: bool = False, memory_report_after: float = 0.0):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.children: Dict[int, int] = {}  # pid -> worker slot
+        self.crashes: Dict[int, int] = {}   # slot -> consecutive crashes
+        self.started_at: Dict[int, float] = {}
+        self.stopping = False
+        self.preloaded = preloaded
+        self.memory_report_after = memory_report_after
+
+    def spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            # Child: default signal handling, never return into the supervisor loop
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if hasattr(signal, 'SIGUSR1'):
+                signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+                signal.signal(signal.SIGALRM, signal.SIG_DFL)
+                signal.alarm(0)
+            # Read by resource_planner.configure_process() in the server module
+            os.environ[WORKER_SLOT_ENV] = str(slot)
+            os.environ[WORKER_COUNT_ENV] = str(self.workers)
+            # The parent's log listener thread does not survive fork
+            setup_logging(load_config().get('logging'), service=self.server)
+            code = 0
+            try:
+                run_worker(self.server, self.host, self.port)
+            except BaseException:
+                logger.exception("Worker %d failed", slot)
+                code = 1
+            finally:
+                # os._exit skips atexit: flush the queue so the traceback is written
+                shutdown_logging()
+                os._exit(code)
+        self.children[pid] = slot
+        self.started_at[slot] = time.time()
+        logger.info("Started worker %d (pid %d)", slot, pid)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report_memory(self, signum=None, frame=None):
+        """Log USS/PSS/RSS of every worker (SIGUSR1, and once after startup)"""
+        from model_preload import format_memory_report, memory_report
+        try:
+            rows = memory_report(self.children)
+        except ImportError:
+            logger.warning("psutil is not installed: no worker memory report")
+            return
+        logger.info(format_memory_report(rows, self.preloaded),
+                    extra={'workers': rows, 'preloaded': self.preloaded})
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, self.report_memory)
+        signal.signal(signal.SIGALRM, self.report_memory)
+
+        for slot in range(self.workers):
+            self.spawn(slot)
+        if self.memory_report_after > 0:
+            # Once the workers have loaded their models
+            signal.alarm(max(1, int(self.memory_report_after)))
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            slot = self.children.pop(pid, None)
+            if slot is None or self.stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if time.time() - self.started_at[slot] > self.HEALTHY_AFTER:
+                self.crashes[slot] = 0
+            self.crashes[slot] = self.crashes.get(slot, 0) + 1
+            delay = min(self.restart_delay * 2 ** (self.crashes[slot] - 1), self.max_restart_delay)
+            logger.warning("Worker %d (pid %d) exited with %s, restarting in %.1fs", slot, pid, code, delay)
+            time.sleep(delay)
+            if not self.stopping:
+                self.spawn(slot)
+
+        logger.info("All workers stopped")
+
+
+def main(argv: Optional[list] = None):
+    config = load_config()
+    setup_logging(config.get('logging'), service='launcher')
+    server_config = config.get('server', {})
+
+    parser = argparse.ArgumentParser(description="Multi-process voice assistant server")
+    parser.add_argument("server", choices=sorted(SERVERS))
+    parser.add_argument("--host", default=server_config.get('host', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--workers", default=server_config.get('workers', 'auto'),
+                        help="Worker processes (default: physical cores / whisper.cpu_threads)")
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction,
+                        default=server_config.get('preload', True),
+                        help="Import modules and cache model files once before forking")
+    args = parser.parse_args(argv)
+
+    port = args.port or SERVERS[args.server][1]
+    workers = resolve_workers(args.workers, config)
+
+    if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+        logger.warning("fork/SO_REUSEPORT not available on this platform, running one worker")
+        run_worker(args.server, args.host, port)
+        return
+
+    if (args.server == "streaming" and workers > 1
+            and config.get('session_store', {}).get('backend', 'memory') == 'memory'):
+        logger.warning("session_store.backend is 'memory': sessions will not be shared "
+                       "between workers. Set it to 'sqlite' in config.yaml.")
+
+    if args.preload:
+        # OpenMP reads its thread count when ctranslate2 is first imported, so
+        # size it for one worker before the parent imports it
+        whisper_config = config.get('whisper', {})
+        plan = plan_workers(
+            read_topology(), processes=workers,
+            num_workers=_auto(whisper_config.get('num_workers')),
+            cpu_threads=_auto(whisper_config.get('cpu_threads')),
+        )[0]
+        apply_plan(plan, pin=False)
+        from model_preload import preload
+        preload(config)
+
+    logger.info("Starting %d %s worker(s) on %s:%s", workers, args.server, args.host, port)
+    Supervisor(
+        args.server, args.host, port, workers,
+        restart_delay=server_config.get('restart_delay', 1.0),
+        preloaded=args.preload,
+        memory_report_after=server_config.get('memory_report_after', 60.0),
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
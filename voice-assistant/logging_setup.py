@@ -0,0 +1,294 @@
+"""
+Shared logging setup for every entry point (voice_service, web servers, launcher)
+Records are handed to a background thread through a queue, so request
+handlers never block on console or file writes. Output is structured JSON
+(or colored console lines for development). Each record carries the
+current request ID and the request's stage timings, and high-volume debug
+records can be sampled.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from tracing import new_trace_id, start_span
+
+ROOT_LOGGER = 'VoiceAssistant'
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class RequestContext:
+    """Request ID, fields and stage timings (ms) for one request / voice turn"""
+
+    __slots__ = ('request_id', 'fields', 'timings', 'started')
+
+    def __init__(self, request_id: str, fields: dict):
+        self.request_id = request_id
+        self.fields = fields
+        self.timings: Dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar('request_context', default=None)
+
+
+def new_request_id() -> str:
+    return new_trace_id()
+
+
+def current_request() -> Optional[RequestContext]:
+    return _current.get()
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None, **fields) -> Iterator[RequestContext]:
+    """Tag every record logged inside the block with a request ID and fields
+
+    The block is also the root span of a trace whose ID is the request ID.
+    """
+    with start_span(fields.get('handler', 'request'), trace_id=request_id) as span:
+        ctx = RequestContext(span.trace_id, fields)
+        token = _current.set(ctx)
+        try:
+            yield ctx
+        finally:
+            _current.reset(token)
+            span.set(**{k: v for k, v in ctx.fields.items() if k != 'handler'})
+
+
+def annotate(**fields):
+    """Add fields (session_id, intent...) to the current request's records"""
+    ctx = _current.get()
+    if ctx is not None:
+        ctx.fields.update(fields)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the current request (preprocess, whisper, n8n...) as a span"""
+    start = time.perf_counter()
+    try:
+        with start_span(name):
+            yield
+    finally:
+        ctx = _current.get()
+        if ctx is not None:
+            elapsed = (time.perf_counter() - start) * 1000
+            ctx.timings[name] = round(ctx.timings.get(name, 0.0) + elapsed, 1)
+
+
+def logged_request(name: str, logger: logging.Logger):
+    """Decorator: run a handler in a new request context and log its timings
+
+    Works for plain and async handlers (Flask views, Socket.IO events).
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with request_context(handler=name) as ctx:
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        logger.info("%s complete", name, extra={'total_ms': round(ctx.elapsed_ms(), 1)})
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with request_context(handler=name) as ctx:
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    logger.info("%s complete", name, extra={'total_ms': round(ctx.elapsed_ms(), 1)})
+        return wrapper
+    return decorator
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current request context onto the record (runs in the caller's thread)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = _current.get()
+        if ctx is not None:
+            record.request_id = ctx.request_id
+            for key, value in ctx.fields.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+            if ctx.timings and not hasattr(record, 'timings'):
+                record.timings = dict(ctx.timings)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of records at or below `level`"""
+
+    def __init__(self, rate: float, level: int = logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.level or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, request_id, extras"""
+
+    def __init__(self, static_fields: Optional[dict] = None):
+        super().__init__()
+        self.static_fields = static_fields or {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            **self.static_fields,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Human-readable lines (colored if colorlog is installed) with the request ID"""
+
+    FORMAT = '%(asctime)s [%(levelname)s] %(request_tag)s%(message)s'
+
+    def __init__(self):
+        super().__init__(self.FORMAT, datefmt='%H:%M:%S')
+        try:
+            import colorlog
+            self._inner = colorlog.ColoredFormatter('%(log_color)s' + self.FORMAT, datefmt='%H:%M:%S')
+        except ImportError:
+            self._inner = None
+
+    def format(self, record: logging.LogRecord) -> str:
+        request_id = getattr(record, 'request_id', None)
+        record.request_tag = f"{request_id[:8]} " if request_id else ""
+        text = (self._inner or super()).format(record)
+        timings = getattr(record, 'timings', None)
+        if timings:
+            text += " " + " ".join(f"{k}={v:.0f}ms" for k, v in timings.items())
+        return text
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Enqueues without pre-formatting; drops records instead of blocking when full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message now (args may change later) but leave
+        # formatting and JSON encoding to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_state = {'pid': None, 'listener': None, 'handler': None}
+_state_lock = threading.Lock()
+
+
+def setup_logging(config: Optional[dict] = None, service: Optional[str] = None,
+                  force: bool = False) -> logging.Logger:
+    """Configure the VoiceAssistant logger tree from the `logging` config section
+
+    Safe to call from every entry point: it runs once per process (again
+    after fork, since the listener thread does not survive it).
+    """
+    config = config or {}
+    with _state_lock:
+        if _state['pid'] == os.getpid() and not force:
+            return logging.getLogger(ROOT_LOGGER)
+        if _state['listener'] is not None and _state['pid'] == os.getpid():
+            _state['listener'].stop()
+
+        fmt = os.getenv('LOG_FORMAT', config.get('format', 'console'))
+        if fmt == 'json':
+            static = {'pid': os.getpid()}
+            if service:
+                static['service'] = service
+            worker = os.getenv('VOICE_WORKER_SLOT')
+            if worker is not None:
+                static['worker'] = int(worker)
+            formatter = JSONFormatter(static)
+        else:
+            formatter = ConsoleFormatter()
+
+        path = config.get('file')
+        output = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler(sys.stderr)
+        output.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=config.get('queue_size', 10000))
+        handler = _QueueHandler(log_queue)
+        handler.addFilter(ContextFilter())
+        sample_rate = config.get('debug_sample_rate', 1.0)
+        if sample_rate < 1.0:
+            handler.addFilter(SamplingFilter(sample_rate))
+        listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+        listener.start()
+
+        root = logging.getLogger(ROOT_LOGGER)
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(os.getenv('LOG_LEVEL', config.get('level', 'INFO')).upper())
+        root.propagate = False
+        for name, level in (config.get('levels') or {}).items():
+            logging.getLogger(f"{ROOT_LOGGER}.{name}").setLevel(level.upper())
+
+        if _state['pid'] is None:
+            atexit.register(shutdown_logging)
+        _state.update(pid=os.getpid(), listener=listener, handler=handler)
+        return root
+
+
+def shutdown_logging():
+    """Flush queued records (call before exiting)"""
+    with _state_lock:
+        if _state['listener'] is not None and _state['pid'] == os.getpid():
+            _state['listener'].stop()
+            _state.update(pid=None, listener=None, handler=None)
+
+
+def dropped_records() -> int:
+    """Records dropped because the queue was full"""
+    handler = _state['handler']
+    return handler.dropped if handler else 0
@@ -0,0 +1,147 @@
+"""
+Pre-fork preloading for launcher workers
+CTranslate2 starts its replica threads when a model is built, and threads
+do not survive fork(), so the Whisper model objects themselves cannot be
+created in the parent. What is done once before forking instead: import the
+heavy modules (their heap then stays shared copy-on-write, protected with
+gc.freeze()), resolve/download every routed model once, and map the model
+files so they sit in the page cache and workers load them from memory.
+memory_report() gives per-worker USS/PSS/RSS to verify what is shared.
+"""
+
+import gc
+import importlib
+import logging
+import mmap
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger('VoiceAssistant.preload')
+
+# Imported in the parent so every worker shares their code objects and data
+HEAVY_MODULES = (
+    'numpy',
+    'ctranslate2',
+    'tokenizers',
+    'av',
+    'onnxruntime',
+    'faster_whisper',
+    'flask',
+    'flask_socketio',
+    'engineio',
+    'requests',
+    'aiohttp',
+)
+
+# Model name -> local directory, filled in the parent and inherited by workers
+_resolved: Dict[str, str] = {}
+
+
+def local_path(name: str) -> str:
+    """Directory resolved before fork, or the name itself (downloaded on load)"""
+    return _resolved.get(name, name)
+
+
+def _warm(path: Path) -> int:
+    """Fault a file into the page cache through a read-only mapping"""
+    size = path.stat().st_size
+    if not size:
+        return 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+            mapped.madvise(mmap.MADV_WILLNEED)
+        else:
+            for offset in range(0, size, mmap.PAGESIZE * 256):
+                mapped[offset]
+    return size
+
+
+def preload(config: dict) -> dict:
+    """Imports, model resolution and page-cache warm-up; call in the parent before forking"""
+    from whisper_router import WhisperRouter
+
+    start = time.perf_counter()
+    imported = []
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+            imported.append(name)
+        except ImportError:
+            pass
+
+    cached = 0
+    models = []
+    if 'faster_whisper' in imported:
+        from faster_whisper.utils import download_model
+
+        router = WhisperRouter.from_config(None, config.get('whisper_routing'),
+                                           default_model=os.getenv('WHISPER_MODEL'))
+        for name in router.models():
+            try:
+                path = name if os.path.isdir(name) else download_model(name)
+            except Exception as e:
+                logger.warning("Could not resolve Whisper model %s before fork: %s", name, e)
+                continue
+            _resolved[name] = path
+            models.append(name)
+            cached += sum(_warm(f) for f in Path(path).iterdir() if f.is_file())
+
+        # Silero VAD (used to split long clips) runs single-threaded: safe to build pre-fork
+        if (config.get('chunked_transcription') or {}).get('enabled', True):
+            try:
+                from faster_whisper.vad import get_vad_model
+                get_vad_model()
+            except Exception as e:
+                logger.debug("VAD model not preloaded: %s", e)
+
+    # Keep the cyclic GC from writing to (and so copying) every inherited object
+    gc.collect()
+    gc.freeze()
+
+    summary = {
+        'modules': imported,
+        'models': models,
+        'cached_mb': round(cached / (1024 * 1024), 1),
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+    logger.info("Preloaded %d modules and %s (%.0f MB of model files cached) in %.1fs",
+                len(imported), ", ".join(models) or "no models", summary['cached_mb'], summary['seconds'])
+    return summary
+
+
+def memory_report(pids: Dict[int, int]) -> List[dict]:
+    """USS / PSS / RSS (MB) of each worker pid -> slot"""
+    import psutil
+
+    rows = []
+    for pid, slot in sorted(pids.items(), key=lambda item: item[1]):
+        try:
+            info = psutil.Process(pid).memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        rows.append({
+            'slot': slot,
+            'pid': pid,
+            'uss_mb': round(info.uss / (1024 * 1024), 1),
+            # PSS is Linux-only: shared pages split between the processes mapping them
+            'pss_mb': round(getattr(info, 'pss', info.uss) / (1024 * 1024), 1),
+            'rss_mb': round(info.rss / (1024 * 1024), 1),
+        })
+    return rows
+
+
+def format_memory_report(rows: List[dict], preloaded: Optional[bool] = None) -> str:
+    mode = '' if preloaded is None else (' (preloaded)' if preloaded else ' (no preload)')
+    lines = [f"Worker memory{mode}:", f"  {'slot':>4} {'pid':>7} {'USS':>9} {'PSS':>9} {'RSS':>9}"]
+    for r in rows:
+        lines.append(f"  {r['slot']:>4} {r['pid']:>7} {r['uss_mb']:>7.1f}MB "
+                     f"{r['pss_mb']:>7.1f}MB {r['rss_mb']:>7.1f}MB")
+    if rows:
+        uss = sum(r['uss_mb'] for r in rows)
+        pss = sum(r['pss_mb'] for r in rows)
+        rss = sum(r['rss_mb'] for r in rows)
+        lines.append(f"  {'total':>12} {uss:>7.1f}MB {pss:>7.1f}MB {rss:>7.1f}MB")
+        lines.append(f"  PSS total is the real footprint; {rss - uss:.1f}MB of the RSS is shared pages")
+    return "\n".join(lines)
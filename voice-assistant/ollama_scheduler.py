@@ -0,0 +1,279 @@
+"""
+Priority scheduler for Ollama requests
+Every generation waits for a slot. Slots go to the highest-priority class
+with waiters (classifier > home_assistant > conversation > tools). Per-class
+limits keep long conversation or tool generations from taking every slot
+Ollama has, and within a class sessions are served round-robin so one
+chatty client cannot starve the others. Queue wait per class is tracked.
+Limits in config.yaml are for all launcher workers together; each worker
+schedules its share of them (priority holds within a worker).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+from resilience import LatencyTracker
+from resource_planner import WORKER_COUNT_ENV, WORKER_SLOT_ENV
+
+logger = logging.getLogger('VoiceAssistant.scheduler')
+
+# Highest priority first; keys are the model roles in config.yaml
+DEFAULT_CLASSES = OrderedDict([
+    ('classifier', 4),
+    ('home_assistant', 2),
+    ('conversation', 2),
+    ('tools', 1),
+])
+
+
+class SchedulerBusy(Exception):
+    """Raised when a class queue is full or a request waited longer than max_wait"""
+
+
+class _Waiter:
+    __slots__ = ('session', 'enqueued', 'granted', 'event', 'future', 'loop')
+
+    def __init__(self, session: str, loop=None):
+        self.session = session
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+
+    def wake(self):
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class _PriorityClass:
+    """Waiters of one class, queued per session and served round-robin"""
+
+    def __init__(self, name: str, priority: int, max_concurrent: int):
+        self.name = name
+        self.priority = priority
+        self.max_concurrent = max_concurrent
+        self.sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self.waiting = 0
+        self.running = 0
+        self.served = 0
+        self.rejected = 0
+        self.wait = LatencyTracker(window=500)
+
+    def push(self, waiter: _Waiter):
+        self.sessions.setdefault(waiter.session, deque()).append(waiter)
+        self.waiting += 1
+
+    def pop(self) -> _Waiter:
+        session, queue = next(iter(self.sessions.items()))
+        waiter = queue.popleft()
+        if queue:
+            self.sessions.move_to_end(session)  # Next session's turn
+        else:
+            del self.sessions[session]
+        self.waiting -= 1
+        return waiter
+
+    def remove(self, waiter: _Waiter):
+        queue = self.sessions.get(waiter.session)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self.sessions[waiter.session]
+
+
+def worker_share(limit: int, slot: int, processes: int) -> int:
+    """This worker's part of a limit split across processes (at least 1)
+
+    With more workers than the limit, each still gets one slot and Ollama
+    queues the excess itself.
+    """
+    share = limit // processes + (1 if slot % processes < limit % processes else 0)
+    return max(1, share)
+
+
+class OllamaScheduler:
+    """Admission control in front of one Ollama host"""
+
+    def __init__(self, enabled: bool = True, max_concurrent: int = 4,
+                 classes: Optional[Dict[str, int]] = None,
+                 max_queue: int = 200, max_wait: float = 30.0):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._running = 0
+        self._classes: Dict[str, _PriorityClass] = OrderedDict()
+        for priority, (name, limit) in enumerate((classes or DEFAULT_CLASSES).items()):
+            self._classes[name] = _PriorityClass(name, priority, limit)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict], slot: Optional[int] = None,
+                    processes: Optional[int] = None) -> "OllamaScheduler":
+        """Build from the `scheduler` section of config.yaml
+
+        The limits there are Ollama's, shared by every worker process:
+        this process gets its share (worker slot/count from launcher.py,
+        like resource_planner.configure_process).
+        """
+        config = config or {}
+        if slot is None:
+            slot = int(os.getenv(WORKER_SLOT_ENV, 0))
+        if processes is None:
+            processes = int(os.getenv(WORKER_COUNT_ENV, 1))
+        max_concurrent = worker_share(config.get('max_concurrent', 4), slot, processes)
+        classes = OrderedDict(
+            (name, min(max_concurrent,
+                       worker_share((opts or {}).get('max_concurrent', 1), slot, processes)))
+            for name, opts in (config.get('classes') or {}).items()
+        )
+        if processes > 1:
+            logger.info("Worker %d of %d schedules %d of %s Ollama slots",
+                        slot, processes, max_concurrent, config.get('max_concurrent', 4))
+        return cls(
+            enabled=config.get('enabled', True),
+            max_concurrent=max_concurrent,
+            classes=classes or None,
+            max_queue=config.get('max_queue', 200),
+            max_wait=config.get('max_wait', 30.0),
+        )
+
+    def _class(self, name: str) -> _PriorityClass:
+        pc = self._classes.get(name)
+        if pc is None:
+            # Unknown roles get the lowest priority
+            pc = self._classes[name] = _PriorityClass(name, len(self._classes), 1)
+        return pc
+
+    def _enqueue(self, pc: _PriorityClass, waiter: _Waiter):
+        with self._lock:
+            if pc.waiting >= self.max_queue:
+                pc.rejected += 1
+                raise SchedulerBusy(f"{pc.waiting} {pc.name} requests already queued")
+            pc.push(waiter)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to the highest-priority waiters (lock held)"""
+        while self._running < self.max_concurrent:
+            for pc in self._classes.values():
+                if pc.waiting and pc.running < pc.max_concurrent:
+                    waiter = pc.pop()
+                    pc.running += 1
+                    pc.served += 1
+                    self._running += 1
+                    pc.wait.record(time.perf_counter() - waiter.enqueued)
+                    waiter.wake()
+                    break
+            else:
+                return
+
+    def _release(self, pc: _PriorityClass):
+        with self._lock:
+            pc.running -= 1
+            self._running -= 1
+            self._dispatch()
+
+    def _abandon(self, pc: _PriorityClass, waiter: _Waiter) -> bool:
+        """Withdraw a waiter; True if it had already been given a slot"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            pc.remove(waiter)
+            pc.rejected += 1
+            return False
+
+    @contextmanager
+    def slot(self, name: str, session: Optional[str] = None, token=None):
+        """Hold an Ollama slot of class `name` (blocking; cancellable with a CancelToken)"""
+        if not self.enabled:
+            yield
+            return
+        pc = self._class(name)
+        waiter = _Waiter(session or '')
+        self._enqueue(pc, waiter)
+        if token is not None:
+            with token.on_cancel(waiter.event.set):
+                waiter.event.wait(self.max_wait)
+        else:
+            waiter.event.wait(self.max_wait)
+        if not waiter.granted:
+            if self._abandon(pc, waiter):
+                self._release(pc)
+            if token is not None:
+                token.check()
+            raise SchedulerBusy(f"{name} request waited more than {self.max_wait:.0f}s")
+        try:
+            if token is not None:
+                token.check()
+            yield
+        finally:
+            self._release(pc)
+
+    @asynccontextmanager
+    async def aslot(self, name: str, session: Optional[str] = None):
+        """Async version of slot(); task cancellation gives the slot up"""
+        if not self.enabled:
+            yield
+            return
+        pc = self._class(name)
+        waiter = _Waiter(session or '', asyncio.get_running_loop())
+        self._enqueue(pc, waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if self._abandon(pc, waiter):
+                self._release(pc)
+            if isinstance(e, asyncio.TimeoutError):
+                raise SchedulerBusy(f"{name} request waited more than {self.max_wait:.0f}s")
+            raise
+        try:
+            yield
+        finally:
+            self._release(pc)
+
+    def depth(self) -> int:
+        """Requests waiting for a slot, all classes"""
+        with self._lock:
+            return sum(pc.waiting for pc in self._classes.values())
+
+    def stats(self) -> dict:
+        """Slots in use plus per-class queue depth and wait percentiles (ms)"""
+        def ms(tracker, pct):
+            value = tracker.quantile(pct)
+            return None if value is None else round(value * 1000, 1)
+
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_concurrent': self.max_concurrent,
+                'running': self._running,
+                'classes': {
+                    name: {
+                        'priority': pc.priority,
+                        'max_concurrent': pc.max_concurrent,
+                        'running': pc.running,
+                        'waiting': pc.waiting,
+                        'sessions_waiting': len(pc.sessions),
+                        'served': pc.served,
+                        'rejected': pc.rejected,
+                        'wait_ms': {'p50': ms(pc.wait, 50), 'p95': ms(pc.wait, 95), 'p99': ms(pc.wait, 99)},
+                    }
+                    for name, pc in self._classes.items()
+                },
+            }
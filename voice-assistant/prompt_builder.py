@@ -0,0 +1,106 @@
+"""
+Context-aware prompt assembly from ConversationHistory
+Keeps an incrementally maintained transcript prefix within a token budget
+"""
+
+from collections import deque
+from typing import Deque, Optional
+
+from conversation_history import ConversationHistory, HistoryTurn, estimate_tokens
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful voice assistant. Answer briefly and naturally."
+
+ROLE_LABELS = {"user": "User", "assistant": "Assistant"}
+
+
+class PromptBuilder:
+    """Builds prompts from the most recent turns of one session's history
+
+    Each turn is formatted and counted once. New turns are appended to the
+    cached prefix and the oldest lines are trimmed when over budget, so a
+    new turn never triggers a full rebuild or re-count of the transcript.
+    """
+
+    def __init__(
+        self,
+        history: ConversationHistory,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        max_tokens: int = 512,
+    ):
+        self.history = history
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self._reset()
+
+    @classmethod
+    def from_config(cls, history: ConversationHistory, config: Optional[dict]) -> "PromptBuilder":
+        """Build from the `prompt` section of config.yaml"""
+        config = config or {}
+        return cls(
+            history,
+            system_prompt=config.get('system_prompt', DEFAULT_SYSTEM_PROMPT),
+            max_tokens=config.get('max_context_tokens', 512),
+        )
+
+    def _reset(self):
+        self._lines: Deque[str] = deque()
+        self._line_tokens: Deque[int] = deque()
+        self._used_tokens = 0
+        self._prefix = ""
+        # Turns already in the history are picked up on the first build
+        self._version = self.history.version - len(self.history)
+        self._epoch = self.history.epoch
+
+    def _sync(self):
+        """Append turns added since the last build and trim to budget"""
+        if self._epoch != self.history.epoch:
+            self._reset()
+
+        new_count = self.history.version - self._version
+        if new_count <= 0:
+            return
+        new_count = min(new_count, len(self.history))
+        start = len(self.history) - new_count
+        for i in range(start, len(self.history)):
+            self._append_turn(self.history[i])
+        self._version = self.history.version
+
+        while self._lines and self._used_tokens > self.max_tokens:
+            line = self._lines.popleft()
+            self._used_tokens -= self._line_tokens.popleft()
+            self._prefix = self._prefix[len(line):]
+
+    def _append_turn(self, turn: HistoryTurn):
+        line = f"{ROLE_LABELS.get(turn.role, turn.role.title())}: {turn.content}\n"
+        self._lines.append(line)
+        self._line_tokens.append(turn.tokens)
+        self._used_tokens += turn.tokens
+        self._prefix += line
+
+    def context(self) -> str:
+        """Recent transcript (oldest first) within the token budget"""
+        self._sync()
+        return self._prefix
+
+    def build(self, text: Optional[str] = None) -> str:
+        """Full prompt: system prompt, earlier summary, recent turns, cue
+
+        If `text` is given it is appended as the final user turn without
+        being stored; otherwise the latest stored turn is the user's.
+        """
+        self._sync()
+        parts = [self.system_prompt, "\n\n"]
+
+        summary = self.history.summary
+        if summary and self._used_tokens + estimate_tokens(summary) <= self.max_tokens:
+            parts.append(f"Earlier in this conversation: {summary}\n\n")
+
+        parts.append(self._prefix)
+        if text is not None:
+            parts.append(f"User: {text}\n")
+        parts.append("Assistant:")
+        return "".join(parts)
+
+    @property
+    def used_tokens(self) -> int:
+        return self._used_tokens
@@ -0,0 +1,308 @@
+"""
+Resilience layer for outbound calls to n8n and Ollama
+Adaptive timeouts from recent latency percentiles, jittered retries for
+idempotent calls, and a circuit breaker that fails fast with a cached
+fallback response while a backend is down
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+logger = logging.getLogger('VoiceAssistant.resilience')
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_MISSING = object()
+
+
+def percentile(values: Iterable[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of values, None when there are none"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class BackendUnavailable(Exception):
+    """Circuit is open (or retries exhausted) and no fallback is available"""
+
+
+class LatencyTracker:
+    """Recent successful-call latencies and the timeout derived from them"""
+
+    def __init__(self, window: int = 200, percentile: float = 99,
+                 multiplier: float = 2.0, min_timeout: float = 2.0,
+                 max_timeout: float = 30.0, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, pct: float) -> Optional[float]:
+        return percentile(self.samples, pct)
+
+    def timeout(self) -> float:
+        """max_timeout until enough samples, then percentile * multiplier (clamped)"""
+        if len(self.samples) < self.min_samples:
+            return self.max_timeout
+        adaptive = self.quantile(self.percentile) * self.multiplier
+        return min(self.max_timeout, max(self.min_timeout, adaptive))
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, probes again after a cool-down"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                # Let exactly one request through to test the backend
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def abandon(self):
+        """The call let through was cancelled by the caller: neither success nor failure"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.time()
+                self._probe_in_flight = False
+
+
+class ResilientBackend:
+    """Wraps calls to one backend with timeouts, retries and a breaker
+
+    Calls are functions taking the timeout to use (in seconds). Successful
+    results are cached under `cache_key` and served while the circuit is
+    open; otherwise `fallback` (if given) is returned.
+    """
+
+    def __init__(self, name: str, retries: int = 2, backoff_base: float = 0.2,
+                 backoff_max: float = 2.0, cache_size: int = 256,
+                 breaker: Optional[CircuitBreaker] = None,
+                 latency: Optional[LatencyTracker] = None):
+        self.name = name
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache_size = cache_size
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self._cache: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.counters = {
+            'calls': 0, 'successes': 0, 'failures': 0, 'retries': 0,
+            'short_circuited': 0, 'fallbacks': 0,
+        }
+
+    @classmethod
+    def from_config(cls, name: str, config: Optional[dict]) -> "ResilientBackend":
+        config = config or {}
+        return cls(
+            name,
+            retries=config.get('retries', 2),
+            backoff_base=config.get('backoff_base', 0.2),
+            backoff_max=config.get('backoff_max', 2.0),
+            cache_size=config.get('fallback_cache_size', 256),
+            breaker=CircuitBreaker(
+                failure_threshold=config.get('failure_threshold', 5),
+                reset_timeout=config.get('reset_timeout', 30.0),
+            ),
+            latency=LatencyTracker(
+                percentile=config.get('timeout_percentile', 99),
+                multiplier=config.get('timeout_multiplier', 2.0),
+                min_timeout=config.get('min_timeout', 2.0),
+                max_timeout=config.get('max_timeout', 30.0),
+            ),
+        )
+
+    def timeout(self) -> float:
+        return self.latency.timeout()
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _remember(self, cache_key, result):
+        if cache_key is None:
+            return
+        with self._cache_lock:
+            self._cache[cache_key] = result
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _fallback(self, cache_key, fallback, error: str):
+        cached = self._cache.get(cache_key, _MISSING) if cache_key is not None else _MISSING
+        if cached is not _MISSING:
+            self.counters['fallbacks'] += 1
+            return cached
+        if fallback is not _MISSING:
+            self.counters['fallbacks'] += 1
+            return fallback
+        raise BackendUnavailable(f"{self.name}: {error}")
+
+    def call(self, fn: Callable[[float], Any], idempotent: bool = False,
+             cache_key: Optional[Hashable] = None, fallback: Any = _MISSING,
+             token=None) -> Any:
+        """Run fn(timeout) synchronously with retries and the breaker
+
+        With a cancellation token, an error caused by aborting the call is
+        not a backend failure: the token's Cancelled is raised instead, and
+        no retry or fallback follows.
+        """
+        self.counters['calls'] += 1
+        if not self.breaker.allow():
+            self.counters['short_circuited'] += 1
+            return self._fallback(cache_key, fallback, "circuit open")
+
+        attempts = 1 + (self.retries if idempotent else 0)
+        error = None
+        for attempt in range(attempts):
+            if attempt:
+                self.counters['retries'] += 1
+                if token is not None:
+                    token.sleep(self._backoff(attempt - 1))
+                else:
+                    time.sleep(self._backoff(attempt - 1))
+            start = time.perf_counter()
+            try:
+                result = fn(self.timeout())
+            except Exception as e:
+                if token is not None and token.cancelled:
+                    self.breaker.abandon()
+                    token.check()
+                error = e
+                self.counters['failures'] += 1
+                self.breaker.record_failure()
+                if not self.breaker.allow():
+                    break
+                continue
+            self._on_success(time.perf_counter() - start, cache_key, result)
+            return result
+
+        logger.warning("%s call failed: %s", self.name, error)
+        return self._fallback(cache_key, fallback, str(error))
+
+    async def acall(self, fn: Callable[[float], Awaitable[Any]], idempotent: bool = False,
+                    cache_key: Optional[Hashable] = None, fallback: Any = _MISSING) -> Any:
+        """Async variant of call(); fn(timeout) returns an awaitable
+
+        Cancelling the awaiting task (CancelToken.arun) propagates
+        asyncio.CancelledError without counting a failure.
+        """
+        self.counters['calls'] += 1
+        if not self.breaker.allow():
+            self.counters['short_circuited'] += 1
+            return self._fallback(cache_key, fallback, "circuit open")
+
+        attempts = 1 + (self.retries if idempotent else 0)
+        error = None
+        for attempt in range(attempts):
+            if attempt:
+                self.counters['retries'] += 1
+                await asyncio.sleep(self._backoff(attempt - 1))
+            timeout = self.timeout()
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(fn(timeout), timeout)
+            except asyncio.CancelledError:
+                # The caller cancelled (e.g. an interrupt): not a backend failure,
+                # but a half-open probe slot must be handed back
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                error = e
+                self.counters['failures'] += 1
+                self.breaker.record_failure()
+                if not self.breaker.allow():
+                    break
+                continue
+            self._on_success(time.perf_counter() - start, cache_key, result)
+            return result
+
+        logger.warning("%s call failed: %r", self.name, error)
+        return self._fallback(cache_key, fallback, repr(error))
+
+    def _on_success(self, elapsed: float, cache_key, result):
+        self.counters['successes'] += 1
+        self.latency.record(elapsed)
+        self.breaker.record_success()
+        self._remember(cache_key, result)
+
+    def metrics(self) -> dict:
+        return {
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.consecutive_failures,
+            'times_opened': self.breaker.times_opened,
+            'timeout': round(self.timeout(), 3),
+            'latency_p50': self.latency.quantile(50),
+            'latency_p95': self.latency.quantile(95),
+            'latency_p99': self.latency.quantile(99),
+            **self.counters,
+        }
+
+
+_backends: Dict[str, ResilientBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str, config: Optional[dict] = None) -> ResilientBackend:
+    """Shared backend wrapper, configured from the `resilience` config section
+
+    Per-backend keys (e.g. `resilience.n8n`) override `resilience.default`.
+    """
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            config = config or {}
+            merged = dict(config.get('default', {}))
+            merged.update(config.get(name, {}))
+            backend = _backends[name] = ResilientBackend.from_config(name, merged)
+        return backend
+
+
+def all_metrics() -> Dict[str, dict]:
+    """Breaker/latency metrics for every backend created in this process"""
+    return {name: backend.metrics() for name, backend in _backends.items()}
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+CPU topology and thread-budget planner for Whisper workers
+Gives each transcription process a disjoint set of physical cores, pins it
+there, and sizes cpu_threads and the OpenMP/BLAS thread pools to match.
+
+Usage:
+    python resource_planner.py                       # print the plan
+    python resource_planner.py bench clip.wav        # compare against the old settings
+"""
+
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from resilience import percentile
+
+logger = logging.getLogger('VoiceAssistant.resources')
+
+SYSFS_CPU = Path("/sys/devices/system/cpu")
+
+# Thread pools that would otherwise each spawn one thread per logical CPU
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+# Set by launcher.py so each forked worker knows its slot
+WORKER_SLOT_ENV = "VOICE_WORKER_SLOT"
+WORKER_COUNT_ENV = "VOICE_WORKER_COUNT"
+
+
+class Core(NamedTuple):
+    package: int
+    core_id: int
+    cpus: Tuple[int, ...]  # Logical CPUs (SMT siblings), lowest first
+
+
+class WorkerPlan(NamedTuple):
+    slot: int
+    cpus: Tuple[int, ...]  # Affinity set
+    cpu_threads: int       # Threads per Whisper model replica
+    num_workers: int       # Whisper model replicas in this process
+    shared: bool           # True if cores had to be shared with other workers
+
+
+def read_topology() -> List[Core]:
+    """Physical cores and their SMT siblings, ordered by package then core"""
+    cores: Dict[Tuple[int, int], List[int]] = {}
+    try:
+        for cpu_dir in SYSFS_CPU.glob("cpu[0-9]*"):
+            topology = cpu_dir / "topology"
+            if not topology.exists():
+                continue
+            cpu = int(cpu_dir.name[3:])
+            package = int((topology / "physical_package_id").read_text())
+            core_id = int((topology / "core_id").read_text())
+            cores.setdefault((package, core_id), []).append(cpu)
+    except (OSError, ValueError):
+        cores = {}
+
+    allowed = _allowed_cpus()
+    if cores:
+        result = []
+        for (package, core_id), cpus in sorted(cores.items()):
+            cpus = tuple(sorted(c for c in cpus if c in allowed))
+            if cpus:
+                result.append(Core(package, core_id, cpus))
+        if result:
+            return result
+
+    # No sysfs (Windows/macOS): assume siblings are numbered adjacently
+    logical = sorted(allowed)
+    physical = _physical_core_count() or len(logical)
+    per_core = max(1, len(logical) // physical)
+    return [
+        Core(0, i, tuple(logical[i * per_core:(i + 1) * per_core]))
+        for i in range(len(logical) // per_core)
+    ]
+
+
+def _allowed_cpus() -> set:
+    if hasattr(os, 'sched_getaffinity'):
+        return set(os.sched_getaffinity(0))
+    return set(range(os.cpu_count() or 1))
+
+
+def _physical_core_count() -> Optional[int]:
+    try:
+        import psutil
+        return psutil.cpu_count(logical=False)
+    except ImportError:
+        return None
+
+
+def plan_workers(
+    cores: List[Core],
+    processes: int = 1,
+    num_workers: Optional[int] = None,
+    cpu_threads: Optional[int] = None,
+    use_smt: bool = False,
+) -> List[WorkerPlan]:
+    """Split physical cores into one disjoint block per process
+
+    Each process gets cpu_threads * num_workers physical cores. Whichever
+    of the two is None is derived from an even share of the cores. If the
+    blocks do not fit, they wrap around and are marked as shared so the
+    caller can warn about oversubscription.
+    """
+    processes = max(1, processes)
+    share = max(1, len(cores) // processes)
+    if num_workers is None:
+        num_workers = max(1, share // cpu_threads) if cpu_threads else 1
+    num_workers = max(1, num_workers)
+    if cpu_threads is None:
+        cpu_threads = max(1, share // num_workers)
+    block = cpu_threads * num_workers
+    shared = block * processes > len(cores)
+
+    plans = []
+    for slot in range(processes):
+        start = slot * block
+        assigned = [cores[(start + i) % len(cores)] for i in range(min(block, len(cores)))]
+        cpus = []
+        for core in assigned:
+            cpus.extend(core.cpus if use_smt else core.cpus[:1])
+        plans.append(WorkerPlan(slot, tuple(sorted(set(cpus))), cpu_threads, num_workers, shared))
+    return plans
+
+
+def apply_plan(plan: WorkerPlan, pin: bool = True):
+    """Set thread-pool env vars and CPU affinity for the current process
+
+    Must run before faster_whisper/ctranslate2 is imported, otherwise the
+    OpenMP pool has already been sized.
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(plan.cpu_threads)
+
+    if not pin:
+        return
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, plan.cpus)
+        else:
+            import psutil
+            psutil.Process().cpu_affinity(list(plan.cpus))
+    except (ImportError, OSError, AttributeError) as e:
+        logger.warning("Could not pin CPUs %s: %s", list(plan.cpus), e)
+
+
+def configure_process(config: Optional[dict], slot: Optional[int] = None,
+                      processes: Optional[int] = None) -> WorkerPlan:
+    """Plan and apply the resource budget for this process
+
+    Worker slot/count come from launcher.py via environment variables; a
+    server started directly is planned as the only process on the machine.
+    """
+    config = config or {}
+    whisper_config = config.get('whisper', {})
+    resources = config.get('resources', {})
+
+    if slot is None:
+        slot = int(os.getenv(WORKER_SLOT_ENV, 0))
+    if processes is None:
+        processes = int(os.getenv(WORKER_COUNT_ENV, 1))
+
+    cores = read_topology()
+    plans = plan_workers(
+        cores,
+        processes=processes,
+        num_workers=_auto(whisper_config.get('num_workers')),
+        cpu_threads=_auto(whisper_config.get('cpu_threads')),
+        use_smt=resources.get('use_smt', False),
+    )
+    plan = plans[slot % len(plans)]
+    apply_plan(plan, pin=resources.get('pin_cpus', True) and processes > 1)
+
+    logger.info(
+        f"Worker {plan.slot}/{processes}: cpus={list(plan.cpus)} "
+        f"cpu_threads={plan.cpu_threads} num_workers={plan.num_workers} "
+        f"({len(cores)} physical cores)"
+    )
+    if plan.shared:
+        logger.warning("Thread budget exceeds physical cores: workers share cores")
+    return plan
+
+
+def _auto(value) -> Optional[int]:
+    """Config value where 'auto' (or missing) means derive it"""
+    return None if value in (None, 'auto') else int(value)
+
+
+def format_plan(cores: List[Core], plans: List[WorkerPlan]) -> str:
+    lines = [f"{len(cores)} physical cores, "
+             f"{sum(len(c.cpus) for c in cores)} logical CPUs"]
+    for plan in plans:
+        lines.append(
+            f"  worker {plan.slot}: cpus={list(plan.cpus)} "
+            f"cpu_threads={plan.cpu_threads} num_workers={plan.num_workers}"
+            + (" (shared)" if plan.shared else "")
+        )
+    return "\n".join(lines)
+
+
+def benchmark(audio_path: str, cpu_threads: int, num_workers: int,
+              requests: int = 16, concurrency: int = 4) -> dict:
+    """Throughput and latency percentiles for one thread configuration"""
+    from concurrent.futures import ThreadPoolExecutor
+    from faster_whisper import WhisperModel
+
+    model = WhisperModel(
+        os.getenv('WHISPER_MODEL', 'base.en'),
+        device='cpu',
+        compute_type=os.getenv('WHISPER_COMPUTE_TYPE', 'int8'),
+        cpu_threads=cpu_threads,
+        num_workers=num_workers,
+    )
+
+    def run_one(_):
+        start = time.perf_counter()
+        segments, _info = model.transcribe(audio_path, beam_size=1)
+        list(segments)
+        return time.perf_counter() - start
+
+    run_one(0)  # Warm-up
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(run_one, range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        'throughput': requests / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def _bench_main(audio_path: str):
+    cores = read_topology()
+    plan = plan_workers(cores)[0]
+    configs = [
+        ("current (num_workers=4, cpu_threads=8)", 8, 4),
+        (f"planned (num_workers={plan.num_workers}, cpu_threads={plan.cpu_threads})",
+         plan.cpu_threads, plan.num_workers),
+    ]
+    print(format_plan(cores, [plan]))
+    print(f"\n{'config':<45} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for name, cpu_threads, num_workers in configs:
+        r = benchmark(audio_path, cpu_threads, num_workers)
+        print(f"{name:<45} {r['throughput']:>7.2f} {r['p50']:>6.2f}s "
+              f"{r['p95']:>6.2f}s {r['p99']:>6.2f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "bench":
+        _bench_main(sys.argv[2])
+    else:
+        from launcher import load_config, resolve_workers
+        config = load_config()
+        cores = read_topology()
+        workers = resolve_workers(config.get('server', {}).get('workers', 'auto'), config)
+        plans = plan_workers(
+            cores, processes=workers,
+            num_workers=_auto(config.get('whisper', {}).get('num_workers')),
+            cpu_threads=_auto(config.get('whisper', {}).get('cpu_threads')),
+            use_smt=config.get('resources', {}).get('use_smt', False),
+        )
+        print(format_plan(cores, plans))
@@ -0,0 +1,427 @@
+"""
+Semantic response cache for CONVERSATION answers
+Repeated factual questions ("what's the capital of France?") are matched
+by embedding similarity against a bounded on-disk vector index and
+answered without another LLM / n8n round trip. Time-sensitive and
+follow-up questions always go upstream.
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from single_flight import normalize_text
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves from concurrent processes are not serialized
+    fcntl = None
+
+logger = logging.getLogger('VoiceAssistant.cache')
+
+DEFAULT_CACHE_PATH = ".cache/response_cache"
+INDEX_FILE = "index.npz"
+
+# Answers to these change over time (or depend on the user's own data)
+DEFAULT_BYPASS_KEYWORDS = (
+    "weather", "forecast", "temperature", "rain", "snow",
+    "time", "clock", "date", "today", "tonight", "tomorrow", "yesterday",
+    "now", "current", "currently", "latest", "news", "score",
+    "price", "stock", "calendar", "schedule", "meeting", "appointment",
+    "remind", "reminder", "timer", "alarm", "my",
+)
+
+# Answers to these depend on the previous turn
+FOLLOW_UP_WORDS = (
+    "it", "its", "that", "this", "those", "these", "he", "she", "him",
+    "her", "they", "them", "their", "there", "again", "else",
+)
+FOLLOW_UP_PREFIXES = ("and ", "what about ", "how about ", "why ", "also ")
+
+# Words that carry no meaning for matching questions
+STOPWORDS = frozenset((
+    "a", "an", "the", "is", "are", "was", "were", "be", "of", "to", "in",
+    "on", "for", "and", "or", "s", "what", "whats", "do", "does", "can",
+    "could", "would", "you", "me", "i", "please", "tell", "hey", "so",
+))
+
+
+class HashingEmbedder:
+    """Dependency-free sentence embedding: hashed word and character n-grams
+
+    Good enough to match rephrasings of the same short question; uses a
+    stable hash so vectors stay valid across processes and restarts.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Iterable[tuple]:
+        words = [w for w in normalize_text(text).split() if w not in STOPWORDS]
+        for word in words:
+            yield word, 2.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}", 1.0
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class OllamaEmbedder:
+    """Embeddings from an Ollama embedding model (e.g. nomic-embed-text)"""
+
+    def __init__(self, model: str, host: str, timeout: float = 2.0):
+        self.model = model
+        self.host = host.rstrip('/')
+        self.timeout = timeout
+        self.name = f"ollama-{model}"
+
+    def embed(self, text: str) -> np.ndarray:
+        import requests
+        resp = requests.post(
+            f"{self.host}/api/embeddings",
+            json={"model": self.model, "prompt": normalize_text(text)},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        vector = np.asarray(resp.json()["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """Fixed-capacity vector matrix plus entry metadata, saved together as one .npz
+
+    Several workers share the file: each save merges what the others
+    saved before writing, so no worker's entries are dropped.
+    """
+
+    def __init__(self, dim: int, max_entries: int):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.entries: List[dict] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def search(self, vector: np.ndarray, intent: str, now: float):
+        """Index and cosine similarity of the best live entry for intent"""
+        if not self.entries:
+            return None, 0.0
+        scores = self.vectors @ vector
+        for i, entry in enumerate(self.entries):
+            if entry['intent'] != intent or entry['expires'] <= now:
+                scores[i] = -1.0
+        best = int(np.argmax(scores))
+        return best, float(scores[best])
+
+    def add(self, vector: np.ndarray, entry: dict, now: float) -> int:
+        if len(self.entries) >= self.max_entries:
+            self._evict(now)
+        self.vectors = np.vstack([self.vectors, vector[None, :]])
+        self.entries.append(entry)
+        return len(self.entries) - 1
+
+    def _evict(self, now: float):
+        """Drop expired entries, or the least recently used one if none expired"""
+        keep = [i for i, e in enumerate(self.entries) if e['expires'] > now]
+        if len(keep) >= self.max_entries:
+            lru = min(keep, key=lambda i: self.entries[i]['last_used'])
+            keep.remove(lru)
+        self.vectors = self.vectors[keep]
+        self.entries = [self.entries[i] for i in keep]
+
+    def merge(self, vectors: np.ndarray, entries: List[dict], now: float):
+        """Take in entries another process saved: new questions are added,
+        and for a question both have the newer answer wins"""
+        known = {_entry_key(e): i for i, e in enumerate(self.entries)}
+        added_vectors, added_entries = [], []
+        for vector, entry in zip(vectors, entries):
+            if entry['expires'] <= now:
+                continue
+            i = known.get(_entry_key(entry))
+            if i is None:
+                added_vectors.append(vector)
+                added_entries.append(entry)
+                continue
+            mine = self.entries[i]
+            if entry['created'] > mine['created']:
+                self.vectors[i] = vector
+                self.entries[i] = mine = dict(entry)
+            mine['hits'] = max(mine['hits'], entry['hits'])
+            mine['last_used'] = max(mine['last_used'], entry['last_used'])
+        if added_entries:
+            self.vectors = np.vstack([self.vectors, np.asarray(added_vectors, dtype=np.float32)])
+            self.entries.extend(added_entries)
+        # Live entries first, then the most recently used up to capacity
+        keep = [i for i, e in enumerate(self.entries) if e['expires'] > now]
+        if len(keep) > self.max_entries:
+            keep = sorted(keep, key=lambda i: self.entries[i]['last_used'])[-self.max_entries:]
+            keep.sort()
+        self.vectors = self.vectors[keep]
+        self.entries = [self.entries[i] for i in keep]
+
+    def save(self, path: Path, embedder_name: str, now: float):
+        """Merge in what other workers saved, then write one .npz renamed into place
+
+        Workers share the file, so it is read and rewritten under a lock
+        file; the rename keeps readers from ever pairing vectors from one
+        save with entries from another.
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        with _locked(path / (INDEX_FILE + ".lock")):
+            saved = _read_index(path, embedder_name, self.dim)
+            if saved is not None:
+                self.merge(*saved, now)
+            meta = json.dumps({"embedder": embedder_name, "entries": self.entries})
+            fd, tmp = tempfile.mkstemp(dir=path, prefix=INDEX_FILE + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, vectors=self.vectors,
+                             meta=np.frombuffer(meta.encode('utf-8'), dtype=np.uint8))
+                os.replace(tmp, path / INDEX_FILE)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+
+    def load(self, path: Path, embedder_name: str, now: float):
+        saved = _read_index(path, embedder_name, self.dim)
+        if saved is None:
+            return
+        vectors, entries = saved
+        keep = [i for i, e in enumerate(entries) if e['expires'] > now][-self.max_entries:]
+        self.vectors = vectors[keep].astype(np.float32)
+        self.entries = [entries[i] for i in keep]
+
+
+def _entry_key(entry: dict) -> tuple:
+    return entry['intent'], normalize_text(entry['text'])
+
+
+def _read_index(path: Path, embedder_name: str, dim: int):
+    """(vectors, entries) saved at path, or None if missing or unusable"""
+    try:
+        with np.load(path / INDEX_FILE) as data:
+            vectors = data["vectors"]
+            meta = json.loads(data["meta"].tobytes().decode('utf-8'))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring unreadable response cache at %s: %s", path, e)
+        return None
+    if meta.get("embedder") != embedder_name or vectors.shape != (len(meta["entries"]), dim):
+        logger.info("Response cache at %s was built with another embedder, ignoring it", path)
+        return None
+    return vectors.astype(np.float32), meta["entries"]
+
+
+@contextmanager
+def _locked(lock_path: Path):
+    """Exclusive lock shared by worker processes (no-op without fcntl)"""
+    with open(lock_path, "a") as f:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ResponseCache:
+    """Similarity-keyed answer cache with per-entry TTL and freshness rules
+
+    get() returns a cached answer or None; put() stores an answer together
+    with the upstream latency it took, which is what a later hit saves.
+    """
+
+    def __init__(
+        self,
+        embedder=None,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        intents: Iterable[str] = ("CONVERSATION",),
+        threshold: float = 0.9,
+        ttl: float = 86400,
+        max_entries: int = 2000,
+        bypass_keywords: Iterable[str] = DEFAULT_BYPASS_KEYWORDS,
+        save_interval: float = 30.0,
+    ):
+        self.embedder = embedder or HashingEmbedder()
+        self.path = Path(path) if path else None
+        self.intents = set(intents)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.save_interval = save_interval
+        self._bypass = re.compile(r"\b(" + "|".join(map(re.escape, bypass_keywords)) + r")\b")
+        self._follow_up = re.compile(r"\b(" + "|".join(FOLLOW_UP_WORDS) + r")\b")
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.time()
+        self._stats: Dict[str, dict] = {}
+
+        try:
+            dim = len(self.embedder.embed("probe"))
+        except Exception as e:
+            logger.warning("%s unavailable (%s), using hashed embeddings", self.embedder.name, e)
+            self.embedder = HashingEmbedder()
+            dim = self.embedder.dim
+        self.index = VectorIndex(dim, max_entries)
+        if self.path:
+            self.index.load(self.path, self.embedder.name, time.time())
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> Optional["ResponseCache"]:
+        """Build from the `response_cache` section of config.yaml (None if disabled)"""
+        config = config or {}
+        if not config.get('enabled', True):
+            return None
+        embedder = None
+        if config.get('embedder', 'hashing') == 'ollama':
+            embedder = OllamaEmbedder(
+                config.get('embedding_model', 'nomic-embed-text'),
+                os.getenv('OLLAMA_HOST', 'http://localhost:11434'),
+            )
+        return cls(
+            embedder=embedder,
+            path=config.get('path', DEFAULT_CACHE_PATH),
+            intents=config.get('intents', ['CONVERSATION']),
+            threshold=config.get('similarity_threshold', 0.9),
+            ttl=config.get('ttl', 86400),
+            max_entries=config.get('max_entries', 2000),
+            bypass_keywords=config.get('bypass_keywords', DEFAULT_BYPASS_KEYWORDS),
+            save_interval=config.get('save_interval', 30.0),
+        )
+
+    def bypass_reason(self, text: str) -> Optional[str]:
+        """Why this utterance must not be served from cache (None if cacheable)"""
+        normalized = normalize_text(text)
+        if not normalized:
+            return "empty"
+        if self._bypass.search(normalized):
+            return "time_sensitive"
+        if normalized.startswith(FOLLOW_UP_PREFIXES) or self._follow_up.search(normalized):
+            return "follow_up"
+        return None
+
+    def _counters(self, intent: str) -> dict:
+        return self._stats.setdefault(intent, {
+            'hits': 0, 'misses': 0, 'bypassed': 0, 'saved_ms': 0.0,
+        })
+
+    def get(self, text: str, intent: str) -> Optional[str]:
+        if intent not in self.intents:
+            return None
+        start = time.perf_counter()
+        if self.bypass_reason(text):
+            with self._lock:
+                self._counters(intent)['bypassed'] += 1
+            return None
+        try:
+            vector = self.embedder.embed(text)
+        except Exception as e:
+            logger.warning("Embedding failed, skipping response cache: %s", e)
+            return None
+
+        now = time.time()
+        with self._lock:
+            counters = self._counters(intent)
+            i, score = self.index.search(vector, intent, now)
+            if i is None or score < self.threshold:
+                counters['misses'] += 1
+                return None
+            entry = self.index.entries[i]
+            entry['hits'] += 1
+            entry['last_used'] = now
+            counters['hits'] += 1
+            lookup_ms = (time.perf_counter() - start) * 1000
+            counters['saved_ms'] += max(0.0, entry['latency_ms'] - lookup_ms)
+        logger.debug("Response cache hit (%.2f): %r ~ %r", score, text, entry['text'])
+        return entry['response']
+
+    def put(self, text: str, intent: str, response: str, latency: float,
+            ttl: Optional[float] = None):
+        """Store an upstream answer that took `latency` seconds to produce"""
+        if intent not in self.intents or not response or self.bypass_reason(text):
+            return
+        try:
+            vector = self.embedder.embed(text)
+        except Exception as e:
+            logger.warning("Embedding failed, not caching response: %s", e)
+            return
+
+        now = time.time()
+        entry = {
+            'text': text,
+            'intent': intent,
+            'response': response,
+            'created': now,
+            'expires': now + (self.ttl if ttl is None else ttl),
+            'last_used': now,
+            'hits': 0,
+            'latency_ms': latency * 1000,
+        }
+        with self._lock:
+            i, score = self.index.search(vector, intent, now)
+            if i is not None and score >= self.threshold:
+                # Same question again (e.g. coalesced callers): refresh it
+                entry['hits'] = self.index.entries[i]['hits']
+                self.index.entries[i] = entry
+            else:
+                self.index.add(vector, entry, now)
+            self._dirty = True
+            if now - self._last_save >= self.save_interval:
+                self._save()
+
+    def _save(self):
+        if not self.path or not self._dirty:
+            return
+        try:
+            self.index.save(self.path, self.embedder.name, time.time())
+        except OSError as e:
+            logger.warning("Could not save response cache to %s: %s", self.path, e)
+        self._dirty = False
+        self._last_save = time.time()
+
+    def flush(self):
+        """Write pending entries to disk"""
+        with self._lock:
+            self._save()
+
+    def stats(self) -> Dict[str, dict]:
+        """Hit rate and latency saved per intent"""
+        with self._lock:
+            intents = {}
+            for intent, c in self._stats.items():
+                lookups = c['hits'] + c['misses']
+                intents[intent] = {
+                    **c,
+                    'saved_ms': round(c['saved_ms'], 1),
+                    'hit_rate': round(c['hits'] / lookups, 3) if lookups else None,
+                }
+            return {'entries': len(self.index), 'intents': intents}
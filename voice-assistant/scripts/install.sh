@@ -141,6 +141,11 @@ fi
 cd ..
 echo ""
 
+# Pick Whisper model size, compute type and threads for this CPU
+echo "Tuning Whisper for this machine (benchmarks a few configurations)..."
+python autotune.py --write || echo "✗ Autotune failed, keeping config.yaml defaults"
+echo ""
+
 # Create logs directory
 mkdir -p logs
 
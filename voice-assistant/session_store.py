@@ -0,0 +1,273 @@
+"""
+Pluggable session store for the streaming server
+In-memory backend for a single process, SQLite (WAL) backend to share
+sessions and Socket.IO fan-out between several worker processes. SQLite
+writes are versioned: a put based on a stale copy merges the stored state
+in and retries instead of overwriting it.
+"""
+
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger('VoiceAssistant.sessions')
+
+DEFAULT_DB_PATH = "session_store.db"
+
+
+class MemorySessionStore:
+    """Process-local store holding live session objects"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str):
+        return self._sessions.get(session_id)
+
+    def put(self, session):
+        with self._lock:
+            self._sessions[session.session_id] = session
+
+    def update(self, session_id: str, change: Callable[[Any], None], create: Callable[[str], Any]):
+        """Apply change() to the stored session (created if unknown)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = create(session_id)
+        change(session)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict_idle(self, now: float, timeout: float) -> List[str]:
+        """Remove sessions idle for longer than timeout, return their ids"""
+        with self._lock:
+            evicted = [
+                sid for sid, session in self._sessions.items()
+                if session.is_idle(now, timeout)
+            ]
+            for sid in evicted:
+                del self._sessions[sid]
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """Shared store: sessions serialized as JSON in a WAL-mode SQLite file
+
+    Sessions must provide `session_id`, `last_active`, `is_processing`,
+    `to_state()` and `merge_state(state)`; `loader` rebuilds a session from
+    that state dict. Each row carries a version: get() records it on the
+    session as `store_version`, and put() only writes over that version.
+    When another writer got there first, the stored state is merged into
+    the session and the write retried.
+    """
+
+    MAX_PUT_ATTEMPTS = 5
+
+    def __init__(self, path: str, loader: Callable[[dict], Any]):
+        self.path = path
+        self.loader = loader
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " last_active REAL NOT NULL,"
+            " is_processing INTEGER NOT NULL DEFAULT 0,"
+            " version INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if 'version' not in columns:
+            # Databases created before writes were versioned
+            conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str):
+        row = self._conn().execute(
+            "SELECT state, version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        session = self.loader(json.loads(row[0]))
+        session.store_version = row[1]
+        return session
+
+    def put(self, session):
+        conn = self._conn()
+        for _ in range(self.MAX_PUT_ATTEMPTS):
+            version = getattr(session, 'store_version', None)
+            state = json.dumps(session.to_state())
+            if version is None:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO sessions"
+                    " (session_id, state, last_active, is_processing, version)"
+                    " VALUES (?, ?, ?, ?, 1)",
+                    (session.session_id, state, session.last_active, int(session.is_processing)),
+                )
+            else:
+                cursor = conn.execute(
+                    "UPDATE sessions SET state = ?, last_active = ?, is_processing = ?,"
+                    " version = version + 1 WHERE session_id = ? AND version = ?",
+                    (state, session.last_active, int(session.is_processing),
+                     session.session_id, version),
+                )
+            conn.commit()
+            if cursor.rowcount == 1:
+                session.store_version = (version or 0) + 1
+                return
+
+            row = conn.execute(
+                "SELECT state, version FROM sessions WHERE session_id = ?", (session.session_id,)
+            ).fetchone()
+            if row is None:
+                # Evicted meanwhile: write it back as a new row
+                session.store_version = None
+                continue
+            # Written by someone else since we read it: take their additions and retry
+            session.merge_state(json.loads(row[0]))
+            session.store_version = row[1]
+        raise RuntimeError(f"Session {session.session_id} kept changing; gave up after "
+                           f"{self.MAX_PUT_ATTEMPTS} attempts")
+
+    def update(self, session_id: str, change: Callable[[Any], None], create: Callable[[str], Any]):
+        """Read-modify-write of the stored session (created if unknown); races merge in put()"""
+        session = self.get(session_id) or create(session_id)
+        change(session)
+        self.put(session)
+
+    def delete(self, session_id: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+
+    def evict_idle(self, now: float, timeout: float) -> List[str]:
+        conn = self._conn()
+        cutoff = now - timeout
+        rows = conn.execute(
+            "SELECT session_id FROM sessions WHERE last_active < ? AND is_processing = 0",
+            (cutoff,),
+        ).fetchall()
+        conn.execute(
+            "DELETE FROM sessions WHERE last_active < ? AND is_processing = 0", (cutoff,)
+        )
+        conn.commit()
+        return [row[0] for row in rows]
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a SQLite connection tuned for many small concurrent writes"""
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def create_session_store(config: Optional[dict], loader: Callable[[dict], Any]):
+    """Build the store selected by the `session_store` section of config.yaml"""
+    config = config or {}
+    backend = config.get('backend', 'memory')
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'sqlite':
+        path = config.get('path', DEFAULT_DB_PATH)
+        logger.info("Using SQLite session store at %s", path)
+        return SQLiteSessionStore(path, loader)
+    raise ValueError(f"Unknown session_store backend: {backend}")
+
+
+def create_client_manager(config: Optional[dict]):
+    """Socket.IO client manager that fans emits out through the session store
+
+    Returns None for the memory backend (single process, default manager).
+    With the SQLite backend every worker publishes emits into a shared table
+    and polls it, so an emit to a room reaches whichever worker holds the
+    client's connection.
+    """
+    config = config or {}
+    if config.get('backend', 'memory') != 'sqlite':
+        return None
+
+    import socketio
+
+    path = config.get('path', DEFAULT_DB_PATH)
+    poll_interval = config.get('poll_interval', 0.02)
+    retention = config.get('message_retention', 60)
+
+    class SQLiteClientManager(socketio.PubSubManager):
+        name = 'sqlite'
+
+        def __init__(self, channel='socketio', write_only=False, logger=None):
+            super().__init__(channel=channel, write_only=write_only, logger=logger)
+            self._local = threading.local()
+            conn = self._conn()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS socketio_messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " channel TEXT NOT NULL,"
+                " payload BLOB NOT NULL,"
+                " created REAL NOT NULL)"
+            )
+            conn.commit()
+
+        def _conn(self) -> sqlite3.Connection:
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = connect(path)
+                self._local.conn = conn
+            return conn
+
+        def _publish(self, data):
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO socketio_messages (channel, payload, created) VALUES (?, ?, ?)",
+                (self.channel, pickle.dumps(data), time.time()),
+            )
+            conn.commit()
+
+        def _listen(self):
+            conn = self._conn()
+            last_id = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM socketio_messages"
+            ).fetchone()[0]
+            last_prune = time.time()
+            while True:
+                rows = conn.execute(
+                    "SELECT id, payload FROM socketio_messages"
+                    " WHERE id > ? AND channel = ? ORDER BY id",
+                    (last_id, self.channel),
+                ).fetchall()
+                for row_id, payload in rows:
+                    last_id = row_id
+                    yield pickle.loads(payload)
+
+                now = time.time()
+                if now - last_prune > retention:
+                    conn.execute(
+                        "DELETE FROM socketio_messages WHERE created < ?", (now - retention,)
+                    )
+                    conn.commit()
+                    last_prune = now
+                self.server.sleep(poll_interval)
+
+    return SQLiteClientManager()
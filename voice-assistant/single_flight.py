@@ -0,0 +1,140 @@
+"""
+Request coalescing ("single flight") for identical concurrent queries
+The first caller for a key runs the upstream call; callers arriving while
+it is in flight wait for and share its result. With cancellation tokens a
+shared call is aborted only once every caller waiting for it has gone.
+"""
+
+import asyncio
+import re
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+from cancellation import CancelToken, submit
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Case, punctuation and whitespace-insensitive form of an utterance"""
+    text = _PUNCTUATION.sub(" ", (text or "").lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class SingleFlight:
+    """Merges in-flight calls with the same key into one upstream call
+
+    Works for threads (do) and coroutines (ado). In-flight calls are
+    tracked with concurrent.futures.Future, so async callers on different
+    event loops (e.g. one loop per Flask request) can still share a call.
+    Only use it for calls without side effects.
+    """
+
+    def __init__(self, intents: Optional[Iterable[str]] = None):
+        self.intents = set(intents or ())
+        self._inflight: Dict[Hashable, Future] = {}
+        # Cancellable flights: key -> [flight token, callers still waiting]
+        self._flights: Dict[Hashable, List] = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    @classmethod
+    def from_config(cls, config: Optional[dict], name: str) -> "SingleFlight":
+        """Build from `coalescing.<name>` (list of intents to coalesce)"""
+        config = config or {}
+        return cls(config.get(name, []))
+
+    def enabled_for(self, intent: str) -> bool:
+        return intent in self.intents
+
+    def _join(self, key: Hashable):
+        """Return (future, is_leader)"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            self.stats['leaders'] += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None,
+                error: Optional[BaseException] = None):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                self._flights.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[..., Any], token: Optional[CancelToken] = None) -> Any:
+        """fn() once for all concurrent callers with this key
+
+        With a token, fn(flight_token) runs on a helper thread. Each caller
+        stops waiting as soon as its own token is cancelled; flight_token
+        is cancelled (fn should abort its request on it) once no caller is
+        waiting any more.
+        """
+        if token is not None:
+            return self._do_cancellable(key, fn, token)
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def _do_cancellable(self, key: Hashable, fn: Callable[[CancelToken], Any], token: CancelToken) -> Any:
+        token.check()
+        with self._lock:
+            flight = self._flights.get(key)
+            future = self._inflight.get(key)
+            if flight is None or flight[0].cancelled:
+                # Nothing in flight, or only an abandoned call still winding down
+                future = self._inflight[key] = Future()
+                flight = self._flights[key] = [CancelToken(), 0]
+                self.stats['leaders'] += 1
+                leader = True
+            else:
+                self.stats['coalesced'] += 1
+                leader = False
+            flight[1] += 1
+
+        if leader:
+            def run():
+                try:
+                    result = fn(flight[0])
+                except BaseException as e:
+                    self._finish(key, future, error=e)
+                else:
+                    self._finish(key, future, result)
+            submit(run)
+
+        try:
+            return token.wait(future)
+        finally:
+            with self._lock:
+                flight[1] -= 1
+                abandoned = flight[1] == 0 and not future.done()
+            if abandoned:
+                flight[0].cancel("abandoned")
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
@@ -0,0 +1,314 @@
+"""
+Non-blocking TOOLS execution queue
+Runs n8n tool calls on a bounded worker pool, tracks job state in a
+persistent store and reports progress/results through a callback
+"""
+
+import asyncio
+import contextvars
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from session_store import DEFAULT_DB_PATH, connect
+from tracing import start_span
+
+logger = logging.getLogger('VoiceAssistant.tools')
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+
+class ToolQueueFull(Exception):
+    """Raised when too many tool jobs are already pending"""
+
+
+class MemoryJobStore:
+    """Process-local job store"""
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: dict):
+        with self._lock:
+            self._jobs[job['job_id']] = dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def for_session(self, session_id: str) -> List[dict]:
+        with self._lock:
+            jobs = [dict(j) for j in self._jobs.values() if j['session_id'] == session_id]
+        return sorted(jobs, key=lambda j: j['created'])
+
+    def unfinished(self) -> List[dict]:
+        with self._lock:
+            return [dict(j) for j in self._jobs.values() if j['status'] not in FINISHED_STATES]
+
+    def prune(self, before: float):
+        with self._lock:
+            for job_id in [k for k, j in self._jobs.items() if j['updated'] < before]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Job store shared by worker processes (same file as the session store)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tool_jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " session_id TEXT NOT NULL,"
+            " job TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS tool_jobs_session ON tool_jobs (session_id)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def save(self, job: dict):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO tool_jobs (job_id, session_id, job, created, updated)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (job['job_id'], job['session_id'], json.dumps(job), job['created'], job['updated']),
+        )
+        conn.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT job FROM tool_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def for_session(self, session_id: str) -> List[dict]:
+        rows = self._conn().execute(
+            "SELECT job FROM tool_jobs WHERE session_id = ? ORDER BY created", (session_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def unfinished(self) -> List[dict]:
+        rows = self._conn().execute("SELECT job FROM tool_jobs ORDER BY created").fetchall()
+        jobs = [json.loads(row[0]) for row in rows]
+        return [j for j in jobs if j['status'] not in FINISHED_STATES]
+
+    def prune(self, before: float):
+        conn = self._conn()
+        conn.execute("DELETE FROM tool_jobs WHERE updated < ?", (before,))
+        conn.commit()
+
+
+def _alive(pid: Optional[int]) -> bool:
+    """Whether another process with this pid is running"""
+    if not pid or pid == os.getpid():
+        # Our own pid on a job we never submitted: a crashed earlier process
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def create_job_store(config: Optional[dict]):
+    """Job store matching the configured session store backend"""
+    config = config or {}
+    if config.get('backend', 'memory') == 'sqlite':
+        return SQLiteJobStore(config.get('path', DEFAULT_DB_PATH))
+    return MemoryJobStore()
+
+
+class ToolJobQueue:
+    """Bounded pool for tool calls that returns a job id immediately
+
+    `on_event(event, job)` is called with 'tool_progress' when a job changes
+    state and 'tool_result' when it finishes. Runners may be plain functions
+    or coroutine functions; coroutines run on a private event loop in the
+    worker thread.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        max_workers: int = 2,
+        max_pending: int = 20,
+        retention: float = 3600,
+        on_event: Optional[Callable[[str, dict], None]] = None,
+    ):
+        self.store = store or MemoryJobStore()
+        self.max_pending = max_pending
+        self.retention = retention
+        self.on_event = on_event
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tool-job')
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._futures = {}  # job_id -> Future, guarded by _lock
+
+    @classmethod
+    def from_config(cls, config: Optional[dict], store_config: Optional[dict] = None,
+                    on_event: Optional[Callable[[str, dict], None]] = None) -> "ToolJobQueue":
+        """Build from the `tools` and `session_store` sections of config.yaml"""
+        config = config or {}
+        return cls(
+            store=create_job_store(store_config),
+            max_workers=config.get('max_concurrent', 2),
+            max_pending=config.get('max_pending', 20),
+            retention=config.get('result_retention', 3600),
+            on_event=on_event,
+        )
+
+    def submit(self, session_id: str, text: str, runner: Callable[..., Any], *args) -> dict:
+        """Queue runner(*args) for a session and return the new job"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ToolQueueFull(f"{self._pending} tool jobs already pending")
+            self._pending += 1
+
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex[:12],
+            "session_id": session_id,
+            "text": text,
+            "status": QUEUED,
+            "result": None,
+            "error": None,
+            "acked": False,
+            "worker": os.getpid(),
+            "created": now,
+            "updated": now,
+        }
+        self.store.save(job)
+        self._emit('tool_progress', job)
+        job_id = job['job_id']
+        # Run in a copy of the caller's context so the job joins its trace
+        ctx = contextvars.copy_context()
+        future = self._executor.submit(ctx.run, self._run, job, runner, args)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return job
+
+    def _forget(self, job_id: str):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def recover(self) -> int:
+        """Fail jobs left queued/running by a worker process that is gone
+
+        Runners are not persisted, so such a job cannot be resumed; failing
+        it delivers an error result (replayed until acked) instead of a
+        progress state that never ends. Call once at startup.
+        """
+        recovered = 0
+        for job in self.store.unfinished():
+            with self._lock:
+                ours = job['job_id'] in self._futures
+            if ours or _alive(job.get('worker')):
+                continue
+            self._update(job, status=FAILED, error="interrupted by a server restart")
+            self._emit('tool_result', job)
+            recovered += 1
+        if recovered:
+            logger.warning("Marked %d tool job(s) from stopped workers as failed", recovered)
+        return recovered
+
+    def _run(self, job: dict, runner: Callable[..., Any], args: tuple):
+        try:
+            self._update(job, status=RUNNING)
+            self._emit('tool_progress', job)
+            with start_span('tool_job', job_id=job['job_id']):
+                if inspect.iscoroutinefunction(runner):
+                    result = asyncio.run(runner(*args))
+                else:
+                    result = runner(*args)
+            if isinstance(result, dict) and result.get('error'):
+                self._update(job, status=FAILED, error=str(result['error']))
+            else:
+                self._update(job, status=DONE, result=result)
+        except Exception as e:
+            logger.error("Tool job %s failed: %s", job['job_id'], e)
+            self._update(job, status=FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self._emit('tool_result', job)
+        self.store.prune(time.time() - self.retention)
+
+    def _update(self, job: dict, **changes):
+        job.update(changes)
+        job['updated'] = time.time()
+        self.store.save(job)
+
+    def _emit(self, event: str, job: dict):
+        if self.on_event:
+            try:
+                self.on_event(event, dict(job))
+            except Exception as e:
+                logger.error("Tool event callback failed: %s", e)
+
+    def ack(self, job_id: str, session_id: str) -> bool:
+        """Session confirmed it received the result; stop replaying it
+
+        Only the job's own session can ack it, and only once it finished.
+        """
+        job = self.store.get(job_id)
+        if not job or job['session_id'] != session_id or job['status'] not in FINISHED_STATES:
+            return False
+        if not job['acked']:
+            self._update(job, acked=True)
+        return True
+
+    def unacked(self, session_id: str) -> List[dict]:
+        """Jobs whose result the session has not acknowledged yet"""
+        return [j for j in self.store.for_session(session_id) if not j['acked']]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until all jobs submitted from this process have finished"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            try:
+                future.result(timeout=remaining)
+            except Exception:
+                pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def result_text(job: dict) -> str:
+    """Spoken summary of a finished job"""
+    if job['status'] == FAILED:
+        return f"Sorry, that didn't work: {job['error']}"
+    result = job.get('result')
+    if isinstance(result, dict):
+        return result.get('output') or result.get('message') or 'Tools executed'
+    return str(result) if result else 'Tools executed'
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Per-turn request tracing
+Every voice turn gets a trace ID and a span per stage (preprocess, Whisper,
+intent, n8n, Ollama, replay...). The trace ID is sent to n8n in the
+payload and a W3C `traceparent` header so workflow timings can be
+correlated. Finished spans are exported in the background to a JSON-lines
+file or an OTLP/HTTP collector.
+
+Usage:
+    python tracing.py waterfall logs/traces.jsonl --top 5   # slowest turns
+    python tracing.py collect --port 4318 --out logs/traces.jsonl
+"""
+
+import abc
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger('VoiceAssistant.tracing')
+
+DEFAULT_TRACE_FILE = "logs/traces.jsonl"
+
+
+class Span:
+    """One timed operation within a trace"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'sampled',
+                 'start', 'end', 'attributes', '_started')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start = time.time()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.end = self.start + (time.perf_counter() - self._started)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else self.start + (time.perf_counter() - self._started)
+        return (end - self.start) * 1000
+
+    def as_dict(self, service: Optional[str] = None) -> dict:
+        data = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration_ms, 2),
+            'attributes': self.attributes,
+        }
+        if service:
+            data['service'] = service
+        return data
+
+
+class _BatchExporter(abc.ABC):
+    """Background thread that ships finished spans in batches; subclasses define write()"""
+
+    def __init__(self, service: Optional[str], batch_size: int = 100,
+                 interval: float = 1.0, queue_size: int = 10000):
+        self.service = service
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass  # Never block a request on tracing
+
+    def _drain(self) -> List[Span]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.warning("Span export failed: %s", e)
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+        self.flush()
+
+    @abc.abstractmethod
+    def write(self, spans: List[Span]):
+        """Send one batch; exceptions are logged and the batch dropped"""
+
+
+class FileExporter(_BatchExporter):
+    """Appends one JSON object per span to a local file"""
+
+    def __init__(self, path: str, service: Optional[str] = None, **kwargs):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(service, **kwargs)
+
+    def write(self, spans: List[Span]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.as_dict(self.service), default=str) + "\n")
+
+
+class OTLPExporter(_BatchExporter):
+    """Posts spans as OTLP/HTTP JSON to `<endpoint>/v1/traces`"""
+
+    def __init__(self, endpoint: str, service: Optional[str] = None, timeout: float = 2.0, **kwargs):
+        self.url = endpoint.rstrip('/') + "/v1/traces"
+        self.timeout = timeout
+        super().__init__(service, **kwargs)
+
+    def write(self, spans: List[Span]):
+        import requests
+        requests.post(self.url, json=to_otlp(spans, self.service), timeout=self.timeout)
+
+
+def to_otlp(spans: List[Span], service: Optional[str]) -> dict:
+    def attr(key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': [attr('service.name', service or 'voice-assistant')]},
+        'scopeSpans': [{
+            'scope': {'name': 'voice-assistant'},
+            'spans': [{
+                'traceId': s.trace_id,
+                'spanId': s.span_id,
+                'parentSpanId': s.parent_id or '',
+                'name': s.name,
+                'startTimeUnixNano': str(int(s.start * 1e9)),
+                'endTimeUnixNano': str(int((s.end or s.start) * 1e9)),
+                'attributes': [attr(k, v) for k, v in s.attributes.items()],
+            } for s in spans],
+        }],
+    }]}
+
+
+def from_otlp(payload: dict) -> List[dict]:
+    """Flat span dicts (as written by FileExporter) from an OTLP JSON body"""
+    spans = []
+    for resource_spans in payload.get('resourceSpans', []):
+        service = None
+        for a in resource_spans.get('resource', {}).get('attributes', []):
+            if a['key'] == 'service.name':
+                service = a['value'].get('stringValue')
+        for scope in resource_spans.get('scopeSpans', []):
+            for s in scope.get('spans', []):
+                start = int(s['startTimeUnixNano']) / 1e9
+                end = int(s['endTimeUnixNano']) / 1e9
+                spans.append({
+                    'trace_id': s['traceId'],
+                    'span_id': s['spanId'],
+                    'parent_id': s.get('parentSpanId') or None,
+                    'name': s['name'],
+                    'start': start,
+                    'duration_ms': round((end - start) * 1000, 2),
+                    'attributes': {a['key']: next(iter(a['value'].values()))
+                                   for a in s.get('attributes', [])},
+                    'service': service,
+                })
+    return spans
+
+
+_current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+_state = {'pid': None, 'exporter': None, 'sample_rate': 1.0}
+_state_lock = threading.Lock()
+
+
+def setup_tracing(config: Optional[dict] = None, service: Optional[str] = None):
+    """Configure span export from the `tracing` section of config.yaml
+
+    Runs once per process (again after fork, the export thread does not survive it).
+    """
+    config = config or {}
+    with _state_lock:
+        if _state['pid'] == os.getpid():
+            return
+        exporter = None
+        kind = config.get('exporter', 'file') if config.get('enabled', True) else 'none'
+        try:
+            if kind == 'file':
+                exporter = FileExporter(config.get('path', DEFAULT_TRACE_FILE), service)
+            elif kind == 'otlp':
+                exporter = OTLPExporter(config.get('endpoint', 'http://localhost:4318'), service)
+        except OSError as e:
+            logger.warning("Tracing disabled: %s", e)
+        if exporter and _state['pid'] is None:
+            atexit.register(shutdown_tracing)
+        _state.update(pid=os.getpid(), exporter=exporter,
+                      sample_rate=config.get('sample_rate', 1.0))
+
+
+def shutdown_tracing():
+    """Flush spans that have not been exported yet"""
+    exporter = _state['exporter']
+    if exporter and _state['pid'] == os.getpid():
+        exporter.shutdown()
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def start_span(name: str, trace_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+    """Child of the current span, or the root of a new trace"""
+    parent = _current.get()
+    if parent is not None and trace_id in (None, parent.trace_id):
+        span = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+    else:
+        sampled = random.random() < _state['sample_rate']
+        span = Span(name, trace_id or new_trace_id(), None, sampled, attributes)
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.attributes['error'] = repr(e)
+        raise
+    finally:
+        span.finish()
+        _current.reset(token)
+        exporter = _state['exporter']
+        if span.sampled and exporter is not None:
+            exporter.export(span)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace_id if span else None
+
+
+def inject_headers(headers: Optional[dict] = None) -> dict:
+    """Add W3C traceparent and X-Trace-Id headers for the current span"""
+    headers = dict(headers or {})
+    span = _current.get()
+    if span is not None:
+        flags = '01' if span.sampled else '00'
+        headers['traceparent'] = f"00-{span.trace_id}-{span.span_id}-{flags}"
+        headers['X-Trace-Id'] = span.trace_id
+    return headers
+
+
+# --- CLI -------------------------------------------------------------------
+
+def load_spans(path: str) -> Dict[str, List[dict]]:
+    traces: Dict[str, List[dict]] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                span = json.loads(line)
+                traces.setdefault(span['trace_id'], []).append(span)
+    return traces
+
+
+def format_waterfall(spans: List[dict], width: int = 50) -> str:
+    """Indented span tree with bars positioned on the trace timeline"""
+    roots = [s for s in spans if not s.get('parent_id')] or spans[:1]
+    root = max(roots, key=lambda s: s['duration_ms'])
+    t0 = min(s['start'] for s in spans)
+    total = max(s['start'] * 1000 + s['duration_ms'] for s in spans) - t0 * 1000
+    total = max(total, 1e-6)
+    children: Dict[Optional[str], List[dict]] = {}
+    for s in spans:
+        children.setdefault(s.get('parent_id'), []).append(s)
+
+    attrs = " ".join(f"{k}={v}" for k, v in root.get('attributes', {}).items() if k != 'error')
+    lines = [f"trace {root['trace_id']}  {root['name']}  {total:.0f}ms  {attrs}".rstrip()]
+
+    def walk(span, depth):
+        offset = (span['start'] - t0) * 1000
+        begin = int(offset / total * width)
+        length = max(1, int(round(span['duration_ms'] / total * width)))
+        bar = " " * begin + "█" * min(length, width - begin)
+        label = ("  " * depth + span['name'])[:28]
+        error = "  ERROR" if 'error' in span.get('attributes', {}) else ""
+        lines.append(f"  {label:<28} |{bar:<{width}}| {span['duration_ms']:>8.1f}ms{error}")
+        for child in sorted(children.get(span['span_id'], []), key=lambda s: s['start']):
+            walk(child, depth + 1)
+
+    for r in sorted(roots, key=lambda s: s['start']):
+        walk(r, 0)
+    return "\n".join(lines)
+
+
+def waterfall_main(path: str, top: int, name: Optional[str]):
+    traces = load_spans(path)
+
+    def trace_ms(spans):
+        roots = [s for s in spans if not s.get('parent_id')]
+        return max(s['duration_ms'] for s in (roots or spans))
+
+    selected = [spans for spans in traces.values()
+                if not name or any(s['name'] == name and not s.get('parent_id') for s in spans)]
+    selected.sort(key=trace_ms, reverse=True)
+    print(f"{len(selected)} traces in {path}, slowest {min(top, len(selected))}:\n")
+    for spans in selected[:top]:
+        print(format_waterfall(spans))
+        print()
+
+
+def collect_main(port: int, out: str):
+    """Minimal OTLP/HTTP JSON collector that stores spans for the waterfall"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/v1/traces':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                spans = from_otlp(json.loads(body))
+            except (ValueError, KeyError) as e:
+                self.send_response(400)
+                self.end_headers()
+                self.wfile.write(str(e).encode())
+                return
+            with lock, open(out, 'a', encoding='utf-8') as f:
+                for span in spans:
+                    f.write(json.dumps(span) + "\n")
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Collecting OTLP spans on http://0.0.0.0:{port}/v1/traces -> {out}")
+    ThreadingHTTPServer(('0.0.0.0', port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Voice assistant trace tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_water = sub.add_parser('waterfall', help="Print the slowest traces as waterfalls")
+    p_water.add_argument('path', nargs='?', default=DEFAULT_TRACE_FILE)
+    p_water.add_argument('--top', type=int, default=5)
+    p_water.add_argument('--name', help="Only traces whose root span has this name (e.g. audio_turn)")
+    p_collect = sub.add_parser('collect', help="Run a local OTLP/HTTP collector stand-in")
+    p_collect.add_argument('--port', type=int, default=4318)
+    p_collect.add_argument('--out', default=DEFAULT_TRACE_FILE)
+    args = parser.parse_args()
+
+    if args.command == 'waterfall':
+        if not os.path.exists(args.path):
+            sys.exit(f"No trace file at {args.path}")
+        waterfall_main(args.path, args.top, args.name)
+    else:
+        collect_main(args.port, args.out)
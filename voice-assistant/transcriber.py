@@ -0,0 +1,193 @@
+"""
+Adaptive Whisper decoding
+Clips are decoded greedily first (beam_size 1, several times cheaper than
+beam search). Only when a segment looks unreliable -- low avg_logprob, or
+high no_speech_prob on a segment that produced text -- is the clip decoded
+again with a wider beam. Tracks how many clips needed the fallback and
+estimates the decode time saved compared with always using the wide beam.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+from resilience import LatencyTracker
+
+logger = logging.getLogger('VoiceAssistant.transcriber')
+
+
+class Transcript:
+    """Text of one clip plus how it was decoded"""
+
+    __slots__ = ('text', 'duration', 'decode_seconds', 'fallback', 'avg_logprob', 'no_speech_prob',
+                 'model', 'route')
+
+    def __init__(self, text: str, duration: float, decode_seconds: float, fallback: bool,
+                 avg_logprob: Optional[float], no_speech_prob: Optional[float]):
+        self.text = text
+        self.duration = duration
+        self.decode_seconds = decode_seconds
+        self.fallback = fallback
+        self.avg_logprob = avg_logprob
+        self.no_speech_prob = no_speech_prob
+        self.model: Optional[str] = None  # Set by WhisperRouter
+        self.route: Optional[str] = None
+
+
+class Transcriber:
+    """Greedy-first decoding around a faster-whisper model"""
+
+    def __init__(
+        self,
+        model,
+        beam_size: int = 1,
+        fallback_beam_size: int = 5,
+        logprob_threshold: float = -1.0,
+        no_speech_threshold: float = 0.6,
+        vad_filter: bool = True,
+        min_silence_duration_ms: int = 500,
+        language: Optional[str] = None,
+    ):
+        self.model = model
+        self.beam_size = beam_size
+        self.fallback_beam_size = fallback_beam_size
+        self.logprob_threshold = logprob_threshold
+        self.no_speech_threshold = no_speech_threshold
+        self.vad_filter = vad_filter
+        self.min_silence_duration_ms = min_silence_duration_ms
+        self.language = language
+        self._lock = threading.Lock()
+        self._stats = {
+            'clips': 0,
+            'fallbacks': 0,
+            'audio_seconds': 0.0,
+            'first_pass_seconds': 0.0,
+            'fallback_audio_seconds': 0.0,
+            'fallback_pass_seconds': 0.0,
+        }
+        self._latency = LatencyTracker(window=500)
+
+    @classmethod
+    def from_config(cls, model, config: Optional[dict]) -> "Transcriber":
+        """Build from the `whisper` section of config.yaml"""
+        config = config or {}
+        return cls(
+            model,
+            beam_size=config.get('beam_size', 1),
+            fallback_beam_size=config.get('fallback_beam_size', 5),
+            logprob_threshold=config.get('logprob_threshold', -1.0),
+            no_speech_threshold=config.get('no_speech_threshold', 0.6),
+            vad_filter=config.get('vad_filter', True),
+            min_silence_duration_ms=config.get('min_silence_duration_ms', 500),
+            language=config.get('language'),
+        )
+
+    def _decode(self, audio, beam_size: int, token=None):
+        """One decoding pass: (segments, duration)"""
+        options = {
+            'beam_size': beam_size,
+            'vad_filter': self.vad_filter,
+            'language': self.language,
+        }
+        if self.vad_filter:
+            options['vad_parameters'] = {'min_silence_duration_ms': self.min_silence_duration_ms}
+        if beam_size <= 1:
+            # No temperature fallback either: re-decoding is our decision
+            options['temperature'] = 0.0
+        segments, info = self.model.transcribe(audio, **options)
+        # Segments are decoded lazily: stop decoding as soon as the turn is cancelled
+        decoded = []
+        for segment in segments:
+            if token is not None:
+                token.check()
+            decoded.append(segment)
+        return decoded, info.duration
+
+    def needs_fallback(self, segments) -> bool:
+        """True if any segment with text looks unreliable"""
+        for segment in segments:
+            if not segment.text.strip():
+                continue
+            if segment.avg_logprob < self.logprob_threshold:
+                return True
+            if segment.no_speech_prob > self.no_speech_threshold:
+                return True
+        return False
+
+    def transcribe(self, audio, token=None, beam_size: Optional[int] = None,
+                   fallback_beam_size: Optional[int] = None) -> Transcript:
+        """Transcribe a file path or 16 kHz float32 array
+
+        beam_size / fallback_beam_size override the configured values for
+        this clip (e.g. from the degradation tier); fallback 0 disables it.
+        """
+        beam_size = self.beam_size if beam_size is None else beam_size
+        fallback_beam_size = self.fallback_beam_size if fallback_beam_size is None else fallback_beam_size
+        if isinstance(audio, str):
+            # Decode the file once; a fallback pass reuses the samples
+            from faster_whisper import decode_audio
+            audio = decode_audio(audio)
+
+        start = time.perf_counter()
+        segments, duration = self._decode(audio, beam_size, token)
+        first_pass = time.perf_counter() - start
+
+        fallback = fallback_beam_size > beam_size and self.needs_fallback(segments)
+        fallback_pass = 0.0
+        if fallback:
+            logger.debug("Low-confidence clip, re-decoding with beam_size=%d", fallback_beam_size)
+            segments, duration = self._decode(audio, fallback_beam_size, token)
+            fallback_pass = time.perf_counter() - start - first_pass
+
+        with self._lock:
+            stats = self._stats
+            stats['clips'] += 1
+            stats['audio_seconds'] += duration
+            stats['first_pass_seconds'] += first_pass
+            if fallback:
+                stats['fallbacks'] += 1
+                stats['fallback_audio_seconds'] += duration
+                stats['fallback_pass_seconds'] += fallback_pass
+            self._latency.record(first_pass + fallback_pass)
+
+        return Transcript(
+            text=" ".join(s.text.strip() for s in segments).strip(),
+            duration=duration,
+            decode_seconds=first_pass + fallback_pass,
+            fallback=fallback,
+            avg_logprob=min((s.avg_logprob for s in segments), default=None),
+            no_speech_prob=max((s.no_speech_prob for s in segments), default=None),
+        )
+
+    def stats(self) -> dict:
+        """Fallback fraction, decode speed and estimated decode time saved"""
+        with self._lock:
+            s = dict(self._stats)
+            p50 = self._latency.quantile(50)
+            p95 = self._latency.quantile(95)
+
+        def rate(seconds, audio):
+            return round(seconds / audio, 4) if audio else None
+
+        first_rtf = rate(s['first_pass_seconds'], s['audio_seconds'])
+        beam_rtf = rate(s['fallback_pass_seconds'], s['fallback_audio_seconds'])
+        saved = None
+        if beam_rtf is not None:
+            # Cost of decoding everything with the wide beam minus what was spent
+            always_beam = s['audio_seconds'] * beam_rtf
+            saved = round(always_beam - s['first_pass_seconds'] - s['fallback_pass_seconds'], 2)
+        return {
+            'clips': s['clips'],
+            'fallbacks': s['fallbacks'],
+            'fallback_fraction': round(s['fallbacks'] / s['clips'], 4) if s['clips'] else None,
+            'audio_seconds': round(s['audio_seconds'], 1),
+            # Decode seconds per audio second
+            'first_pass_rtf': first_rtf,
+            'fallback_rtf': beam_rtf,
+            'decode_seconds_saved': saved,
+            'decode_ms': {
+                'p50': None if p50 is None else round(p50 * 1000, 1),
+                'p95': None if p95 is None else round(p95 * 1000, 1),
+            },
+        }
@@ -0,0 +1,113 @@
+"""
+Local routing for conversation turns
+Simple CONVERSATION turns are streamed straight from Ollama instead of
+going through the n8n AI Agent (several LLM hops for "hello"). TOOLS
+turns and anything that may need the agent's tools still go to n8n.
+"""
+
+import re
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from resilience import LatencyTracker
+from single_flight import normalize_text
+
+# Routes
+LOCAL = "local"
+N8N = "n8n"
+
+# Words suggesting the agent's tools (search, email, calendar, contacts,
+# calculator) or live data are needed
+DEFAULT_N8N_KEYWORDS = (
+    "email", "mail", "calendar", "schedule", "meeting", "appointment",
+    "remind", "reminder", "contact", "phone", "address", "search",
+    "look up", "google", "find", "news", "latest", "weather", "forecast",
+    "today", "tomorrow", "price", "stock", "score", "calculate", "times",
+    "plus", "minus", "divided", "blog", "post", "send", "book", "my",
+)
+
+
+class TurnRouter:
+    """Decides whether a turn is answered locally or by the n8n agent
+
+    Also keeps per-route latency (time to first chunk and total) so the
+    saving from local routing shows up in /api/metrics.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_words: int = 20,
+        n8n_keywords: Iterable[str] = DEFAULT_N8N_KEYWORDS,
+        model: str = "qwen2.5:3b",
+        max_tokens: int = 200,
+        temperature: float = 0.7,
+    ):
+        self.enabled = enabled
+        self.max_words = max_words
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self._n8n_words = re.compile(r"\b(" + "|".join(map(re.escape, n8n_keywords)) + r")\b")
+        self._lock = threading.Lock()
+        self._routes: Dict[str, dict] = {}
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "TurnRouter":
+        """Build from the `router` section of config.yaml"""
+        config = config or {}
+        return cls(
+            enabled=config.get('enabled', True),
+            max_words=config.get('max_words', 20),
+            n8n_keywords=config.get('n8n_keywords', DEFAULT_N8N_KEYWORDS),
+            model=config.get('model', 'qwen2.5:3b'),
+            max_tokens=config.get('max_tokens', 200),
+            temperature=config.get('temperature', 0.7),
+        )
+
+    def route(self, text: str, intent: str) -> Tuple[str, str]:
+        """(route, reason) for one turn"""
+        if intent != "CONVERSATION":
+            return N8N, "intent"
+        if not self.enabled:
+            return N8N, "disabled"
+        normalized = normalize_text(text)
+        if self._n8n_words.search(normalized):
+            return N8N, "may_need_tools"
+        if len(normalized.split()) > self.max_words:
+            return N8N, "long"
+        return LOCAL, "simple"
+
+    def record(self, route: str, reason: str, first_chunk: Optional[float], total: float):
+        """Latency of one routed turn, in seconds"""
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {
+                    'count': 0,
+                    'reasons': {},
+                    'first_chunk': LatencyTracker(window=500),
+                    'total': LatencyTracker(window=500),
+                }
+            stats['count'] += 1
+            stats['reasons'][reason] = stats['reasons'].get(reason, 0) + 1
+            if first_chunk is not None:
+                stats['first_chunk'].record(first_chunk)
+            stats['total'].record(total)
+
+    def stats(self) -> Dict[str, dict]:
+        """Per-route counts and latency percentiles in milliseconds"""
+        def ms(tracker, pct):
+            value = tracker.quantile(pct)
+            return None if value is None else round(value * 1000, 1)
+
+        with self._lock:
+            return {
+                route: {
+                    'count': s['count'],
+                    'reasons': dict(s['reasons']),
+                    'first_chunk_ms': {'p50': ms(s['first_chunk'], 50), 'p95': ms(s['first_chunk'], 95)},
+                    'total_ms': {'p50': ms(s['total'], 50), 'p95': ms(s['total'], 95)},
+                }
+                for route, s in self._routes.items()
+            }
@@ -15,33 +15,30 @@ from typing import Optional, Dict, Any
 import json
 
 import numpy as np
-from faster_whisper import WhisperModel
 import ollama
 import aiohttp
 import yaml
 from dotenv import load_dotenv
-import colorlog
+
+from conversation_history import ConversationHistory
+from degradation import DegradationController
+from logging_setup import request_context, setup_logging, stage
+from ollama_scheduler import OllamaScheduler
+from prompt_builder import PromptBuilder
+from resilience import get_backend
+from resource_planner import configure_process
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+from tool_queue import ToolJobQueue, result_text
+from tracing import current_trace_id, inject_headers, setup_tracing
+from whisper_router import configured_default_model, configured_loader
 
 # Load environment variables
 load_dotenv()
 
-# Setup colorful logging
-handler = colorlog.StreamHandler()
-handler.setFormatter(colorlog.ColoredFormatter(
-    '%(log_color)s%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S',
-    log_colors={
-        'DEBUG': 'cyan',
-        'INFO': 'green',
-        'WARNING': 'yellow',
-        'ERROR': 'red',
-        'CRITICAL': 'red,bg_white',
-    }
-))
-
+# Queue-based logging (console by default; reconfigured from config.yaml below)
+setup_logging(service='voice_service')
 logger = logging.getLogger('VoiceAssistant')
-logger.addHandler(handler)
-logger.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
 
 
 class VoiceAssistantService:
@@ -57,39 +54,69 @@ class VoiceAssistantService:
             with open(config_path, 'r') as f:
                 self.config = yaml.safe_load(f)
         except FileNotFoundError:
-            logger.error(f"Config file not found: {config_path}")
+            logger.error("Config file not found: %s", config_path)
             logger.error("Please run the installation script first!")
             sys.exit(1)
         
-        # Initialize Whisper (CPU-optimized for i9)
-        logger.info("Loading Whisper model (CPU-optimized for i9)...")
+        # Same logging settings as the web servers and launcher
+        setup_logging(self.config.get('logging'), service='voice_service', force=True)
+        setup_tracing(self.config.get('tracing'), service='voice_service')
+        
+        # Size Whisper threads to the physical cores available to this process
+        self.resource_plan = configure_process(self.config)
+        
+        # Initialize Whisper (CPU-optimized)
+        logger.info("Loading Whisper model (CPU-optimized)...")
         start = time.time()
-        self.whisper = WhisperModel(
-            os.getenv('WHISPER_MODEL', 'base.en'),
-            device=os.getenv('WHISPER_DEVICE', 'cpu'),
-            compute_type=os.getenv('WHISPER_COMPUTE_TYPE', 'int8'),
-            num_workers=4,  # Utilize i9 cores
-            cpu_threads=8   # i9 can handle this
+        # Device / compute type / threads as tuned by autotune.py (env vars win)
+        self.whisper = configured_loader(self.config.get('whisper'), self.resource_plan)(
+            configured_default_model(self.config)
         )
-        logger.info(f"✓ Whisper loaded in {time.time()-start:.2f}s")
+        logger.info("✓ Whisper loaded in %.2fs", time.time() - start)
         
         # Ollama configuration
         ollama_host = os.getenv('OLLAMA_HOST')
-        logger.info(f"Connecting to Ollama at {ollama_host}")
+        logger.info("Connecting to Ollama at %s", ollama_host)
         self.ollama = ollama.AsyncClient(host=ollama_host)
         
         # Test Ollama connection
         self._test_ollama_connection()
         
+        # Adaptive timeouts, retries and circuit breakers for outbound calls
+        self.ollama_backend = get_backend('ollama', self.config.get('resilience'))
+        self.n8n_backend = get_backend('n8n', self.config.get('resilience'))
+        
+        # Priority classes and per-class slots in front of the Ollama host
+        self.scheduler = OllamaScheduler.from_config(self.config.get('scheduler'))
+        
+        # Merge identical concurrent Ollama prompts for the configured roles
+        self.ollama_flight = SingleFlight.from_config(self.config.get('coalescing'), 'ollama')
+        
+        # Answers to repeated factual questions (None if disabled)
+        self.response_cache = ResponseCache.from_config(self.config.get('response_cache'))
+        
         # Model configuration
         self.models = self.config['models']
+        # Smaller models / token budgets while the Ollama queue is backed up
+        self.degradation = DegradationController.from_config(
+            self.config.get('degradation'), self.models, self.scheduler.depth
+        )
         
         # Intent cache
         self.intent_cache = self.config.get('intent_cache', {})
         
+        # Conversation context for multi-turn follow-ups
+        self.history = ConversationHistory.from_config(self.config.get('history'))
+        self.prompt_builder = PromptBuilder.from_config(self.history, self.config.get('prompt'))
+        
         # n8n webhook
         self.n8n_webhook = os.getenv('N8N_WEBHOOK_URL')
         
+        # Background tool jobs (results are tracked, not fire-and-forget)
+        self.tool_queue = ToolJobQueue.from_config(
+            self.config.get('tools'), on_event=self._on_tool_event
+        )
+        
         # Performance tracking
         self.stats = {
             'total_requests': 0,
@@ -108,15 +135,46 @@ class VoiceAssistantService:
             response = requests.get(f"{ollama_host}/api/tags", timeout=5)
             if response.status_code == 200:
                 models = response.json().get('models', [])
-                logger.info(f"✓ Ollama connected. Available models: {len(models)}")
+                logger.info("✓ Ollama connected. Available models: %d", len(models))
             else:
-                logger.warning(f"Ollama connection issue: {response.status_code}")
+                logger.warning("Ollama connection issue: %s", response.status_code)
         except Exception as e:
-            logger.error(f"Cannot connect to Ollama: {e}")
+            logger.error("Cannot connect to Ollama: %s", e)
             logger.error("Make sure Ollama is running on Windows and accessible from WSL")
             logger.error("See docs/TROUBLESHOOTING.md for help")
             sys.exit(1)
     
+    async def _generate(self, model_config: Dict[str, Any], prompt: str,
+                        role: str, session_id: Optional[str] = None, **options) -> Dict[str, Any]:
+        """Ollama generate behind the scheduler and the adaptive timeout / retry / breaker layer
+        
+        `role` is the scheduler priority class. Identical concurrent prompts
+        are coalesced when it is listed under coalescing.ollama in config.yaml.
+        """
+        def generate(timeout):
+            return self.ollama.generate(
+                model=model_config['name'],
+                prompt=prompt,
+                options={
+                    'num_predict': model_config['max_tokens'],
+                    'temperature': model_config['temperature'],
+                    **options
+                }
+            )
+        
+        async def send():
+            # Coalesced followers wait on the leader and take no slot
+            start = time.perf_counter()
+            async with self.scheduler.aslot(role, session_id):
+                result = await self.ollama_backend.acall(generate, idempotent=True)
+            self.degradation.observe(time.perf_counter() - start)
+            return result
+        
+        if not self.ollama_flight.enabled_for(role):
+            return await send()
+        key = (model_config['name'], prompt, tuple(sorted(options.items())))
+        return await self.ollama_flight.ado(key, send)
+    
     async def classify_intent(self, text: str) -> str:
         """Fast intent classification with caching"""
         start_time = time.time()
@@ -126,12 +184,13 @@ class VoiceAssistantService:
         for phrase, intent in self.intent_cache.items():
             if phrase in text_lower:
                 elapsed = time.time() - start_time
-                logger.info(f"🎯 Intent (cached): {intent} ({elapsed*1000:.0f}ms)")
+                logger.info("Intent (cached): %s", intent,
+                            extra={'intent': intent, 'duration_ms': round(elapsed * 1000, 1)})
                 return intent
         
         # Use LLM classifier (50-100ms)
         try:
-            model_config = self.models['classifier']
+            model_config = self.degradation.model('classifier')
             prompt = f"""Classify this query into exactly ONE category:
 HOME_CONTROL - controlling devices, lights, temperature, locks
 TOOLS - email, calendar, timers, alarms, reminders
@@ -140,15 +199,7 @@ CONVERSATION - questions, information, chat
 Query: {text}
 Category:"""
             
-            response = await self.ollama.generate(
-                model=model_config['name'],
-                prompt=prompt,
-                options={
-                    'num_predict': model_config['max_tokens'],
-                    'temperature': model_config['temperature'],
-                    'top_k': 1
-                }
-            )
+            response = await self._generate(model_config, prompt, role='classifier', top_k=1)
             
             intent = response['response'].strip().upper()
             
@@ -157,12 +208,13 @@ Category:"""
                 intent = 'CONVERSATION'
             
             elapsed = time.time() - start_time
-            logger.info(f"🎯 Intent (LLM): {intent} ({elapsed*1000:.0f}ms)")
+            logger.info("Intent (LLM): %s", intent,
+                        extra={'intent': intent, 'duration_ms': round(elapsed * 1000, 1)})
             
             return intent
         
         except Exception as e:
-            logger.error(f"Intent classification error: {e}")
+            logger.error("Intent classification error: %s", e)
             return 'CONVERSATION'
     
     async def home_assistant_agent(self, text: str) -> str:
@@ -170,7 +222,7 @@ Category:"""
         start_time = time.time()
         
         try:
-            model_config = self.models['home_assistant']
+            model_config = self.degradation.model('home_assistant')
             
             # Get device list from config
             devices = self.config.get('home_assistant', {}).get('devices', {})
@@ -186,86 +238,92 @@ Command: {text}
 
 Respond briefly what you did (max 1 sentence)."""
             
-            response = await self.ollama.generate(
-                model=model_config['name'],
-                prompt=prompt,
-                options={
-                    'num_predict': model_config['max_tokens'],
-                    'temperature': model_config['temperature']
-                }
-            )
+            response = await self._generate(model_config, prompt, role='home_assistant')
             
             result = response['response'].strip()
             
             elapsed = time.time() - start_time
-            logger.info(f"🏠 HA Agent response ({elapsed*1000:.0f}ms)")
+            logger.info("HA agent response", extra={'duration_ms': round(elapsed * 1000, 1)})
             
             return result
         
         except Exception as e:
-            logger.error(f"HA agent error: {e}")
+            logger.error("HA agent error: %s", e)
             return "I had trouble controlling that device."
     
-    async def conversation_agent(self, text: str) -> str:
-        """General conversation"""
+    async def conversation_agent(self, text: str, builder: Optional[PromptBuilder] = None) -> str:
+        """General conversation with recent session history as context"""
         start_time = time.time()
+        builder = builder or self.prompt_builder
+        builder.history.append("user", text)
+        
+        cached = self.response_cache.get(text, 'CONVERSATION') if self.response_cache else None
+        if cached is not None:
+            builder.history.append("assistant", cached)
+            logger.info("Conversation agent response (cached)",
+                        extra={'cached': True, 'duration_ms': round((time.time() - start_time) * 1000, 1)})
+            return cached
         
         try:
-            model_config = self.models['conversation']
+            model_config = self.degradation.model('conversation')
             
-            prompt = f"""You are a helpful voice assistant. Answer briefly and naturally.
-
-User: {text}
-Assistant:"""
+            prompt = builder.build()
             
-            response = await self.ollama.generate(
-                model=model_config['name'],
-                prompt=prompt,
-                options={
-                    'num_predict': model_config['max_tokens'],
-                    'temperature': model_config['temperature']
-                }
-            )
+            response = await self._generate(model_config, prompt, role='conversation')
             
             result = response['response'].strip()
+            builder.history.append("assistant", result)
+            if self.response_cache:
+                self.response_cache.put(text, 'CONVERSATION', result, time.time() - start_time)
             
             elapsed = time.time() - start_time
-            logger.info(f"💬 Conversation Agent response ({elapsed*1000:.0f}ms)")
+            logger.info("Conversation agent response", extra={'duration_ms': round(elapsed * 1000, 1)})
             
             return result
         
         except Exception as e:
-            logger.error(f"Conversation agent error: {e}")
+            logger.error("Conversation agent error: %s", e)
             return "I'm having trouble responding right now."
     
-    async def execute_tools_async(self, text: str):
-        """Execute n8n tools asynchronously"""
-        try:
-            logger.info(f"🔧 Executing n8n tools for: '{text}'")
-            
+    async def execute_tools_async(self, text: str) -> dict:
+        """Execute n8n tools (run through self.tool_queue)"""
+        logger.info("Executing n8n tools", extra={'intent': 'TOOLS'})
+        logger.debug("Tool request text: %s", text)
+        payload = {
+            "text": text,
+            "intent": "TOOLS",
+            "source": "voice_satellite",
+            "timestamp": time.time(),
+            "trace_id": current_trace_id()
+        }
+        headers = inject_headers()
+        
+        async def post(timeout):
             async with aiohttp.ClientSession() as session:
-                payload = {
-                    "text": text,
-                    "intent": "TOOLS",
-                    "source": "voice_satellite",
-                    "timestamp": time.time()
-                }
-                
                 async with session.post(
                     self.n8n_webhook,
                     json=payload,
-                    timeout=aiohttp.ClientTimeout(total=30)
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=timeout)
                 ) as resp:
+                    if resp.status >= 500:
+                        resp.raise_for_status()
                     if resp.status == 200:
-                        result = await resp.json()
-                        logger.info(f"✓ n8n tool execution complete: {result}")
-                    else:
-                        logger.warning(f"n8n returned status {resp.status}")
+                        return await resp.json()
+                    return {"error": f"n8n returned status {resp.status}"}
         
-        except asyncio.TimeoutError:
-            logger.error("n8n execution timeout")
-        except Exception as e:
-            logger.error(f"n8n execution error: {e}")
+        # Tool calls have side effects: no retries, fail fast while n8n is down
+        return await self.n8n_backend.acall(
+            post, idempotent=False, fallback={"error": "n8n is unavailable right now"}
+        )
+    
+    def _on_tool_event(self, event: str, job: dict):
+        """Log tool job progress and results"""
+        if event == 'tool_result':
+            logger.info("Tool job %s %s: %s", job['job_id'], job['status'], result_text(job),
+                        extra={'job_id': job['job_id'], 'status': job['status']})
+        else:
+            logger.debug("Tool job %s %s", job['job_id'], job['status'])
 
 
 async def test_mode():
@@ -277,39 +335,87 @@ async def test_mode():
     test_queries = [
         "Turn on the living room lights",
         "What's the weather like today?",
+        "And tomorrow?",
         "Send an email to John"
     ]
     
     for query in test_queries:
-        logger.info(f"\n{'='*60}")
-        logger.info(f"Testing: {query}")
-        logger.info(f"{'='*60}")
+        logger.info("\n%s", '=' * 60)
+        logger.info("Testing: %s", query)
+        logger.info("%s", '=' * 60)
         
-        # Classify intent
-        intent = await service.classify_intent(query)
-        
-        # Execute based on intent
-        if intent == "HOME_CONTROL":
-            response = await service.home_assistant_agent(query)
-        elif intent == "CONVERSATION":
-            response = await service.conversation_agent(query)
-        elif intent == "TOOLS":
-            asyncio.create_task(service.execute_tools_async(query))
-            response = "I'm working on that right now."
-        else:
-            response = "I'm not sure how to help with that."
-        
-        logger.info(f"Response: {response}")
+        with request_context(handler="voice_turn", session_id="test") as turn:
+            # Classify intent
+            with stage('intent'):
+                intent = await service.classify_intent(query)
+            
+            # Execute based on intent
+            with stage('agent'):
+                if intent == "HOME_CONTROL":
+                    response = await service.home_assistant_agent(query)
+                elif intent == "CONVERSATION":
+                    response = await service.conversation_agent(query)
+                elif intent == "TOOLS":
+                    job = service.tool_queue.submit("test", query, service.execute_tools_async, query)
+                    response = f"I'm working on that right now. (job {job['job_id']})"
+                else:
+                    response = "I'm not sure how to help with that."
+            
+            logger.info("Response: %s", response)
+            logger.info("Turn complete", extra={'intent': intent, 'total_ms': round(turn.elapsed_ms(), 1)})
         await asyncio.sleep(1)
     
-    logger.info(f"\n{'='*60}")
+    # Wait for background tool jobs so their results are reported
+    service.tool_queue.wait(timeout=60)
+    
+    if service.response_cache:
+        logger.info("Response cache: %s", service.response_cache.stats())
+    
+    logger.info("\n%s", '=' * 60)
     logger.info("Test complete!")
-    logger.info(f"{'='*60}")
+    logger.info("%s", '=' * 60)
+
+
+async def bench_mode(iterations: int = 20):
+    """Latency of every agent method, e.g. against web_test/mock_ollama_server.py"""
+    logger.info("Running in BENCH mode")
+    service = VoiceAssistantService()
+    # Measure the model path, not cache hits
+    service.response_cache = None
+    service.intent_cache = {}
+    
+    cases = [
+        ("classify_intent", service.classify_intent, "What's the capital of France?"),
+        ("home_assistant_agent", service.home_assistant_agent, "Turn on the living room lights"),
+        ("conversation_agent", service.conversation_agent, "Tell me something interesting"),
+    ]
+    if service.n8n_webhook:
+        cases.append(("execute_tools_async", service.execute_tools_async, "Send an email to John"))
+    
+    print(f"\n{'method':<24} {'n':>4} {'p50':>8} {'p95':>8} {'max':>8}")
+    for name, method, text in cases:
+        latencies = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            await method(f"{text} ({i})")
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{name:<24} {len(latencies):>4} {p50:>6.0f}ms {p95:>6.0f}ms {latencies[-1]:>6.0f}ms")
+    
+    print(f"\n{'scheduler class':<24} {'served':>6} {'wait p50':>9} {'wait p95':>9}")
+    for name, c in service.scheduler.stats()['classes'].items():
+        if c['served']:
+            print(f"{name:<24} {c['served']:>6} {c['wait_ms']['p50']:>7.1f}ms {c['wait_ms']['p95']:>7.1f}ms")
 
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "test":
         asyncio.run(test_mode())
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        asyncio.run(bench_mode(int(sys.argv[2]) if len(sys.argv) > 2 else 20))
     else:
         logger.info("Usage: python voice_service.py test")
+        logger.info("       python voice_service.py bench [iterations]")
         logger.info("(Full Wyoming server implementation coming next)")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fault-injection check for the n8n resilience layer
+Starts mock_n8n_server.py with --fail-rate / --hang-rate and drives the
+same ResilientBackend wrapper the servers use against it:
+
+  retries    only idempotent calls are retried (counted at the mock)
+  breaker    consecutive hangs open the circuit, then calls fail fast
+  fallback   an open circuit answers from the cached response
+  recovery   after reset_timeout a half-open probe goes through; a failed
+             probe re-opens the circuit, a good one closes it
+
+Exits non-zero if any check fails.
+
+Usage:
+    python fault_check.py
+    python fault_check.py --port 8899 --reset-timeout 2
+"""
+import sys
+import io
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+import argparse
+import logging
+import subprocess
+import time
+from pathlib import Path
+
+import requests
+
+HERE = Path(__file__).parent
+sys.path.insert(0, str(HERE.parent))
+
+from resilience import (CLOSED, HALF_OPEN, OPEN, BackendUnavailable, CircuitBreaker,
+                        LatencyTracker, ResilientBackend)
+
+QUESTION = "what is the capital of france"
+
+
+class MockN8n:
+    """mock_n8n_server.py in a subprocess, restartable with other faults"""
+
+    def __init__(self, port: int, log):
+        self.port = port
+        self.log = log
+        self.proc = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, *fault_args: str):
+        self.stop()
+        self.proc = subprocess.Popen(
+            [sys.executable, 'mock_n8n_server.py', '--port', str(self.port),
+             '--latency-scale', '0', *fault_args],
+            cwd=HERE, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        deadline = time.time() + 15
+        while time.time() < deadline:
+            try:
+                requests.get(self.url, timeout=0.5)
+                return
+            except requests.RequestException:
+                time.sleep(0.1)
+        raise RuntimeError(f"mock n8n did not start on port {self.port}")
+
+    def stop(self):
+        if self.proc is not None:
+            # Not terminate(): aiohttp would wait for the hanging requests
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+    def requests_seen(self) -> int:
+        return requests.get(f"{self.url}/traces", timeout=2).json()['counters']['requests']
+
+
+class Checker:
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, name: str, ok: bool, detail: str = ""):
+        mark = "✓" if ok else "✗"
+        print(f"  {mark} {name}" + (f" ({detail})" if detail else ""))
+        if not ok:
+            self.failed += 1
+
+
+def make_backend(args, failure_threshold: int) -> ResilientBackend:
+    return ResilientBackend(
+        'n8n', retries=args.retries, backoff_base=0.05, backoff_max=0.2,
+        breaker=CircuitBreaker(failure_threshold=failure_threshold,
+                               reset_timeout=args.reset_timeout),
+        latency=LatencyTracker(max_timeout=args.timeout),
+    )
+
+
+def webhook_call(mock: MockN8n, text: str):
+    """fn(timeout) in the shape call_n8n_webhook passes to the backend"""
+    def post(timeout: float) -> dict:
+        resp = requests.post(f"{mock.url}/webhook/voice-assistant",
+                             json={'text': text, 'intent': 'CONVERSATION'}, timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+    return post
+
+
+def check_retries(args, mock: MockN8n, checker: Checker):
+    print(f"Retries (--fail-rate 1, {args.retries} retries configured)")
+    mock.start('--fail-rate', '1')
+    backend = make_backend(args, failure_threshold=100)  # Keep the breaker out of it
+
+    before = mock.requests_seen()
+    result = backend.call(webhook_call(mock, "send an email to bob"), idempotent=False,
+                          fallback={'output': 'queued'})
+    sent = mock.requests_seen() - before
+    checker.check("non-idempotent call is sent once", sent == 1, f"{sent} request(s)")
+    checker.check("and answered by its fallback", result == {'output': 'queued'})
+
+    before = mock.requests_seen()
+    backend.call(webhook_call(mock, QUESTION), idempotent=True, fallback=None)
+    sent = mock.requests_seen() - before
+    checker.check("idempotent call is retried", sent == 1 + args.retries, f"{sent} request(s)")
+    checker.check("retries counted", backend.counters['retries'] == args.retries,
+                  f"retries={backend.counters['retries']}")
+
+
+def check_breaker(args, mock: MockN8n, checker: Checker):
+    threshold = 3
+    print(f"Breaker (--hang-rate 1, timeout {args.timeout}s, threshold {threshold})")
+    backend = make_backend(args, failure_threshold=threshold)
+
+    mock.start()
+    answer = backend.call(webhook_call(mock, QUESTION), idempotent=True, cache_key=QUESTION)
+    checker.check("healthy call is cached", backend.breaker.state == CLOSED and bool(answer))
+
+    mock.start('--hang-rate', '1', '--hang-seconds', '60')
+    start = time.perf_counter()
+    for i in range(threshold):
+        try:
+            backend.call(webhook_call(mock, f"hang {i}"))
+        except BackendUnavailable:
+            pass
+    elapsed = time.perf_counter() - start
+    checker.check("hanging calls time out", elapsed < threshold * (args.timeout + 1),
+                  f"{elapsed:.1f}s for {threshold} calls")
+    checker.check("circuit opens", backend.breaker.state == OPEN,
+                  f"state={backend.breaker.state}")
+
+    before = mock.requests_seen()
+    start = time.perf_counter()
+    try:
+        backend.call(webhook_call(mock, "anything else"))
+        failed_fast = False
+    except BackendUnavailable:
+        failed_fast = True
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    checker.check("open circuit fails fast without calling n8n",
+                  failed_fast and elapsed_ms < 50 and mock.requests_seen() == before,
+                  f"{elapsed_ms:.1f}ms")
+
+    cached = backend.call(webhook_call(mock, QUESTION), idempotent=True, cache_key=QUESTION)
+    checker.check("open circuit returns the cached answer", cached == answer)
+    checker.check("fallbacks and short circuits counted",
+                  backend.counters['fallbacks'] >= 1 and backend.counters['short_circuited'] >= 2,
+                  f"fallbacks={backend.counters['fallbacks']} "
+                  f"short_circuited={backend.counters['short_circuited']}")
+    return backend
+
+
+def check_recovery(args, mock: MockN8n, checker: Checker, backend: ResilientBackend):
+    print(f"Recovery (reset_timeout {args.reset_timeout}s)")
+    mock.start('--fail-rate', '1')
+    time.sleep(args.reset_timeout)
+    checker.check("probe allowed after reset_timeout", backend.breaker.allow()
+                  and backend.breaker.state == HALF_OPEN, f"state={backend.breaker.state}")
+    checker.check("only one probe at a time", not backend.breaker.allow())
+    backend.breaker.abandon()  # Hand the probe slot back to the real call below
+
+    before = mock.requests_seen()
+    backend.call(webhook_call(mock, QUESTION), idempotent=True, cache_key=QUESTION)
+    checker.check("failed probe re-opens the circuit",
+                  backend.breaker.state == OPEN and mock.requests_seen() - before == 1,
+                  f"state={backend.breaker.state}, times_opened={backend.breaker.times_opened}")
+
+    mock.start()
+    time.sleep(args.reset_timeout)
+    before = mock.requests_seen()
+    result = backend.call(webhook_call(mock, QUESTION), idempotent=True, cache_key=QUESTION)
+    checker.check("successful probe closes the circuit",
+                  backend.breaker.state == CLOSED and mock.requests_seen() - before == 1
+                  and result.get('source') == 'mock_n8n_server',
+                  f"state={backend.breaker.state}")
+    before = mock.requests_seen()
+    backend.call(webhook_call(mock, "hello"))
+    checker.check("calls reach n8n again", mock.requests_seen() - before == 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fault-injection check for the n8n breaker")
+    parser.add_argument('--port', type=int, default=8899, help="Port for the mock n8n server")
+    parser.add_argument('--timeout', type=float, default=0.5, help="Per-call timeout (hang detection)")
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--reset-timeout', type=float, default=1.0)
+    parser.add_argument('--mock-log', default='fault_check_mock.log')
+    args = parser.parse_args()
+    # The expected failures would otherwise be logged as warnings
+    logging.getLogger('VoiceAssistant').setLevel(logging.ERROR)
+
+    checker = Checker()
+    with open(args.mock_log, 'w') as log:
+        mock = MockN8n(args.port, log)
+        try:
+            check_retries(args, mock, checker)
+            backend = check_breaker(args, mock, checker)
+            check_recovery(args, mock, checker, backend)
+        finally:
+            mock.stop()
+
+    if checker.failed:
+        print(f"\n✗ {checker.failed} check(s) failed (mock output in {args.mock_log})")
+        sys.exit(1)
+    print("\n✓ All resilience checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator for the streaming server
+Opens N concurrent Socket.IO clients that replay text_message / audio_data
+turns from fixtures, including interrupts and CONFIRM / CANCEL tool flows.
+Concurrency is ramped in steps. Each step reports time-to-transcript,
+time-to-first-chunk and time-to-complete percentiles, interrupt-to-idle
+latency and error rates, and the run ends with a saturation summary.
+
+Usage:
+    python load_test.py --url http://localhost:5002 --clients 50 --ramp 10
+    python load_test.py --with-mocks --clients 40 --ramp 10 --report load.json
+    python load_test.py --audio-dir fixtures/ --mix chat=4,audio=4,interrupt=2
+"""
+import sys
+import io
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import subprocess
+import time
+from pathlib import Path
+
+import aiohttp
+import socketio
+
+HERE = Path(__file__).parent
+sys.path.insert(0, str(HERE.parent))
+
+from resilience import percentile
+
+# Text fixtures per scenario (override with --fixtures file.json)
+FIXTURES = {
+    "chat": [
+        "hello there", "how are you doing", "tell me a joke",
+        "what do you think about cats", "thanks, that was helpful",
+        "what's the weather in paris", "what is the latest news about space",
+    ],
+    "long": [
+        "tell me a long story about a lighthouse keeper",
+        "explain how a jet engine works in detail",
+        "describe the history of the roman empire",
+    ],
+    "tools": [
+        "send an email to john about lunch tomorrow",
+        "add a meeting to my calendar for friday at 3pm",
+        "search the web for vegetarian lasagna recipes",
+    ],
+    "confirm": ["yes, go ahead"],
+    "cancel": ["no, cancel that"],
+}
+
+DEFAULT_MIX = "chat=6,tools_confirm=1,tools_cancel=1,interrupt=2,audio=2"
+
+AUDIO_TYPES = {'.webm', '.wav', '.ogg', '.mp3', '.m4a'}
+
+# Events a turn can end on
+END_EVENTS = ('response_complete', 'error')
+
+
+class TurnResult:
+    """Timings (ms) and outcome of one turn"""
+
+    __slots__ = ('scenario', 'transcript_ms', 'first_chunk_ms', 'complete_ms',
+                 'interrupt_to_idle_ms', 'error')
+
+    def __init__(self, scenario: str):
+        self.scenario = scenario
+        self.transcript_ms = None
+        self.first_chunk_ms = None
+        self.complete_ms = None
+        self.interrupt_to_idle_ms = None
+        self.error = None
+
+
+class VoiceClient:
+    """One simulated browser session"""
+
+    EVENTS = ('transcript', 'intent', 'response_chunk', 'response_complete',
+              'response_interrupted', 'interrupted', 'confirmation_request', 'error')
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.session_id = None  # Issued by the server on connect
+        self.timeout = timeout
+        self.tool_results = 0
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self._events: asyncio.Queue = asyncio.Queue()
+        for name in self.EVENTS:
+            self.sio.on(name, self._recorder(name))
+        self.sio.on('tool_result', self._on_tool_result)
+        self.sio.on('connected', self._on_connected)
+
+    def _recorder(self, name):
+        async def record(data=None):
+            await self._events.put((name, data, time.perf_counter()))
+        return record
+
+    async def _on_connected(self, data):
+        self.session_id = data.get('session_id')
+
+    async def _on_tool_result(self, data):
+        self.tool_results += 1
+        await self.sio.emit('tool_ack', {'job_id': data.get('job_id')})
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=['websocket', 'polling'], wait_timeout=self.timeout)
+
+    async def close(self):
+        await self.sio.disconnect()
+
+    async def turn(self, scenario: str, event: str, data: dict, interrupt: bool = False) -> TurnResult:
+        """Send one message and wait for the reply (optionally barging in on it)"""
+        result = TurnResult(scenario)
+        while not self._events.empty():
+            self._events.get_nowait()  # Stale events from an earlier turn
+
+        start = time.perf_counter()
+        interrupted_at = None
+        await self.sio.emit(event, data)
+        deadline = start + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                result.error = 'timeout'
+                return result
+            try:
+                name, payload, at = await asyncio.wait_for(self._events.get(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            elapsed = (at - start) * 1000
+            if name == 'transcript':
+                result.transcript_ms = elapsed
+            elif name == 'response_chunk' and result.first_chunk_ms is None:
+                result.first_chunk_ms = elapsed
+                if interrupt:
+                    interrupted_at = time.perf_counter()
+                    await self.sio.emit('interrupt')
+            elif name == 'response_interrupted' and interrupted_at is None:
+                result.error = 'unexpected_interrupt'
+            elif name in END_EVENTS:
+                if name == 'error' and result.error is None:
+                    result.error = (payload or {}).get('message', 'error')[:80]
+                if result.first_chunk_ms is None:
+                    result.first_chunk_ms = elapsed
+                result.complete_ms = elapsed
+                if interrupted_at is not None:
+                    result.interrupt_to_idle_ms = (at - interrupted_at) * 1000
+                return result
+
+
+class Scenarios:
+    """Builds each scenario's turns from the fixtures"""
+
+    def __init__(self, fixtures: dict, audio_files: list):
+        self.fixtures = fixtures
+        self.audio = [base64.b64encode(p.read_bytes()).decode() for p in audio_files]
+
+    def names(self):
+        names = ['chat', 'tools_confirm', 'tools_cancel', 'interrupt']
+        return names + ['audio'] if self.audio else names
+
+    async def run(self, name: str, client: VoiceClient) -> list:
+        pick = lambda key: random.choice(self.fixtures[key])
+        if name == 'chat':
+            return [await client.turn(name, 'text_message', {'text': pick('chat')})]
+        if name == 'interrupt':
+            return [await client.turn(name, 'text_message', {'text': pick('long')}, interrupt=True)]
+        if name == 'audio':
+            audio = random.choice(self.audio)
+            return [await client.turn(name, 'audio_data', {'audio': audio, 'format': 'webm'})]
+        if name in ('tools_confirm', 'tools_cancel'):
+            ask = await client.turn(name + ':request', 'text_message', {'text': pick('tools')})
+            if ask.error:
+                return [ask]
+            answer = pick('confirm' if name == 'tools_confirm' else 'cancel')
+            return [ask, await client.turn(name + ':answer', 'text_message', {'text': answer})]
+        raise ValueError(f"Unknown scenario: {name}")
+
+
+def parse_mix(mix: str, available: list) -> dict:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name in available and float(weight or 1) > 0:
+            weights[name] = float(weight or 1)
+    if not weights:
+        raise SystemExit(f"No runnable scenarios in mix '{mix}' (available: {', '.join(available)})")
+    return weights
+
+
+async def client_loop(index: int, args, scenarios: Scenarios, weights: dict,
+                      results: list, stop: asyncio.Event, stats: dict):
+    client = VoiceClient(args.url, args.timeout)
+    try:
+        await client.connect()
+    except Exception as e:
+        stats['connect_errors'] += 1
+        stats['last_connect_error'] = str(e)
+        return
+    names, probs = list(weights), list(weights.values())
+    try:
+        while not stop.is_set():
+            scenario = random.choices(names, probs)[0]
+            try:
+                results.extend(await scenarios.run(scenario, client))
+            except Exception as e:
+                failed = TurnResult(scenario)
+                failed.error = type(e).__name__
+                results.append(failed)
+                if not client.sio.connected:
+                    stats['disconnects'] += 1
+                    return
+            # Think time between turns, jittered so clients do not move in lockstep
+            await asyncio.sleep(random.uniform(0.5, 1.5) * args.think)
+    finally:
+        stats['tool_results'] += client.tool_results
+        if client.sio.connected:
+            await client.close()
+
+
+def summarize(clients: int, results: list, duration: float, stats: dict) -> dict:
+    def pcts(key):
+        values = [getattr(r, key) for r in results if getattr(r, key) is not None]
+        return {
+            'count': len(values),
+            'p50': round(percentile(values, 50), 1) if values else None,
+            'p95': round(percentile(values, 95), 1) if values else None,
+            'p99': round(percentile(values, 99), 1) if values else None,
+        }
+
+    errors = {}
+    for r in results:
+        if r.error:
+            errors[r.error] = errors.get(r.error, 0) + 1
+    per_scenario = {}
+    for r in results:
+        s = per_scenario.setdefault(r.scenario, {'turns': 0, 'errors': 0})
+        s['turns'] += 1
+        s['errors'] += bool(r.error)
+    return {
+        'clients': clients,
+        'turns': len(results),
+        'turns_per_sec': round(len(results) / duration, 2) if duration else 0,
+        'error_rate': round(sum(errors.values()) / len(results), 4) if results else None,
+        'errors': errors,
+        'connect_errors': stats['connect_errors'],
+        'disconnects': stats['disconnects'],
+        'tool_results': stats['tool_results'],
+        'transcript_ms': pcts('transcript_ms'),
+        'first_chunk_ms': pcts('first_chunk_ms'),
+        'complete_ms': pcts('complete_ms'),
+        'interrupt_to_idle_ms': pcts('interrupt_to_idle_ms'),
+        'scenarios': per_scenario,
+    }
+
+
+async def fetch_metrics(url: str):
+    try:
+        async with aiohttp.ClientSession() as http:
+            async with http.get(f"{url}/api/metrics", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                return await resp.json() if resp.status == 200 else None
+    except Exception:
+        return None
+
+
+async def run_step(clients: int, args, scenarios: Scenarios, weights: dict) -> dict:
+    results, stop = [], asyncio.Event()
+    stats = {'connect_errors': 0, 'disconnects': 0, 'tool_results': 0, 'last_connect_error': None}
+    tasks = []
+    for i in range(clients):
+        tasks.append(asyncio.create_task(client_loop(i, args, scenarios, weights, results, stop, stats)))
+        await asyncio.sleep(args.spawn_interval)  # Do not open every socket at once
+    started = time.perf_counter()
+    await asyncio.sleep(args.step_duration)
+    stop.set()
+    # Turns in flight get a chance to finish (bounded by the turn timeout)
+    await asyncio.wait(tasks, timeout=args.timeout + 5)
+    for task in tasks:
+        task.cancel()
+    summary = summarize(clients, results, time.perf_counter() - started, stats)
+    if stats['last_connect_error']:
+        summary['last_connect_error'] = stats['last_connect_error']
+    summary['server_metrics'] = await fetch_metrics(args.url)
+    return summary
+
+
+def fmt(p: dict) -> str:
+    if not p['count']:
+        return "-"
+    return f"{p['p50']:.0f}/{p['p95']:.0f}/{p['p99']:.0f}"
+
+
+def print_step(s: dict):
+    print(f"{s['clients']:>7} {s['turns']:>6} {s['turns_per_sec']:>7.1f} "
+          f"{(s['error_rate'] or 0) * 100:>6.1f}% {fmt(s['transcript_ms']):>16} "
+          f"{fmt(s['first_chunk_ms']):>18} {fmt(s['complete_ms']):>18} "
+          f"{fmt(s['interrupt_to_idle_ms']):>16}")
+
+
+def find_saturation(steps: list, slo_ms: float, max_error_rate: float):
+    """First step whose p95 time-to-complete or error rate breaks the limits"""
+    baseline = steps[0]['complete_ms']['p95'] if steps else None
+    for s in steps:
+        p95 = s['complete_ms']['p95']
+        if (s['error_rate'] or 0) > max_error_rate or s['connect_errors']:
+            return s, f"error rate {(s['error_rate'] or 0) * 100:.1f}% (connect errors: {s['connect_errors']})"
+        if p95 is not None and p95 > slo_ms:
+            return s, f"p95 time-to-complete {p95:.0f}ms > {slo_ms:.0f}ms"
+        if p95 is not None and baseline and p95 > 3 * baseline:
+            return s, f"p95 time-to-complete {p95:.0f}ms is over 3x the {steps[0]['clients']}-client baseline"
+    return None, None
+
+
+def start_mocks(args) -> list:
+    """Mock Ollama and n8n plus the streaming server (through the launcher) pointed at them"""
+    log = open(args.mock_log, 'w')
+    env = dict(os.environ,
+               OLLAMA_HOST=f"http://localhost:{args.mock_ollama_port}",
+               N8N_WEBHOOK_URL=f"http://localhost:{args.mock_n8n_port}/webhook/voice-assistant")
+    procs = [
+        subprocess.Popen([sys.executable, 'mock_ollama_server.py', '--port', str(args.mock_ollama_port)],
+                         cwd=HERE, stdout=log, stderr=subprocess.STDOUT),
+        subprocess.Popen([sys.executable, 'mock_n8n_server.py', '--port', str(args.mock_n8n_port)],
+                         cwd=HERE, stdout=log, stderr=subprocess.STDOUT),
+        subprocess.Popen([sys.executable, 'launcher.py', 'streaming', '--port', args.url.rsplit(':', 1)[1],
+                          '--workers', str(args.server_workers)],
+                         cwd=HERE.parent, env=env, stdout=log, stderr=subprocess.STDOUT),
+    ]
+    return procs
+
+
+async def wait_for_server(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.time() < deadline:
+            try:
+                async with http.get(f"{url}/api/test", timeout=aiohttp.ClientTimeout(total=2)) as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise SystemExit(f"Server at {url} did not come up within {timeout:.0f}s")
+
+
+async def main(args):
+    fixtures = dict(FIXTURES)
+    if args.fixtures:
+        fixtures.update(json.loads(Path(args.fixtures).read_text(encoding='utf-8')))
+    audio_files = []
+    if args.audio_dir:
+        audio_files = sorted(p for p in Path(args.audio_dir).iterdir() if p.suffix.lower() in AUDIO_TYPES)
+        if not audio_files:
+            print(f"No audio fixtures in {args.audio_dir}, skipping audio turns")
+    scenarios = Scenarios(fixtures, audio_files)
+    weights = parse_mix(args.mix, scenarios.names())
+
+    await wait_for_server(args.url)
+    levels = list(range(args.ramp, args.clients + 1, args.ramp)) if args.ramp else [args.clients]
+    if levels[-1] != args.clients:
+        levels.append(args.clients)
+
+    print(f"Load test against {args.url}: {levels} clients, {args.step_duration:.0f}s per step")
+    print(f"Scenario mix: {weights}\n")
+    print(f"{'clients':>7} {'turns':>6} {'turn/s':>7} {'errors':>7} {'transcript ms':>16} "
+          f"{'first chunk ms':>18} {'complete ms':>18} {'interrupt ms':>16}")
+    print(f"{'':>40}{'p50/p95/p99':>16}")
+
+    steps = []
+    for clients in levels:
+        summary = await run_step(clients, args, scenarios, weights)
+        steps.append(summary)
+        print_step(summary)
+        if args.stop_on_saturation and find_saturation(steps, args.slo_ms, args.max_error_rate)[0]:
+            break
+
+    step, reason = find_saturation(steps, args.slo_ms, args.max_error_rate)
+    print()
+    if step is None:
+        print(f"No saturation up to {steps[-1]['clients']} clients "
+              f"(p95 time-to-complete {steps[-1]['complete_ms']['p95']}ms)")
+    else:
+        good = [s['clients'] for s in steps if s['clients'] < step['clients']]
+        print(f"Saturated at {step['clients']} clients: {reason}")
+        print(f"Highest healthy level: {good[-1] if good else 'none'} clients")
+
+    interrupts = (steps[-1].get('server_metrics') or {}).get('interrupts')
+    if interrupts and interrupts['count']:
+        print(f"Server interrupt-to-idle: p50 {interrupts['idle_ms']['p50']}ms, "
+              f"p95 {interrupts['idle_ms']['p95']}ms over {interrupts['count']} interrupts")
+
+    if args.report:
+        report = {
+            'url': args.url,
+            'mix': weights,
+            'step_duration': args.step_duration,
+            'slo_ms': args.slo_ms,
+            'steps': steps,
+            'saturation': None if step is None else {'clients': step['clients'], 'reason': reason},
+        }
+        Path(args.report).write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"Report written to {args.report}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Socket.IO load test for streaming_server.py")
+    parser.add_argument('--url', default='http://localhost:5002')
+    parser.add_argument('--clients', type=int, default=20, help="Maximum concurrent clients")
+    parser.add_argument('--ramp', type=int, default=0,
+                        help="Add this many clients per step (0 = all at once)")
+    parser.add_argument('--step-duration', type=float, default=30.0, help="Seconds per step")
+    parser.add_argument('--spawn-interval', type=float, default=0.05, help="Seconds between client connects")
+    parser.add_argument('--think', type=float, default=1.0, help="Mean pause between a client's turns")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Turn timeout in seconds")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Scenario weights, e.g. chat=6,interrupt=2")
+    parser.add_argument('--fixtures', help="JSON file overriding the text fixtures")
+    parser.add_argument('--audio-dir', help="Directory of recorded audio clips for audio_data turns")
+    parser.add_argument('--slo-ms', type=float, default=5000.0, help="p95 time-to-complete limit")
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--stop-on-saturation', action='store_true')
+    parser.add_argument('--report', help="Write the full JSON report here")
+    parser.add_argument('--with-mocks', action='store_true',
+                        help="Start mock Ollama/n8n and the streaming server for the run")
+    parser.add_argument('--mock-ollama-port', type=int, default=11435)
+    parser.add_argument('--mock-n8n-port', type=int, default=8889)
+    parser.add_argument('--server-workers', type=int, default=1)
+    parser.add_argument('--mock-log', default='load_test_mocks.log')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    procs = start_mocks(args) if args.with_mocks else []
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
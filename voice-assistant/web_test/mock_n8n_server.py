@@ -3,6 +3,16 @@
 """
 Mock n8n server for testing voice functionality
 This simulates n8n responses so you can test the voice interface
+
+Requests are served asynchronously and walk a simulated copy of the
+"Assistant Agent" workflow: AI Agent reasoning hops on the Ollama chat
+model plus tool sub-workflows, each with its own latency distribution.
+Replies can be streamed (chunked NDJSON) and every request is traced.
+
+Usage:
+    python mock_n8n_server.py                    # realistic latencies
+    python mock_n8n_server.py --latency-scale 0  # answer instantly
+    curl localhost:8888/traces                   # recent traces + percentiles
 """
 import sys
 import io
@@ -11,12 +21,19 @@ import io
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from aiohttp import web
+from collections import deque
+import argparse
+import asyncio
+import json
+import math
 import random
+import time
+import uuid
+from pathlib import Path
 
-app = Flask(__name__)
-CORS(app)
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from resilience import percentile
 
 # Mock responses
 responses = {
@@ -33,60 +50,307 @@ responses = {
     ]
 }
 
-@app.route('/webhook/voice-assistant', methods=['POST', 'GET'])
-def webhook():
+# One reasoning hop of the "Ultimate Assistant" agent on the Ollama chat model
+AGENT_STEP = {"median_ms": 700, "p95_ms": 1800}
+
+# Tool nodes of the "Assistant Agent" workflow: trigger keywords and latency
+TOOLS = {
+    "Email Agent": {"keywords": ["email", "mail"], "median_ms": 2500, "p95_ms": 6000,
+                    "reply": "Done! I've sent the email."},
+    "Calendar Agent": {"keywords": ["calendar", "schedule", "appointment", "meeting"],
+                       "median_ms": 1800, "p95_ms": 4500,
+                       "reply": "I've updated your calendar."},
+    "Contact Agent": {"keywords": ["contact", "phone number", "address"],
+                      "median_ms": 1200, "p95_ms": 3000,
+                      "reply": "I found that contact for you."},
+    "Tavily": {"keywords": ["search", "look up", "google", "news"], "median_ms": 1500, "p95_ms": 4000,
+               "reply": "Here's what I found online: this is a mock search result."},
+    "Calculator": {"keywords": ["times", "plus", "minus", "divided", "calculate"],
+                   "median_ms": 50, "p95_ms": 150,
+                   "reply": "The answer is 42."},
+    "Content Creator Agent": {"keywords": ["blog", "post", "write an article"],
+                              "median_ms": 5000, "p95_ms": 12000,
+                              "reply": "I've drafted that content for you."},
+}
+
+# Set from the command line, see --help
+faults = {
+    'fail_rate': 0.0,   # Fraction of requests answered with HTTP 500
+    'hang_rate': 0.0,   # Fraction of requests that hang for hang_seconds
+    'hang_seconds': 60.0,
+    'delay_ms': 0,      # Added latency for every request
+}
+settings = {
+    'latency_scale': 1.0,   # Multiplier for all simulated workflow latencies
+    'max_concurrent': 10,   # Concurrent executions (N8N_CONCURRENCY_PRODUCTION_LIMIT)
+    'chunk_delay_ms': 30,   # Gap between streamed chunks
+    'trace_file': None,     # Append one JSON trace per request
+}
+
+traces = deque(maxlen=1000)
+
+# Webhook POSTs received and faults injected (what fault_check.py counts)
+counters = {'requests': 0, 'injected_failures': 0, 'injected_hangs': 0}
+
+
+def sample_ms(median_ms: float, p95_ms: float) -> float:
+    """Log-normal latency with the given median and 95th percentile"""
+    if median_ms <= 0:
+        return 0.0
+    sigma = math.log(max(p95_ms, median_ms) / median_ms) / 1.645
+    return random.lognormvariate(math.log(median_ms), sigma) * settings['latency_scale']
+
+
+def select_tools(text: str, intent: str) -> list:
+    if intent == "CONVERSATION":
+        return []
+    return [name for name, tool in TOOLS.items() if any(kw in text for kw in tool['keywords'])]
+
+
+def reply_for(text: str, tools: list) -> str:
+    if tools:
+        return " ".join(TOOLS[name]['reply'] for name in tools)
+    for keyword, response in responses.items():
+        if keyword != 'default' and keyword in text:
+            return response
+    return random.choice(responses['default'])
+
+
+class Trace:
+    """Timeline of one webhook execution"""
+
+    def __init__(self, text: str, intent: str, streamed: bool, trace_id: str = None):
+        self.started = time.perf_counter()
+        self.record = {
+            'id': uuid.uuid4().hex[:12],
+            'trace_id': trace_id,
+            'received': time.time(),
+            'text': text,
+            'intent': intent,
+            'streamed': streamed,
+            'stages': [],
+            'status': 200,
+        }
+
+    async def stage(self, node: str, duration_ms: float):
+        start_ms = (time.perf_counter() - self.started) * 1000
+        await asyncio.sleep(duration_ms / 1000)
+        self.record['stages'].append({
+            'node': node, 'start_ms': round(start_ms, 1), 'duration_ms': round(duration_ms, 1)
+        })
+
+    def finish(self, status: int = 200):
+        self.record['status'] = status
+        self.record['total_ms'] = round((time.perf_counter() - self.started) * 1000, 1)
+        traces.append(self.record)
+        if settings['trace_file']:
+            with open(settings['trace_file'], 'a') as f:
+                f.write(json.dumps(self.record) + "\n")
+
+
+async def run_workflow(trace: Trace, text: str, tools: list, limiter: asyncio.Semaphore):
+    """Simulate the agent: plan, call each tool, then write the answer"""
+    queued = time.perf_counter()
+    async with limiter:
+        trace.record['queue_ms'] = round((time.perf_counter() - queued) * 1000, 1)
+        await trace.stage("Ultimate Assistant", sample_ms(**AGENT_STEP))
+        for name in tools:
+            await trace.stage(name, sample_ms(TOOLS[name]['median_ms'], TOOLS[name]['p95_ms']))
+            await trace.stage("Ultimate Assistant", sample_ms(**AGENT_STEP))
+    return reply_for(text, tools)
+
+
+async def inject_faults():
+    """Apply configured latency/failures; returns an error response or None"""
+    if faults['delay_ms']:
+        await asyncio.sleep(faults['delay_ms'] / 1000)
+    if random.random() < faults['hang_rate']:
+        counters['injected_hangs'] += 1
+        await asyncio.sleep(faults['hang_seconds'])
+    if random.random() < faults['fail_rate']:
+        counters['injected_failures'] += 1
+        print("💥 Injected failure")
+        return web.json_response({'error': 'injected failure'}, status=500)
+    return None
+
+
+def wants_stream(request: web.Request, data: dict) -> bool:
+    return (bool(data.get('stream')) or request.query.get('stream') == '1'
+            or 'application/x-ndjson' in request.headers.get('Accept', ''))
+
+
+async def stream_reply(request: web.Request, trace: Trace, text: str, tools: list,
+                       limiter: asyncio.Semaphore) -> web.StreamResponse:
+    """n8n-style streaming: begin, progress per node, items, end
+
+    Finishes the trace itself: once the headers are sent a failure can only
+    be reported in the stream (an n8n 'error' message), not as a 500.
+    """
+    resp = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await resp.prepare(request)
+
+    async def send(message: dict):
+        await resp.write((json.dumps(message) + "\n").encode('utf-8'))
+
+    try:
+        await send({'type': 'begin', 'metadata': {'executionId': trace.record['id']}})
+        sent = 0
+
+        async def progress():
+            nonlocal sent
+            while True:
+                for stage in trace.record['stages'][sent:]:
+                    await send({'type': 'progress', 'node': stage['node']})
+                    sent += 1
+                await asyncio.sleep(0.05)
+
+        reporter = asyncio.create_task(progress())
+        try:
+            reply = await run_workflow(trace, text, tools, limiter)
+        finally:
+            reporter.cancel()
+        for stage in trace.record['stages'][sent:]:
+            await send({'type': 'progress', 'node': stage['node']})
+
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            await send({'type': 'item', 'content': word + (" " if i < len(words) - 1 else "")})
+            await asyncio.sleep(settings['chunk_delay_ms'] / 1000 * settings['latency_scale'])
+        await send({'type': 'end', 'output': reply})
+        await resp.write_eof()
+    except Exception as e:
+        print(f"❌ Stream error: {e}")
+        trace.finish(status=500)
+        try:
+            await send({'type': 'error', 'content': str(e)})
+            await resp.write_eof()
+        except ConnectionError:
+            pass  # Client already gone
+        return resp
+    trace.finish()
+    return resp
+
+
+async def webhook(request: web.Request):
     """Mock webhook endpoint"""
+    if request.method == 'GET':
+        return web.json_response({
+            'status': 'ok',
+            'message': 'Mock n8n webhook endpoint is running'
+        })
+
+    trace = None
+    counters['requests'] += 1
     try:
-        if request.method == 'POST':
-            data = request.json
-            text = data.get('text', '').lower()
-            
-            print(f"📥 Received: {text}")
-            
-            # Generate response based on keywords
-            response_text = None
-            for keyword, response in responses.items():
-                if keyword != 'default' and keyword in text:
-                    response_text = response
-                    break
-            
-            if not response_text:
-                response_text = random.choice(responses['default'])
-            
-            print(f"📤 Responding: {response_text}")
-            
-            return jsonify({
-                'success': True,
-                'output': response_text,
-                'message': response_text,
-                'source': 'mock_n8n_server'
-            })
-        else:
-            return jsonify({
-                'status': 'ok',
-                'message': 'Mock n8n webhook endpoint is running'
-            })
+        fault = await inject_faults()
+        if fault:
+            return fault
+
+        data = await request.json()
+        text = data.get('text', '').lower()
+        intent = data.get('intent', 'CONVERSATION')
+        tools = select_tools(text, intent)
+        streamed = wants_stream(request, data)
+        trace = Trace(text, intent, streamed,
+                      trace_id=request.headers.get('X-Trace-Id') or data.get('trace_id'))
+        print(f"📥 Received ({intent}): {text}")
+
+        if streamed:
+            return await stream_reply(request, trace, text, tools, request.app['limiter'])
+
+        response_text = await run_workflow(trace, text, tools, request.app['limiter'])
+        trace.finish()
+        print(f"📤 Responding ({trace.record['total_ms']:.0f}ms): {response_text}")
+        return web.json_response({
+            'success': True,
+            'output': response_text,
+            'message': response_text,
+            'source': 'mock_n8n_server'
+        })
     except Exception as e:
         print(f"❌ Error: {e}")
-        return jsonify({'error': str(e)}), 500
+        if trace:
+            trace.finish(status=500)
+        return web.json_response({'error': str(e)}, status=500)
 
-@app.route('/')
-def index():
-    return jsonify({
+
+async def get_traces(request: web.Request):
+    """Recent traces plus latency percentiles per node"""
+    limit = int(request.query.get('limit', 50))
+    recent = list(traces)
+    by_node = {}
+    for record in recent:
+        for stage in record['stages']:
+            by_node.setdefault(stage['node'], []).append(stage['duration_ms'])
+    totals = [r['total_ms'] for r in recent if 'total_ms' in r]
+    return web.json_response({
+        'count': len(recent),
+        'total_ms': {'p50': percentile(totals, 50), 'p95': percentile(totals, 95),
+                     'p99': percentile(totals, 99)},
+        'nodes': {node: {'count': len(v), 'p50': percentile(v, 50), 'p95': percentile(v, 95)}
+                  for node, v in by_node.items()},
+        'counters': counters,
+        'traces': recent[-limit:],
+    })
+
+
+async def index(request: web.Request):
+    return web.json_response({
         'status': 'running',
         'message': 'Mock n8n server for voice testing',
-        'webhook': '/webhook/voice-assistant'
+        'webhook': '/webhook/voice-assistant',
+        'traces': '/traces'
     })
 
+
+def create_app() -> web.Application:
+    app = web.Application()
+
+    async def on_startup(app):
+        app['limiter'] = asyncio.Semaphore(settings['max_concurrent'])
+
+    app.on_startup.append(on_startup)
+    app.router.add_route('*', '/webhook/voice-assistant', webhook)
+    app.router.add_get('/traces', get_traces)
+    app.router.add_get('/', index)
+    return app
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock n8n server")
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests that return 500")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument('--hang-seconds', type=float, default=60.0)
+    parser.add_argument('--delay-ms', type=int, default=0, help="Latency added to every request")
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="Multiplier for simulated agent/tool latencies (0 = instant)")
+    parser.add_argument('--max-concurrent', type=int, default=10,
+                        help="Workflow executions running at once; the rest queue")
+    parser.add_argument('--trace-file', help="Append a JSON trace per request to this file")
+    args = parser.parse_args()
+    faults.update(
+        fail_rate=args.fail_rate, hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds, delay_ms=args.delay_ms
+    )
+    settings.update(
+        latency_scale=args.latency_scale, max_concurrent=args.max_concurrent,
+        trace_file=args.trace_file
+    )
+
     print("\n" + "="*60)
     print("🎭 Mock n8n Server")
     print("="*60)
     print("This simulates n8n so you can test voice functionality")
-    print("Webhook: http://localhost:8888/webhook/voice-assistant")
+    print(f"Webhook: http://localhost:{args.port}/webhook/voice-assistant")
+    print(f"Traces:  http://localhost:{args.port}/traces")
     print("="*60)
     print("\n✓ Voice responses will work")
     print("✓ Test your microphone and speaker")
-    print("✓ Then connect to real n8n\n")
-    
-    app.run(host='127.0.0.1', port=8888, debug=False)
+    print("✓ Then connect to real n8n")
+    print(f"✓ Latency scale {args.latency_scale}, {args.max_concurrent} concurrent executions")
+    if any(faults[k] for k in ('fail_rate', 'hang_rate', 'delay_ms')):
+        print(f"⚠️  Fault injection: {faults}")
+    print()
+
+    web.run_app(create_app(), host='127.0.0.1', port=args.port, print=None)
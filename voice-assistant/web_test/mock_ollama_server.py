@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mock Ollama server for testing and load-testing without a GPU
+Implements /api/tags, /api/generate and /api/chat (streaming and not) with
+per-model time-to-first-token, token rate, model load delay and faults
+
+Usage:
+    python mock_ollama_server.py                      # realistic latencies
+    python mock_ollama_server.py --profile instant    # no delays (functional tests)
+    OLLAMA_HOST=http://localhost:11434 python ../voice_service.py test
+"""
+import sys
+import io
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+from flask import Flask, Response, request, jsonify
+from flask_cors import CORS
+from datetime import datetime, timezone
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+app = Flask(__name__)
+CORS(app)
+
+# Latency profiles by model size (CPU-ish numbers for a desktop i9)
+PROFILES = {
+    "1b": {"ttft_ms": 40, "tokens_per_sec": 90, "load_ms": 800},
+    "3b": {"ttft_ms": 90, "tokens_per_sec": 45, "load_ms": 1500},
+    "7b": {"ttft_ms": 200, "tokens_per_sec": 20, "load_ms": 3000},
+    "14b": {"ttft_ms": 400, "tokens_per_sec": 10, "load_ms": 6000},
+    "default": {"ttft_ms": 100, "tokens_per_sec": 40, "load_ms": 1500},
+}
+INSTANT = {"ttft_ms": 0, "tokens_per_sec": 0, "load_ms": 0}  # 0 tokens/sec = no delay
+
+# Models reported by /api/tags (the ones config.yaml uses)
+MODELS = ["llama3.2:1b", "llama3.2:3b", "qwen2.5:3b", "qwen2.5:7b", "qwen2.5:14b"]
+
+# Set from the command line, see --help
+settings = {
+    'profile': None,      # Force one profile for every model (None = by size)
+    'jitter': 0.2,        # +/- fraction applied to every delay
+    'keep_alive': 300.0,  # Seconds a model stays loaded after its last request
+    'parallel': 4,        # Concurrent generations per model (OLLAMA_NUM_PARALLEL)
+    'fail_rate': 0.0,     # Fraction of requests answered with HTTP 500
+    'hang_rate': 0.0,     # Fraction of requests that hang for hang_seconds
+    'hang_seconds': 60.0,
+    'midstream_fail_rate': 0.0,  # Fraction of streams cut off halfway
+}
+
+_loaded = {}          # model -> last used (time.time())
+_load_lock = threading.Lock()
+_slots = {}           # model -> semaphore limiting concurrent generations
+_slots_lock = threading.Lock()
+
+CANNED = [
+    "Sure, here is a short answer to that.",
+    "That is a great question, and the short answer is that it depends on the details.",
+    "I am a mock language model, so this reply is made up for testing purposes only.",
+    "Here is what I know about that topic, kept brief for a voice reply.",
+]
+
+
+def profile_for(model: str) -> dict:
+    if settings['profile']:
+        return settings['profile']
+    match = re.search(r":(\d+)b\b", model)
+    return PROFILES.get(f"{match.group(1)}b" if match else "default", PROFILES["default"])
+
+
+def jittered(seconds: float) -> float:
+    return max(0.0, seconds * random.uniform(1 - settings['jitter'], 1 + settings['jitter']))
+
+
+def slot_for(model: str) -> threading.Semaphore:
+    with _slots_lock:
+        if model not in _slots:
+            _slots[model] = threading.BoundedSemaphore(settings['parallel'])
+        return _slots[model]
+
+
+def ensure_loaded(model: str) -> float:
+    """Simulate loading the model into memory; returns load seconds"""
+    now = time.time()
+    with _load_lock:
+        last_used = _loaded.get(model)
+        loaded = last_used is not None and now - last_used < settings['keep_alive']
+        _loaded[model] = now
+    if loaded:
+        return 0.0
+    delay = jittered(profile_for(model)['load_ms'] / 1000)
+    time.sleep(delay)
+    return delay
+
+
+def inject_faults():
+    """Apply configured failures; returns an error response or None"""
+    if random.random() < settings['hang_rate']:
+        time.sleep(settings['hang_seconds'])
+    if random.random() < settings['fail_rate']:
+        print("💥 Injected failure")
+        return jsonify({'error': 'injected failure'}), 500
+    return None
+
+
+def reply_for(prompt: str) -> str:
+    """Deterministic reply so repeated prompts behave the same"""
+    lower = prompt.lower()
+    if "category:" in lower:
+        # Intent classifier prompt from voice_service.classify_intent
+        query = lower.rsplit("query:", 1)[-1]
+        if any(kw in query for kw in ("light", "thermostat", "temperature", "lock", "turn on", "turn off")):
+            return "HOME_CONTROL"
+        if any(kw in query for kw in ("email", "calendar", "timer", "alarm", "remind")):
+            return "TOOLS"
+        return "CONVERSATION"
+    if "command:" in lower:
+        return "Done, I took care of that for you."
+    digest = int(hashlib.md5(prompt.encode('utf-8')).hexdigest(), 16)
+    return CANNED[digest % len(CANNED)]
+
+
+def tokenize(text: str, limit: int) -> list:
+    """Whitespace tokens (keeping the separators), capped at num_predict"""
+    tokens = re.findall(r"\S+\s*", text)
+    return tokens[:limit] if limit and limit > 0 else tokens
+
+
+def timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def generate_tokens(model: str, prompt: str, options: dict):
+    """Yield (token, done) pairs at the model's speed, holding a model slot"""
+    profile = profile_for(model)
+    tokens = tokenize(reply_for(prompt), options.get('num_predict', 128))
+    cut_at = len(tokens) // 2 if random.random() < settings['midstream_fail_rate'] else None
+    with slot_for(model):
+        time.sleep(jittered(profile['ttft_ms'] / 1000))
+        for i, token in enumerate(tokens):
+            if i == cut_at:
+                print("💥 Injected mid-stream failure")
+                raise ConnectionAbortedError("injected mid-stream failure")
+            if i and profile['tokens_per_sec']:
+                time.sleep(jittered(1 / profile['tokens_per_sec']))
+            yield token
+
+
+def final_stats(prompt: str, tokens: list, started: float, load_seconds: float) -> dict:
+    """Timing fields Ollama reports on the last message (nanoseconds)"""
+    total = time.perf_counter() - started
+    return {
+        "total_duration": int(total * 1e9),
+        "load_duration": int(load_seconds * 1e9),
+        "prompt_eval_count": max(1, len(prompt) // 4),
+        "eval_count": len(tokens),
+        "eval_duration": int(max(0.0, total - load_seconds) * 1e9),
+    }
+
+
+def run_model(model: str, prompt: str, options: dict, stream: bool, wrap):
+    """Shared body of /api/generate and /api/chat; wrap(text) builds the payload"""
+    started = time.perf_counter()
+    load_seconds = ensure_loaded(model)
+    base = {"model": model}
+
+    if not stream:
+        try:
+            tokens = list(generate_tokens(model, prompt, options))
+        except ConnectionAbortedError as e:
+            return jsonify({'error': str(e)}), 500
+        return jsonify({
+            **base, "created_at": timestamp(), **wrap("".join(tokens)),
+            "done": True, "done_reason": "stop",
+            **final_stats(prompt, tokens, started, load_seconds),
+        })
+
+    def chunks():
+        tokens = []
+        try:
+            for token in generate_tokens(model, prompt, options):
+                tokens.append(token)
+                yield json.dumps({**base, "created_at": timestamp(), **wrap(token), "done": False}) + "\n"
+        except ConnectionAbortedError:
+            return  # Close the stream without a final message
+        yield json.dumps({
+            **base, "created_at": timestamp(), **wrap(""),
+            "done": True, "done_reason": "stop",
+            **final_stats(prompt, tokens, started, load_seconds),
+        }) + "\n"
+
+    return Response(chunks(), mimetype='application/x-ndjson')
+
+
+@app.route('/api/tags')
+def tags():
+    return jsonify({"models": [
+        {
+            "name": name, "model": name, "modified_at": timestamp(), "size": 0,
+            "digest": hashlib.sha256(name.encode()).hexdigest(),
+            "details": {"family": name.split(':')[0], "parameter_size": name.split(':')[-1].upper()},
+        }
+        for name in MODELS
+    ]})
+
+
+@app.route('/api/version')
+def version():
+    return jsonify({"version": "0.0.0-mock"})
+
+
+@app.route('/api/generate', methods=['POST'])
+def api_generate():
+    fault = inject_faults()
+    if fault:
+        return fault
+    data = request.get_json(force=True) or {}
+    model = data.get('model', '')
+    if not model:
+        return jsonify({'error': 'model is required'}), 400
+    prompt = data.get('prompt', '')
+    print(f"📥 generate {model}: {prompt[-60:]!r}")
+    return run_model(
+        model, prompt, data.get('options') or {}, data.get('stream', True),
+        lambda text: {"response": text},
+    )
+
+
+@app.route('/api/chat', methods=['POST'])
+def api_chat():
+    fault = inject_faults()
+    if fault:
+        return fault
+    data = request.get_json(force=True) or {}
+    model = data.get('model', '')
+    if not model:
+        return jsonify({'error': 'model is required'}), 400
+    messages = data.get('messages') or []
+    prompt = "\n".join(m.get('content', '') for m in messages)
+    last = messages[-1].get('content', '') if messages else ''
+    print(f"📥 chat {model}: {last[-60:]!r}")
+    return run_model(
+        model, prompt, data.get('options') or {}, data.get('stream', True),
+        lambda text: {"message": {"role": "assistant", "content": text}},
+    )
+
+
+@app.route('/')
+def index():
+    return "Ollama is running"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock Ollama server")
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--profile', choices=sorted(PROFILES) + ['instant'],
+                        help="Use one latency profile for every model (default: by model size)")
+    parser.add_argument('--ttft-ms', type=float, help="Override time to first token")
+    parser.add_argument('--tokens-per-sec', type=float, help="Override generation speed (0 = no delay)")
+    parser.add_argument('--load-ms', type=float, help="Override model load delay")
+    parser.add_argument('--jitter', type=float, default=0.2, help="+/- fraction applied to delays")
+    parser.add_argument('--keep-alive', type=float, default=300.0, help="Seconds before a model is unloaded")
+    parser.add_argument('--parallel', type=int, default=4, help="Concurrent generations per model")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of requests that return 500")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument('--hang-seconds', type=float, default=60.0)
+    parser.add_argument('--midstream-fail-rate', type=float, default=0.0,
+                        help="Fraction of streams cut off halfway")
+    args = parser.parse_args()
+
+    profile = None
+    if args.profile:
+        profile = dict(INSTANT if args.profile == 'instant' else PROFILES[args.profile])
+    overrides = {k: v for k, v in (('ttft_ms', args.ttft_ms), ('tokens_per_sec', args.tokens_per_sec),
+                                   ('load_ms', args.load_ms)) if v is not None}
+    if overrides:
+        profile = {**(profile or PROFILES['default']), **overrides}
+    settings.update(
+        profile=profile, jitter=args.jitter, keep_alive=args.keep_alive, parallel=args.parallel,
+        fail_rate=args.fail_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        midstream_fail_rate=args.midstream_fail_rate,
+    )
+
+    print("\n" + "="*60)
+    print("🎭 Mock Ollama Server")
+    print("="*60)
+    print(f"API: http://localhost:{args.port}/api/generate, /api/chat, /api/tags")
+    print(f"Latency: {profile or 'by model size ' + json.dumps(PROFILES)}")
+    if any(settings[k] for k in ('fail_rate', 'hang_rate', 'midstream_fail_rate')):
+        print(f"⚠️  Fault injection: fail={args.fail_rate} hang={args.hang_rate} "
+              f"midstream={args.midstream_fail_rate}")
+    print("="*60 + "\n")
+
+    app.run(host='127.0.0.1', port=args.port, debug=False, threaded=True)
@@ -5,21 +5,30 @@ Simple Flask server for voice assistant web testing
 import os
 import sys
 import base64
-import tempfile
 from pathlib import Path
 from flask import Flask, render_template, request, jsonify, send_from_directory
 from flask_cors import CORS
 import asyncio
+import logging
+import time
 import aiohttp
 
 # Add parent directory to path to import voice_service
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-# Import from voice_service
-from faster_whisper import WhisperModel
-import subprocess
 import yaml
 
+from audio_chunking import AudioChunker
+from audio_preprocess import AudioDecodeError, AudioPreprocessor
+from cancellation import CancelToken, Cancelled, TokenRegistry, run_process
+from logging_setup import logged_request, setup_logging, stage
+from resilience import BackendUnavailable, all_metrics, get_backend
+from resource_planner import configure_process
+from response_cache import ResponseCache
+from single_flight import SingleFlight, normalize_text
+from tracing import current_trace_id, inject_headers, setup_tracing
+from whisper_router import WhisperRouter, configured_loader
+
 app = Flask(__name__, static_folder='.', template_folder='.')
 CORS(app)
 
@@ -28,63 +37,120 @@ CONFIG_PATH = Path(__file__).parent.parent / "config" / "config.yaml"
 with open(CONFIG_PATH) as f:
     config = yaml.safe_load(f)
 
-# Initialize Whisper
-print("Loading Whisper model...")
-whisper_model = WhisperModel(
-    os.getenv("WHISPER_MODEL", "base.en"),
-    device=os.getenv("WHISPER_DEVICE", "cpu"),
-    compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+# Queue-based structured logging shared with the other entry points
+setup_logging(config.get('logging'), service='web_server')
+setup_tracing(config.get('tracing'), service='web_server')
+logger = logging.getLogger('VoiceAssistant.web')
+
+# Thread budget and CPU pinning must be set before ctranslate2 is loaded
+WORKER_PLAN = configure_process(config)
+
+# Initialize Whisper: clips are routed to a model by duration (no sessions
+# here, so the confirmation route never matches); WHISPER_MODEL sets the default
+print("Loading Whisper models...")
+whisper_router = WhisperRouter.from_config(
+    configured_loader(config.get('whisper'), WORKER_PLAN),
+    config.get('whisper_routing'),
+    config.get('whisper'),
+    default_model=os.getenv("WHISPER_MODEL"),
+    # Long uploads: split at pauses, chunks decoded on the model replicas in parallel
+    chunker=AudioChunker.from_config(config.get('chunked_transcription'), WORKER_PLAN.num_workers),
 )
-print("✓ Whisper model loaded")
+print(f"✓ Whisper models loaded: {', '.join(whisper_router.preload())}")
+
+# Resampling, downmix and normalization in NumPy (replaces the ffmpeg step)
+audio_preprocessor = AudioPreprocessor.from_config(config.get('audio_preprocessing'))
 
 # Piper TTS path
 PIPER_MODEL = os.getenv("PIPER_MODEL_PATH")
 N8N_WEBHOOK = os.getenv("N8N_WEBHOOK_URL")
 
+# Adaptive timeout, retries and circuit breaker for n8n
+n8n_backend = get_backend('n8n', config.get('resilience'))
+
+# Merge identical concurrent n8n queries (opt-in per intent, never TOOLS)
+n8n_flight = SingleFlight.from_config(config.get('coalescing'), 'n8n')
+
+# Answers to repeated factual questions (None if disabled)
+response_cache = ResponseCache.from_config(config.get('response_cache'))
+
+# In-flight /api/voice turns the client can cancel through /api/interrupt
+voice_turns = TokenRegistry()
+
 
-def transcribe_audio(audio_path: str) -> str:
-    """Transcribe audio using Faster-Whisper"""
-    segments, info = whisper_model.transcribe(audio_path, beam_size=5)
-    text = " ".join([segment.text for segment in segments]).strip()
-    return text
+def transcribe_audio(audio, token: CancelToken = None) -> str:
+    """Transcribe preprocessed 16 kHz audio using Faster-Whisper"""
+    return whisper_router.transcribe(audio, token).text
 
 
-def synthesize_speech(text: str) -> bytes:
+def synthesize_speech(text: str, token: CancelToken = None) -> bytes:
     """Synthesize speech using Piper TTS"""
     try:
         if not PIPER_MODEL or not os.path.exists(PIPER_MODEL):
-            print(f"Warning: Piper model not found at {PIPER_MODEL}")
+            logger.warning("Piper model not found at %s", PIPER_MODEL)
             return None
             
-        # Run piper TTS
-        result = subprocess.run(
+        # Run piper TTS (killed if the turn is cancelled)
+        result = run_process(
             ["piper", "--model", PIPER_MODEL, "--output-raw"],
-            input=text,
-            capture_output=True,
-            text=True,
-            check=True
+            token,
+            input=text.encode()
         )
-        return result.stdout.encode() if result.stdout else None
+        return result.stdout or None
+    except Cancelled:
+        raise
     except Exception as e:
-        print(f"TTS error: {e}")
+        logger.error("TTS error: %s", e)
         return None
 
 
 async def call_n8n_webhook(text: str, intent: str = "CONVERSATION") -> dict:
     """Call n8n webhook"""
-    try:
+    payload = {"text": text, "intent": intent, "source": "web_test", "trace_id": current_trace_id()}
+    headers = inject_headers()
+
+    async def post(timeout):
         async with aiohttp.ClientSession() as session:
             async with session.post(
                 N8N_WEBHOOK,
-                json={"text": text, "intent": intent, "source": "web_test"},
-                timeout=aiohttp.ClientTimeout(total=30)
+                json=payload,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=timeout)
             ) as resp:
+                if resp.status >= 500:
+                    resp.raise_for_status()
                 if resp.status == 200:
                     return await resp.json()
                 else:
                     return {"error": f"n8n returned status {resp.status}"}
-    except Exception as e:
-        return {"error": str(e)}
+
+    is_tools = intent == "TOOLS"
+
+    async def send():
+        try:
+            return await n8n_backend.acall(
+                post,
+                idempotent=not is_tools,
+                cache_key=None if is_tools else (intent, text.strip().lower())
+            )
+        except BackendUnavailable as e:
+            return {"error": str(e)}
+
+    if response_cache and not is_tools:
+        cached = response_cache.get(text, intent)
+        if cached is not None:
+            return {"output": cached, "cached": True}
+
+    start = time.perf_counter()
+    if is_tools or not n8n_flight.enabled_for(intent):
+        result = await send()
+    else:
+        # Copy: coalesced callers share one upstream response
+        result = dict(await n8n_flight.ado((intent, normalize_text(text)), send))
+
+    if response_cache and not is_tools and result.get('output') and not result.get('error'):
+        response_cache.put(text, intent, result['output'], time.perf_counter() - start)
+    return result
 
 
 @app.route('/')
@@ -104,7 +170,20 @@ def test_connection():
     })
 
 
+@app.route('/api/metrics')
+def metrics():
+    """Circuit breaker state, adaptive timeouts and call counters per backend"""
+    return jsonify({
+        'backends': all_metrics(),
+        'coalescing': {'n8n': n8n_flight.stats},
+        'response_cache': response_cache.stats() if response_cache else None,
+        'transcription': whisper_router.stats(),
+        'preprocessing': audio_preprocessor.stats()
+    })
+
+
 @app.route('/api/chat', methods=['POST'])
+@logged_request('chat', logger)
 async def handle_chat():
     """Handle text-only chat (no audio transcription)"""
     try:
@@ -117,12 +196,13 @@ async def handle_chat():
             }), 400
         
         text = data['text']
-        print(f"Chat input: {text}")
+        logger.debug("Chat input: %s", text)
         
         # Send to n8n
         try:
-            n8n_response = await call_n8n_webhook(text, "CONVERSATION")
-            print(f"n8n response: {n8n_response}")
+            with stage('n8n'):
+                n8n_response = await call_n8n_webhook(text, "CONVERSATION")
+            logger.debug("n8n response: %s", n8n_response)
             
             # Extract response text
             if isinstance(n8n_response, dict):
@@ -131,7 +211,7 @@ async def handle_chat():
                 response_text = str(n8n_response)
                 
         except Exception as e:
-            print(f"n8n webhook error: {e}")
+            logger.error("n8n webhook error: %s", e)
             return jsonify({
                 'success': False,
                 'error': f"n8n error: {str(e)}"
@@ -143,18 +223,37 @@ async def handle_chat():
         })
         
     except Exception as e:
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Chat request failed: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
 
+@app.route('/api/interrupt', methods=['POST'])
+def handle_interrupt():
+    """Cancel an in-flight /api/voice turn by the turn_id it was sent with"""
+    turn_id = (request.get_json(silent=True) or {}).get('turn_id')
+    if not turn_id:
+        return jsonify({'success': False, 'error': 'No turn_id provided'}), 400
+    return jsonify({'success': True, 'interrupted': voice_turns.cancel(turn_id)})
+
+
 @app.route('/api/voice', methods=['POST'])
+@logged_request('voice', logger)
 def handle_voice():
     """Handle voice input from browser"""
+    # Optional client-chosen ID so the turn can be cancelled via /api/interrupt
+    with voice_turns.turn(request.form.get('turn_id')) as token:
+        try:
+            return process_voice(token)
+        except Cancelled:
+            logger.info("Voice turn interrupted")
+            return jsonify({'success': False, 'interrupted': True, 'error': 'Interrupted', 'transcript': ''})
+
+
+def process_voice(token: CancelToken):
+    """Transcribe, answer and synthesize one voice turn"""
     try:
         # Get audio file from request
         if 'audio' not in request.files:
@@ -162,94 +261,75 @@ def handle_voice():
         
         audio_file = request.files['audio']
         
-        # Save to temp file with original extension first
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_audio:
-            audio_file.save(temp_audio.name)
-            temp_audio_path = temp_audio.name
+        audio_bytes = audio_file.read()
+        logger.debug("Received audio file: %d bytes", len(audio_bytes))
         
-        # Convert to WAV using ffmpeg if needed
-        wav_path = temp_audio_path.replace('.webm', '.wav')
+        if len(audio_bytes) < 1000:
+            return jsonify({
+                'success': False,
+                'error': 'Audio file too small - please record for at least 1 second',
+                'transcript': ''
+            })
         
-        try:
-            # Check file size
-            file_size = os.path.getsize(temp_audio_path)
-            print(f"Received audio file: {file_size} bytes")
-            
-            if file_size < 1000:
+        # Decode and resample in-process (any rate / channel count -> 16 kHz mono),
+        # in pooled buffers held until Whisper is done with the audio
+        with audio_preprocessor.buffers() as buffers:
+            try:
+                with stage('preprocess'):
+                    audio = audio_preprocessor.load(audio_bytes, token, buffers)
+            except AudioDecodeError as e:
+                logger.warning("Undecodable audio upload: %s", e)
                 return jsonify({
                     'success': False,
-                    'error': 'Audio file too small - please record for at least 1 second',
+                    'error': 'Could not decode audio - unsupported format',
                     'transcript': ''
                 })
             
-            # Convert to WAV using ffmpeg
-            try:
-                subprocess.run([
-                    'ffmpeg', '-i', temp_audio_path,
-                    '-ar', '16000',  # 16kHz sample rate
-                    '-ac', '1',       # Mono
-                    '-y',             # Overwrite
-                    wav_path
-                ], check=True, capture_output=True)
-                print(f"Converted to WAV: {wav_path}")
-            except subprocess.CalledProcessError:
-                # If ffmpeg fails, try using the file as-is
-                print("FFmpeg conversion failed, trying original file...")
-                wav_path = temp_audio_path
-            except FileNotFoundError:
-                print("FFmpeg not found, trying original file...")
-                wav_path = temp_audio_path
-            
             # Transcribe
-            print(f"Transcribing audio from {wav_path}...")
-            transcript = transcribe_audio(wav_path)
-            print(f"Transcript: {transcript}")
-            
-            if not transcript or len(transcript.strip()) < 2:
-                return jsonify({
-                    'success': False,
-                    'error': 'Could not transcribe audio - please speak clearly and record for longer',
-                    'transcript': transcript or ''
-                })
-            
-            # Send to n8n
-            print(f"Sending to n8n: {transcript}")
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            n8n_response = loop.run_until_complete(
-                call_n8n_webhook(transcript, "CONVERSATION")
-            )
-            loop.close()
-            
-            print(f"n8n response: {n8n_response}")
-            
-            # Extract response text (adjust based on your n8n output)
-            response_text = n8n_response.get('output', n8n_response.get('message', 'I received your message.'))
-            
-            # Synthesize speech
-            audio_bytes = synthesize_speech(response_text)
-            audio_base64 = base64.b64encode(audio_bytes).decode() if audio_bytes else None
-            
+            with stage('whisper'):
+                transcript = transcribe_audio(audio, token)
+        logger.debug("Transcript: %s", transcript)
+        
+        if not transcript or len(transcript.strip()) < 2:
             return jsonify({
-                'success': True,
-                'transcript': transcript,
-                'response': response_text,
-                'audio_base64': audio_base64
+                'success': False,
+                'error': 'Could not transcribe audio - please speak clearly and record for longer',
+                'transcript': transcript or ''
             })
-            
+        
+        # Send to n8n
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with stage('n8n'):
+                # Cancelling the task aborts the aiohttp request
+                n8n_response = loop.run_until_complete(
+                    token.arun(call_n8n_webhook(transcript, "CONVERSATION"))
+                )
         finally:
-            # Clean up temp files
-            try:
-                os.unlink(temp_audio_path)
-                if wav_path != temp_audio_path and os.path.exists(wav_path):
-                    os.unlink(wav_path)
-            except:
-                pass
+            loop.close()
+        
+        logger.debug("n8n response: %s", n8n_response)
+        
+        # Extract response text (adjust based on your n8n output)
+        response_text = n8n_response.get('output', n8n_response.get('message', 'I received your message.'))
+        
+        # Synthesize speech
+        with stage('tts'):
+            audio_bytes = synthesize_speech(response_text, token)
+        audio_base64 = base64.b64encode(audio_bytes).decode() if audio_bytes else None
+        
+        return jsonify({
+            'success': True,
+            'transcript': transcript,
+            'response': response_text,
+            'audio_base64': audio_base64
+        })
     
+    except Cancelled:
+        raise
     except Exception as e:
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Voice request failed: %s", e)
         return jsonify({
             'success': False,
             'error': str(e),
@@ -261,7 +341,7 @@ if __name__ == '__main__':
     print("\n" + "="*60)
     print("🎤 Voice Assistant Web Test Server")
     print("="*60)
-    print(f"Whisper Model: {os.getenv('WHISPER_MODEL', 'base.en')}")
+    print(f"Whisper Models: {', '.join(whisper_router.models())}")
     print(f"Piper Model: {PIPER_MODEL or 'Not configured'}")
     print(f"n8n Webhook: {N8N_WEBHOOK}")
     print("="*60)
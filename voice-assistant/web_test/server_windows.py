@@ -5,56 +5,77 @@ Runs on Windows directly (not WSL) to avoid RDP audio issues
 """
 import os
 import base64
+import logging
 import tempfile
 from pathlib import Path
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import requests
+import yaml
 
 # Add parent directory to path
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from audio_preprocess import AudioDecodeError, AudioPreprocessor
+from logging_setup import logged_request, setup_logging, stage
+from resource_planner import configure_process
+from transcriber import Transcriber
+from whisper_router import configured_default_model, configured_loader
+
+# Configuration
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "config.yaml"
+with open(CONFIG_PATH) as f:
+    config = yaml.safe_load(f)
+
+# Queue-based logging: handlers never block on a slow Windows console
+setup_logging(config.get('logging'), service='server_windows')
+logger = logging.getLogger('VoiceAssistant.windows')
+
 try:
-    from faster_whisper import WhisperModel
+    import faster_whisper  # noqa: F401  (models are built by configured_loader)
     WHISPER_AVAILABLE = True
 except ImportError:
     WHISPER_AVAILABLE = False
-    print("WARNING: faster-whisper not installed. Install with: pip install faster-whisper")
+    logger.warning("faster-whisper not installed. Install with: pip install faster-whisper")
 
 app = Flask(__name__, static_folder='.', template_folder='.')
 CORS(app)
 
-# Configuration
 N8N_WEBHOOK = os.getenv("N8N_WEBHOOK_URL", "http://172.22.32.1:32768/webhook/voice-assistant")
-WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base.en")
+# WHISPER_MODEL, else the default route's model (written by autotune.py)
+WHISPER_MODEL = configured_default_model(config)
+
+# Thread budget for this process (whisper.cpu_threads / num_workers)
+WORKER_PLAN = configure_process(config)
 
 # Initialize Whisper if available
 whisper_model = None
+transcriber = None
 if WHISPER_AVAILABLE:
-    print("Loading Whisper model...")
+    logger.info("Loading Whisper model...")
     try:
-        whisper_model = WhisperModel(
-            WHISPER_MODEL,
-            device="cpu",
-            compute_type="int8"
-        )
-        print("✓ Whisper model loaded")
+        # whisper.device / compute_type from config.yaml (WHISPER_DEVICE etc. win)
+        whisper_model = configured_loader(config.get('whisper'), WORKER_PLAN)(WHISPER_MODEL)
+        # Same decoding settings as the other servers (beam size, VAD, fallback)
+        transcriber = Transcriber.from_config(whisper_model, config.get('whisper'))
+        logger.info("Whisper model loaded")
     except Exception as e:
-        print(f"Failed to load Whisper: {e}")
+        logger.error("Failed to load Whisper: %s", e)
+
+# Resampling, downmix and normalization in NumPy (replaces the ffmpeg step)
+audio_preprocessor = AudioPreprocessor.from_config(config.get('audio_preprocessing'))
 
 
-def transcribe_audio(audio_path: str) -> str:
-    """Transcribe audio using Faster-Whisper"""
-    if not whisper_model:
+def transcribe_audio(audio) -> str:
+    """Transcribe preprocessed 16 kHz audio using Faster-Whisper"""
+    if not transcriber:
         return "[Whisper not available]"
     
     try:
-        segments, info = whisper_model.transcribe(audio_path, beam_size=5)
-        text = " ".join([segment.text for segment in segments]).strip()
-        return text
+        return transcriber.transcribe(audio).text
     except Exception as e:
-        print(f"Transcription error: {e}")
+        logger.error("Transcription error: %s", e)
         return f"[Error: {e}]"
 
 
@@ -92,6 +113,7 @@ def test_connection():
 
 
 @app.route('/api/chat', methods=['POST'])
+@logged_request('chat', logger)
 def handle_chat():
     """Handle text-only chat (no audio transcription)"""
     try:
@@ -104,12 +126,13 @@ def handle_chat():
             }), 400
         
         text = data['text']
-        print(f"Chat input: {text}")
+        logger.debug("Chat input: %s", text)
         
         # Send to n8n
         try:
-            n8n_response = call_n8n_webhook(text, "CONVERSATION")
-            print(f"n8n response: {n8n_response}")
+            with stage('n8n'):
+                n8n_response = call_n8n_webhook(text, "CONVERSATION")
+            logger.debug("n8n response: %s", n8n_response)
             
             # Extract response text
             if isinstance(n8n_response, dict):
@@ -118,7 +141,7 @@ def handle_chat():
                 response_text = str(n8n_response)
                 
         except Exception as e:
-            print(f"n8n webhook error: {e}")
+            logger.error("n8n webhook error: %s", e)
             return jsonify({
                 'success': False,
                 'error': f"n8n error: {str(e)}"
@@ -130,9 +153,7 @@ def handle_chat():
         })
         
     except Exception as e:
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Chat request failed: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -140,6 +161,7 @@ def handle_chat():
 
 
 @app.route('/api/voice', methods=['POST'])
+@logged_request('voice', logger)
 def handle_voice():
     """Handle voice input from browser"""
     try:
@@ -157,7 +179,7 @@ def handle_voice():
         try:
             # Check file size
             file_size = os.path.getsize(temp_audio_path)
-            print(f"Received audio file: {file_size} bytes")
+            logger.debug("Received audio file: %d bytes", file_size)
             
             if file_size < 1000:
                 return jsonify({
@@ -166,28 +188,25 @@ def handle_voice():
                     'transcript': ''
                 })
             
-            # Try converting with ffmpeg if available
-            wav_path = temp_audio_path.replace('.webm', '.wav')
-            
-            try:
-                import subprocess
-                subprocess.run([
-                    'ffmpeg', '-i', temp_audio_path,
-                    '-ar', '16000',  # 16kHz sample rate
-                    '-ac', '1',       # Mono
-                    '-y',             # Overwrite
-                    wav_path
-                ], check=True, capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-                print(f"Converted to WAV: {wav_path}")
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # Use original file if conversion fails
-                print("Using original audio format (no ffmpeg conversion)")
-                wav_path = temp_audio_path
-            
-            # Transcribe
-            print(f"Transcribing audio from {wav_path}...")
-            transcript = transcribe_audio(wav_path)
-            print(f"Transcript: {transcript}")
+            # Decode, downmix and resample to 16 kHz mono in NumPy (no ffmpeg needed),
+            # in pooled buffers held until Whisper is done with the audio
+            with audio_preprocessor.buffers() as buffers:
+                try:
+                    with stage('preprocess'):
+                        audio = audio_preprocessor.load(temp_audio_path, buffers=buffers)
+                except AudioDecodeError as e:
+                    logger.warning("Undecodable audio upload: %s", e)
+                    return jsonify({
+                        'success': False,
+                        'error': 'Could not decode audio - unsupported format',
+                        'transcript': ''
+                    })
+                
+                # Transcribe
+                logger.debug("Transcribing %.1fs of audio", len(audio) / 16000)
+                with stage('whisper'):
+                    transcript = transcribe_audio(audio)
+            logger.debug("Transcript: %s", transcript)
             
             if not transcript or len(transcript.strip()) < 2 or transcript == "[Whisper not available]":
                 return jsonify({
@@ -197,10 +216,11 @@ def handle_voice():
                 })
             
             # Send to n8n
-            print(f"Sending to n8n: {transcript}")
+            logger.debug("Sending to n8n: %s", transcript)
             try:
-                n8n_response = call_n8n_webhook(transcript, "CONVERSATION")
-                print(f"n8n response: {n8n_response}")
+                with stage('n8n'):
+                    n8n_response = call_n8n_webhook(transcript, "CONVERSATION")
+                logger.debug("n8n response: %s", n8n_response)
                 
                 # Extract response text
                 if isinstance(n8n_response, dict):
@@ -209,7 +229,7 @@ def handle_voice():
                     response_text = str(n8n_response)
                     
             except Exception as e:
-                print(f"n8n webhook error: {e}")
+                logger.error("n8n webhook error: %s", e)
                 response_text = f"Error communicating with n8n: {str(e)}"
             
             return jsonify({
@@ -223,15 +243,11 @@ def handle_voice():
             # Clean up temp files
             try:
                 os.unlink(temp_audio_path)
-                if wav_path != temp_audio_path and os.path.exists(wav_path):
-                    os.unlink(wav_path)
             except:
                 pass
     
     except Exception as e:
-        print(f"Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Voice request failed: %s", e)
         return jsonify({
             'success': False,
             'error': str(e),
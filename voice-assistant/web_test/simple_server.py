@@ -15,7 +15,9 @@ if sys.platform == 'win32':
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import requests
+import logging
 import os
+import yaml
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -23,6 +25,24 @@ from pathlib import Path
 env_path = Path(__file__).parent.parent / '.env'
 load_dotenv(env_path)
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from logging_setup import logged_request, setup_logging, stage
+from single_flight import SingleFlight
+from tracing import current_trace_id, inject_headers, setup_tracing
+
+# Queue-based structured logging and tracing shared with the other entry points
+try:
+    with open(Path(__file__).parent.parent / "config" / "config.yaml") as f:
+        CONFIG = yaml.safe_load(f) or {}
+except FileNotFoundError:
+    CONFIG = {}
+setup_logging(CONFIG.get('logging'), service='simple_server')
+setup_tracing(CONFIG.get('tracing'), service='simple_server')
+logger = logging.getLogger('VoiceAssistant.simple')
+
+# Concurrent /api/test probes share one n8n round-trip
+probe_flight = SingleFlight()
+
 app = Flask(__name__, static_folder='.', template_folder='.')
 CORS(app)
 
@@ -49,6 +69,7 @@ def index():
     return response
 
 @app.route('/api/chat', methods=['POST'])
+@logged_request('chat', logger)
 def handle_chat():
     """Forward text to n8n and return response"""
     try:
@@ -58,25 +79,27 @@ def handle_chat():
         if not text:
             return jsonify({'success': False, 'error': 'No text provided'}), 400
         
-        print(f"📤 Sending to n8n: {text}")
-        print(f"🌐 Using URL: {N8N_WEBHOOK_URL}")
+        logger.debug("Sending to n8n: %s", text)
         
         # Send to remote n8n
         try:
-            response = requests.post(
-                N8N_WEBHOOK_URL,
-                json={
-                    "text": text,
-                    "intent": "CONVERSATION",
-                    "source": "web_voice_chat"
-                },
-                timeout=30
-            )
+            with stage('n8n'):
+                response = requests.post(
+                    N8N_WEBHOOK_URL,
+                    json={
+                        "text": text,
+                        "intent": "CONVERSATION",
+                        "source": "web_voice_chat",
+                        "trace_id": current_trace_id()
+                    },
+                    headers=inject_headers(),
+                    timeout=30
+                )
             
             if response.status_code == 200:
                 result = response.json()
                 response_text = result.get('output', result.get('message', 'Message received'))
-                print(f"📥 n8n response: {response_text}")
+                logger.debug("n8n response: %s", response_text)
                 
                 return jsonify({
                     'success': True,
@@ -84,40 +107,40 @@ def handle_chat():
                 })
             else:
                 error_msg = f"n8n returned status {response.status_code}"
-                print(f"❌ {error_msg}")
+                logger.error(error_msg)
                 return jsonify({'success': False, 'error': error_msg}), 500
                 
         except requests.exceptions.Timeout:
             error_msg = "n8n request timeout"
-            print(f"❌ {error_msg}")
+            logger.error(error_msg)
             return jsonify({'success': False, 'error': error_msg}), 504
             
         except requests.exceptions.ConnectionError as e:
             error_msg = f"Cannot connect to n8n: {str(e)}"
-            print(f"❌ {error_msg}")
+            logger.error(error_msg)
             return jsonify({'success': False, 'error': 'Cannot connect to n8n server'}), 503
             
     except Exception as e:
-        print(f"❌ Error: {e}")
+        logger.exception("Chat request failed: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/test', methods=['GET'])
 def test_connection():
     """Test connection to n8n"""
-    print(f"[DEBUG] Test endpoint called, using URL: {N8N_WEBHOOK_URL}")
+    logger.debug("Test endpoint called, using URL: %s", N8N_WEBHOOK_URL)
     try:
-        response = requests.post(
+        status = probe_flight.do('connection test', lambda: requests.post(
             N8N_WEBHOOK_URL,
             json={"text": "connection test", "test": True},
             timeout=5
-        )
+        ).status_code)
         return jsonify({
             'success': True,
-            'status': response.status_code,
+            'status': status,
             'n8n_url': N8N_WEBHOOK_URL
         })
     except Exception as e:
-        print(f"[ERROR] Test connection failed: {e}")
+        logger.error("Test connection failed: %s", e)
         return jsonify({
             'success': False,
             'error': str(e),
@@ -5,16 +5,18 @@ Supports interrupts, streaming transcription, and fluid conversation
 """
 import os
 import sys
-import asyncio
 import base64
-import tempfile
+import hmac
+import json
+import logging
+import secrets
 import time
 from pathlib import Path
 from flask import Flask, render_template, send_from_directory, request
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 from flask_cors import CORS
 import requests
-import subprocess
+import yaml
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -24,6 +26,52 @@ load_dotenv(env_path)
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from audio_chunking import AudioChunker
+from audio_preprocess import AudioDecodeError, AudioPreprocessor
+from cancellation import CancelToken, Cancelled, abortable_session, configure_helpers
+from conversation_history import ConversationHistory
+from degradation import DegradationController
+from logging_setup import annotate, logged_request, setup_logging, stage
+from ollama_scheduler import OllamaScheduler, SchedulerBusy
+from prompt_builder import PromptBuilder
+from resilience import BackendUnavailable, LatencyTracker, all_metrics, get_backend
+from resource_planner import configure_process
+from response_cache import ResponseCache
+from session_store import create_client_manager, create_session_store
+from single_flight import SingleFlight, normalize_text
+from tool_queue import FINISHED_STATES, ToolJobQueue, ToolQueueFull, result_text
+from tracing import current_span, current_trace_id, inject_headers, setup_tracing
+from turn_router import LOCAL, N8N, TurnRouter
+from whisper_router import WhisperRouter, configured_loader
+
+# Load configuration (optional - defaults are used if missing)
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "config.yaml"
+try:
+    with open(CONFIG_PATH) as f:
+        config = yaml.safe_load(f) or {}
+except FileNotFoundError:
+    config = {}
+HISTORY_CONFIG = config.get('history', {})
+SESSION_IDLE_TIMEOUT = HISTORY_CONFIG.get('idle_timeout', 900)
+SESSION_SWEEP_INTERVAL = HISTORY_CONFIG.get('sweep_interval', 60)
+PROMPT_CONFIG = config.get('prompt', {})
+SESSION_STORE_CONFIG = config.get('session_store', {})
+TOOLS_CONFIG = config.get('tools', {})
+RESILIENCE_CONFIG = config.get('resilience', {})
+COALESCING_CONFIG = config.get('coalescing', {})
+
+# Queue-based structured logging shared with the other entry points
+setup_logging(config.get('logging'), service='streaming_server')
+setup_tracing(config.get('tracing'), service='streaming_server')
+logger = logging.getLogger('VoiceAssistant.streaming')
+RESPONSE_CACHE_CONFIG = config.get('response_cache', {})
+ROUTER_CONFIG = config.get('router', {})
+
+# Thread budget and CPU pinning must be set before ctranslate2 is loaded
+WORKER_PLAN = configure_process(config)
+# Helper threads for blocking calls a turn can stop waiting for
+configure_helpers(config.get('server'))
+
 try:
     from faster_whisper import WhisperModel
     WHISPER_AVAILABLE = True
@@ -34,53 +82,82 @@ except ImportError:
 app = Flask(__name__, static_folder='.', template_folder='.')
 app.config['SECRET_KEY'] = 'voice-assistant-secret'
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(
+    app,
+    cors_allowed_origins="*",
+    async_mode='threading',
+    # Shared fan-out between worker processes (None = single process)
+    client_manager=create_client_manager(SESSION_STORE_CONFIG)
+)
 
 # Configuration
 N8N_WEBHOOK = os.getenv("N8N_WEBHOOK_URL", "http://172.22.32.1:32768/webhook/voice-assistant")
-WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base.en")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://172.22.32.1:11434")
 
-# Initialize Whisper
-whisper_model = None
+# Initialize Whisper: one model per route (tiny for confirmations, larger
+# for dictation) within a memory budget; WHISPER_MODEL sets the default
+whisper_router = None
 if WHISPER_AVAILABLE:
-    print("Loading Whisper model...")
+    print("Loading Whisper models...")
     try:
-        whisper_model = WhisperModel(
-            WHISPER_MODEL,
-            device="cpu",
-            compute_type="int8"
+        whisper_router = WhisperRouter.from_config(
+            configured_loader(config.get('whisper'), WORKER_PLAN),
+            config.get('whisper_routing'),
+            config.get('whisper'),
+            default_model=os.getenv("WHISPER_MODEL"),
+            # Long clips: split at pauses, chunks decoded on the model replicas in parallel
+            chunker=AudioChunker.from_config(config.get('chunked_transcription'), WORKER_PLAN.num_workers),
         )
-        print("✓ Whisper model loaded")
+        print(f"✓ Whisper models loaded: {', '.join(whisper_router.preload())}")
     except Exception as e:
-        print(f"Failed to load Whisper: {e}")
-
-# Session state for each client
-sessions = {}
+        logger.error("Failed to load Whisper: %s", e)
+        whisper_router = None
 
+# Resampling, downmix and normalization in NumPy (replaces the ffmpeg step)
+audio_preprocessor = AudioPreprocessor.from_config(config.get('audio_preprocessing'))
 
 class VoiceSession:
     """Manages state for a single voice conversation session"""
     
     def __init__(self, session_id):
         self.session_id = session_id
-        self.conversation_history = []
+        self.conversation_history = ConversationHistory.from_config(HISTORY_CONFIG)
+        self.prompt_builder = PromptBuilder.from_config(self.conversation_history, PROMPT_CONFIG)
+        self.last_active = time.time()
         self.is_processing = False
-        self.should_interrupt = False
+        self.cancel_token = CancelToken()
         self.current_response = ""
         self.pending_tools = None  # Store tools awaiting confirmation
         self.awaiting_confirmation = False
+        self.store_version = None  # Set by the SQLite store, checked on save
+        # Proof of ownership a reconnecting client must send with the session id
+        self.resume_token = secrets.token_urlsafe(32)
         
     def add_message(self, role, content):
-        self.conversation_history.append({
-            "role": role,
-            "content": content,
-            "timestamp": time.time()
-        })
+        self.last_active = time.time()
+        self.conversation_history.append(role, content, self.last_active)
+
+    def is_idle(self, now, timeout):
+        """True if the session has been inactive for longer than timeout"""
+        return not self.is_processing and now - self.last_active > timeout
         
-    def interrupt(self):
-        """Signal to stop current processing"""
-        self.should_interrupt = True
+    def begin_turn(self):
+        """Fresh cancellation token for a new turn (an earlier interrupt must not abort it)"""
+        self.cancel_token = CancelToken()
+        self.is_processing = True
+        return self.cancel_token
+
+    def end_turn(self):
+        """Mark the turn finished; returns seconds from interrupt to idle if it was cancelled"""
+        self.is_processing = False
+        token = self.cancel_token
+        if token.cancelled:
+            return time.perf_counter() - token.cancelled_at
+        return None
+
+    def interrupt(self, reason="interrupt"):
+        """Cancel the current turn: stops decoding, upstream requests and replay"""
+        self.cancel_token.cancel(reason)
         self.is_processing = False
         
     def set_pending_tools(self, tools_info):
@@ -98,92 +175,428 @@ class VoiceSession:
         self.awaiting_confirmation = False
         self.pending_tools = None
 
-
-def transcribe_audio(audio_path: str) -> str:
-    """Transcribe audio using Faster-Whisper"""
-    if not whisper_model:
+    def to_state(self):
+        """Serializable state shared between worker processes"""
+        return {
+            "session_id": self.session_id,
+            "history": self.conversation_history.to_state(),
+            "last_active": self.last_active,
+            "current_response": self.current_response,
+            "pending_tools": self.pending_tools,
+            "awaiting_confirmation": self.awaiting_confirmation,
+            "resume_token": self.resume_token,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        session = cls(state["session_id"])
+        session.conversation_history.load_state(state.get("history", {}))
+        session.last_active = state.get("last_active", session.last_active)
+        session.current_response = state.get("current_response", "")
+        session.pending_tools = state.get("pending_tools")
+        session.awaiting_confirmation = state.get("awaiting_confirmation", False)
+        session.resume_token = state.get("resume_token", session.resume_token)
+        return session
+
+    def merge_state(self, state):
+        """Fold in messages another writer saved (e.g. a tool result); our turn state wins"""
+        self.conversation_history.merge_state(state.get("history", {}))
+        self.last_active = max(self.last_active, state.get("last_active", 0.0))
+
+
+# Session state shared by all workers (memory or SQLite backend)
+session_store = create_session_store(SESSION_STORE_CONFIG, VoiceSession.from_state)
+
+# Live sessions for clients connected to this process, keyed by socket sid
+connected_sessions = {}
+
+
+def new_session():
+    """Fresh session under an unguessable server-issued id"""
+    session = VoiceSession(secrets.token_urlsafe(16))
+    session_store.put(session)
+    return session
+
+
+def resume_session(session_id, resume_token):
+    """Stored session if the token proves the client owns it, else None"""
+    if not session_id or not resume_token:
+        return None
+    session = session_store.get(session_id)
+    if session is None or not hmac.compare_digest(session.resume_token, str(resume_token)):
+        return None
+    return session
+
+
+def get_session(sid):
+    """Live session for a connected client"""
+    session = connected_sessions.get(sid)
+    if session is None:
+        session = connected_sessions[sid] = new_session()
+    return session
+
+
+def save_session(session):
+    """Persist session state so any worker can continue the conversation"""
+    session_store.put(session)
+
+
+def evict_idle_sessions():
+    """Background task: drop sessions that have been idle too long"""
+    while True:
+        socketio.sleep(SESSION_SWEEP_INTERVAL)
+        evicted = set(session_store.evict_idle(time.time(), SESSION_IDLE_TIMEOUT))
+        for sid, session in list(connected_sessions.items()):
+            if session.session_id in evicted:
+                connected_sessions.pop(sid, None)
+        for session_id in evicted:
+            logger.info("Evicted idle session %s", session_id)
+
+
+def start_background_tasks():
+    """Start per-process background tasks (also called by launcher.py workers)"""
+    socketio.start_background_task(evict_idle_sessions)
+
+
+def transcribe_audio(audio, token: CancelToken = None, session=None) -> str:
+    """Transcribe preprocessed 16 kHz audio using Faster-Whisper"""
+    if not whisper_router:
         return "[Whisper not available]"
     
     try:
-        segments, info = whisper_model.transcribe(audio_path, beam_size=5)
-        text = " ".join([segment.text for segment in segments]).strip()
-        return text
+        # Degradation tiers may turn the wide-beam fallback off or route to smaller models
+        result = whisper_router.transcribe(
+            audio, token,
+            awaiting_confirmation=bool(session and session.awaiting_confirmation),
+            route_models=degradation.override('whisper', 'routes', None),
+            beam_size=degradation.override('whisper', 'beam_size', None),
+            fallback_beam_size=degradation.override('whisper', 'fallback_beam_size', None),
+        )
+        annotate(whisper_route=result.route, whisper_model=result.model,
+                 whisper_fallback=result.fallback)
+        return result.text
+    except Cancelled:
+        raise
     except Exception as e:
-        print(f"Transcription error: {e}")
+        logger.error("Transcription error: %s", e)
         return f"[Error: {e}]"
 
 
-async def stream_ollama_response(prompt: str, session: VoiceSession, sid: str):
-    """Stream response from Ollama with interrupt capability"""
+# Adaptive timeouts, retries and circuit breakers for outbound calls
+n8n_backend = get_backend('n8n', RESILIENCE_CONFIG)
+ollama_backend = get_backend('ollama', RESILIENCE_CONFIG)
+# Merge identical concurrent n8n queries (opt-in per intent, never TOOLS)
+n8n_flight = SingleFlight.from_config(COALESCING_CONFIG, 'n8n')
+# Answers to repeated factual questions (None if disabled)
+response_cache = ResponseCache.from_config(RESPONSE_CACHE_CONFIG)
+N8N_FALLBACK = {
+    "output": "I can't reach my assistant service right now. Please try again in a minute.",
+    "degraded": True
+}
+
+
+# Simple CONVERSATION turns skip the n8n agent and stream from Ollama
+turn_router = TurnRouter.from_config(ROUTER_CONFIG)
+# Priority classes and fair per-session queuing for Ollama slots
+ollama_scheduler = OllamaScheduler.from_config(config.get('scheduler'))
+# Under load: smaller local model, fewer tokens, greedy Whisper (tiers in config.yaml)
+degradation = DegradationController.from_config(
+    config.get('degradation'),
+    {'conversation': {'name': turn_router.model, 'max_tokens': turn_router.max_tokens,
+                      'temperature': turn_router.temperature}},
+    ollama_scheduler.depth,
+)
+
+# Time from an interrupt until the handler has stopped all work for the turn
+interrupt_stats = {'count': 0, 'idle': LatencyTracker(window=500)}
+
+
+def finish_turn(session: VoiceSession):
+    """End the session's turn and record interrupt-to-idle latency"""
+    idle = session.end_turn()
+    if idle is not None:
+        interrupt_stats['count'] += 1
+        interrupt_stats['idle'].record(idle)
+        logger.info("Turn interrupted", extra={'interrupt_to_idle_ms': round(idle * 1000, 1)})
+
+
+def ms_or_none(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def handle_cancelled(session: VoiceSession):
+    """Tell the client the turn stopped early and keep what was already said"""
+    partial = session.current_response
+    session.current_response = ""
+    if partial:
+        session.add_message("assistant", partial)
+    if session.cancel_token.reason != "disconnect":
+        emit('response_interrupted', {})
+        # Every turn ends with response_complete, interrupted or not
+        emit('response_complete', {'text': partial, 'interrupted': True})
+
+
+def stream_ollama_response(prompt: str, session: VoiceSession):
+    """Stream a reply straight from Ollama, stopping on interrupt
+
+    Returns (text, seconds to first chunk), or (None, None) if Ollama could
+    not be reached (or its queue is full) so the caller can fall back to
+    n8n. An interrupt closes the upstream stream (Ollama stops generating)
+    and raises Cancelled.
+    """
+    start = time.perf_counter()
     try:
-        response = requests.post(
+        # The slot is held until the stream is closed; an interrupt shuts its socket down
+        with ollama_scheduler.slot('conversation', session.session_id, session.cancel_token), \
+                abortable_session(session.cancel_token) as http:
+            return _stream_from_ollama(prompt, session, start, http)
+    except SchedulerBusy as e:
+        logger.warning("Ollama busy: %s", e)
+        return None, None
+
+
+def _stream_from_ollama(prompt: str, session: VoiceSession, start: float, http):
+    token = session.cancel_token
+    model = degradation.model('conversation')
+
+    def open_stream(timeout):
+        resp = http.post(
             f"{OLLAMA_HOST}/api/generate",
             json={
-                "model": "qwen2.5:3b",
+                "model": model['name'],
                 "prompt": prompt,
                 "stream": True,
                 "options": {
-                    "temperature": 0.7,
-                    "num_predict": 200
+                    "temperature": model['temperature'],
+                    "num_predict": model['max_tokens']
                 }
             },
             stream=True,
-            timeout=30
+            timeout=timeout
         )
-        
-        full_response = ""
-        for line in response.iter_lines():
-            # Check for interrupt
-            if session.should_interrupt:
-                print(f"Response interrupted for session {sid}")
-                socketio.emit('response_interrupted', {}, room=sid)
-                break
-                
-            if line:
-                import json
+        resp.raise_for_status()
+        return resp
+
+    try:
+        # Waiting for the first byte can take seconds (model load, prompt eval);
+        # an interrupt aborts the wait on this thread, no helper thread involved
+        response = ollama_backend.call(open_stream, idempotent=True, token=token)
+    except Cancelled:
+        raise
+    except Exception as e:
+        logger.warning("Ollama error: %s", e)
+        return None, None
+
+    chunks = []
+    first_chunk = None
+    try:
+        with response:
+            for line in response.iter_lines():
+                if token.cancelled:
+                    break
+                if not line:
+                    continue
                 data = json.loads(line)
-                
-                if 'response' in data:
-                    chunk = data['response']
-                    full_response += chunk
-                    
-                    # Send chunk to client
-                    socketio.emit('response_chunk', {
-                        'chunk': chunk,
-                        'done': data.get('done', False)
-                    }, room=sid)
-                    
-                    # Small delay to prevent overwhelming client
-                    await asyncio.sleep(0.01)
-                
+                chunk = data.get('response', '')
+                if chunk:
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - start
+                        span = current_span()
+                        if span is not None:
+                            span.set(first_chunk_ms=round(first_chunk * 1000, 1))
+                    chunks.append(chunk)
+                    emit('response_chunk', {'chunk': chunk, 'done': data.get('done', False)})
                 if data.get('done'):
                     break
-        
+    except (requests.RequestException, ValueError) as e:
+        # An aborted stream surfaces as a read error
+        if not token.cancelled:
+            logger.warning("Ollama stream error: %s", e)
+            if not chunks:
+                return None, None
+
+    full_response = "".join(chunks).strip()
+    if token.cancelled:
         session.current_response = full_response
-        session.add_message("assistant", full_response)
-        return full_response
-        
-    except Exception as e:
-        print(f"Ollama error: {e}")
-        error_msg = f"Error: {str(e)}"
-        socketio.emit('error', {'message': error_msg}, room=sid)
-        return error_msg
-
+        raise Cancelled(token.reason)
+    emit('response_complete', {'text': full_response})
+    return full_response, first_chunk
+
+
+def replay_response(response_text: str, session: VoiceSession):
+    """Send a complete reply word by word so the UI renders it like a stream"""
+    token = session.cancel_token
+    words = response_text.split()
+    for i, word in enumerate(words):
+        if token.cancelled:
+            session.current_response = " ".join(words[:i])
+            token.check()
+
+        chunk = word + (' ' if i < len(words) - 1 else '')
+        emit('response_chunk', {
+            'chunk': chunk,
+            'done': i == len(words) - 1
+        })
+        try:
+            token.sleep(0.05)  # Slight delay to simulate streaming
+        except Cancelled:
+            session.current_response = " ".join(words[:i + 1])
+            raise
+
+    emit('response_complete', {'text': response_text})
+
+
+def call_n8n_webhook(text: str, intent: str = "CONVERSATION", context: str = None,
+                     token: CancelToken = None) -> dict:
+    """Call n8n webhook for tool execution
+
+    Cancelling the token aborts the HTTP request itself (n8n sees the
+    disconnect); a coalesced request is aborted once every turn sharing
+    it has been cancelled.
+    """
+    # Trace ID lets n8n execution logs be matched with this turn's spans
+    payload = {"text": text, "intent": intent, "source": "streaming", "trace_id": current_trace_id()}
+    headers = inject_headers()
+    if context:
+        # Recent conversation turns so follow-ups like "and tomorrow?" resolve
+        payload["context"] = context
+
+    def send(abort=None):
+        def post(timeout):
+            with abortable_session(abort) as http:
+                resp = http.post(N8N_WEBHOOK, json=payload, headers=headers, timeout=timeout)
+                if resp.status_code >= 500:
+                    # Server-side failure: counts against the circuit breaker
+                    resp.raise_for_status()
+                if resp.status_code == 200:
+                    return resp.json()
+                return {"error": f"n8n returned status {resp.status_code}"}
 
-def call_n8n_webhook(text: str, intent: str = "CONVERSATION") -> dict:
-    """Call n8n webhook for tool execution"""
+        try:
+            return n8n_backend.call(
+                post,
+                idempotent=not is_tools,
+                cache_key=None if is_tools else (intent, text.strip().lower()),
+                fallback={"error": "n8n is unavailable right now"} if is_tools else N8N_FALLBACK,
+                token=abort,
+            )
+        except BackendUnavailable as e:
+            return {"error": str(e)}
+
+    # TOOLS calls have side effects: never retried, never answered from cache
+    is_tools = intent == "TOOLS"
+
+    if response_cache and not is_tools:
+        cached = response_cache.get(text, intent)
+        if cached is not None:
+            return {"output": cached, "cached": True}
+
+    start = time.perf_counter()
+    if is_tools or not n8n_flight.enabled_for(intent):
+        result = send(token)
+    else:
+        key = (intent, normalize_text(text), context or "")
+        # Copy: coalesced callers share one upstream response
+        result = dict(n8n_flight.do(key, send, token))
+
+    if (response_cache and not is_tools and result.get('output')
+            and not result.get('error') and not result.get('degraded')):
+        response_cache.put(text, intent, result['output'], time.perf_counter() - start)
+    return result
+
+
+def tool_job_payload(job):
+    """Client-facing view of a tool job"""
+    payload = {'job_id': job['job_id'], 'status': job['status']}
+    if job['status'] in FINISHED_STATES:
+        payload['text'] = result_text(job)
+    return payload
+
+
+def emit_tool_event(event, job):
+    """Push tool_progress/tool_result to the session (any worker, any reconnect)"""
+    session_id = job['session_id']
+    socketio.emit(event, tool_job_payload(job), room=session_id)
+    if event != 'tool_result':
+        return
+    text = result_text(job)
+    live = next((s for s in list(connected_sessions.values()) if s.session_id == session_id), None)
+    if live is not None:
+        # The handler saves this object at the end of its turn: add to it, not to a copy
+        live.add_message("assistant", text)
+        save_session(live)
+    else:
+        # Not connected here: store-side append (a stale copy elsewhere merges it on save)
+        session_store.update(session_id, lambda session: session.add_message("assistant", text),
+                             VoiceSession)
+
+
+# Tool calls run off the Socket.IO handler thread
+tool_queue = ToolJobQueue.from_config(TOOLS_CONFIG, SESSION_STORE_CONFIG, on_event=emit_tool_event)
+tool_queue.recover()
+
+
+def start_confirmed_tools(session):
+    """Queue the confirmed tool request and return the immediate reply"""
+    pending = session.confirm_tools()
+    if not pending:
+        return "No pending tools to execute."
     try:
-        resp = requests.post(
-            N8N_WEBHOOK,
-            json={"text": text, "intent": intent, "source": "streaming"},
-            timeout=30
+        tool_queue.submit(
+            session.session_id, pending['original_text'],
+            call_n8n_webhook, pending['original_text'], "TOOLS"
         )
-        if resp.status_code == 200:
-            return resp.json()
+    except ToolQueueFull:
+        return "I'm busy with other tasks right now. Please try again in a moment."
+    return "Okay, working on it. I'll let you know when it's done."
+
+
+def answer_conversation(session: VoiceSession, transcript: str) -> str:
+    """Answer a CONVERSATION turn locally (Ollama) or through the n8n agent"""
+    emit('status', {'message': 'Thinking...'})
+    start = time.perf_counter()
+    route, reason = turn_router.route(transcript, "CONVERSATION")
+    annotate(route=route)
+    response_text = first_chunk = None
+
+    if route == LOCAL:
+        cached = response_cache.get(transcript, "CONVERSATION") if response_cache else None
+        if cached is not None:
+            first_chunk = time.perf_counter() - start
+            response_text = cached
+            with stage('replay'):
+                replay_response(cached, session)
         else:
-            return {"error": f"n8n returned status {resp.status_code}"}
-    except Exception as e:
-        return {"error": str(e)}
+            with stage('ollama'):
+                response_text, first_chunk = stream_ollama_response(session.prompt_builder.build(), session)
+            if response_text is None:
+                route, reason = N8N, "local_unavailable"
+                annotate(route=route)
+            elif response_cache:
+                response_cache.put(transcript, "CONVERSATION", response_text, time.perf_counter() - start)
+
+    if route == N8N:
+        with stage('n8n'):
+            # An interrupt aborts the request and frees this handler at once
+            n8n_response = call_n8n_webhook(
+                transcript, "CONVERSATION", session.prompt_builder.context(), session.cancel_token
+            )
+        first_chunk = time.perf_counter() - start
+
+        response_text = n8n_response.get('output') or n8n_response.get('response') or n8n_response.get('message', 'I received your message')
+
+        # Check for error
+        if 'error' in n8n_response:
+            response_text = f"Error: {n8n_response['error']}"
+            emit('error', {'message': response_text})
+        else:
+            with stage('replay'):
+                replay_response(response_text, session)
+
+    turn_router.record(route, reason, first_chunk, time.perf_counter() - start)
+    degradation.observe(time.perf_counter() - start)
+    session.add_message("assistant", response_text)
+    return response_text
 
 
 def detect_intent(text: str, session=None) -> str:
@@ -218,6 +631,28 @@ def index():
     return send_from_directory('.', 'streaming_ui.html')
 
 
+@app.route('/api/metrics')
+def metrics():
+    """Circuit breaker state, adaptive timeouts and call counters per backend"""
+    return {
+        'backends': all_metrics(),
+        'coalescing': {'n8n': n8n_flight.stats},
+        'response_cache': response_cache.stats() if response_cache else None,
+        'routes': turn_router.stats(),
+        'scheduler': ollama_scheduler.stats(),
+        'degradation': degradation.stats(),
+        'transcription': whisper_router.stats() if whisper_router else None,
+        'preprocessing': audio_preprocessor.stats(),
+        'interrupts': {
+            'count': interrupt_stats['count'],
+            'idle_ms': {
+                'p50': ms_or_none(interrupt_stats['idle'].quantile(50)),
+                'p95': ms_or_none(interrupt_stats['idle'].quantile(95)),
+            },
+        },
+    }
+
+
 @app.route('/api/test')
 def test_connection():
     """Test endpoint"""
@@ -230,32 +665,50 @@ def test_connection():
 
 
 @socketio.on('connect')
-def handle_connect():
-    """Handle new WebSocket connection"""
+def handle_connect(auth=None):
+    """Handle new WebSocket connection (resumes a session if the client sends its id and token)"""
     sid = request.sid if hasattr(request, 'sid') else 'unknown'
-    sessions[sid] = VoiceSession(sid)
-    print(f"Client connected: {sid}")
-    emit('connected', {'session_id': sid})
+    auth = auth if isinstance(auth, dict) else {}
+    session = resume_session(auth.get('session_id'), auth.get('resume_token'))
+    if session is None:
+        if auth.get('session_id'):
+            # Unknown, evicted or someone else's: never attach without the token
+            logger.warning("Session resume rejected for client %s, starting a new session", sid)
+        session = new_session()
+    session_id = session.session_id
+    connected_sessions[sid] = session
+    # Tool results are addressed to the session, not the socket
+    join_room(session_id)
+    logger.info("Client connected: %s (session %s)", sid, session_id)
+    emit('connected', {'session_id': session_id, 'resume_token': session.resume_token})
+
+    # Replay tool jobs the client has not acknowledged (e.g. finished while offline)
+    for job in tool_queue.unacked(session_id):
+        event = 'tool_result' if job['status'] in FINISHED_STATES else 'tool_progress'
+        emit(event, tool_job_payload(job))
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle WebSocket disconnection"""
     sid = request.sid if hasattr(request, 'sid') else 'unknown'
-    if sid in sessions:
-        del sessions[sid]
-    print(f"Client disconnected: {sid}")
+    session = connected_sessions.pop(sid, None)
+    if session:
+        # Nobody is listening any more: stop the turn's work
+        session.interrupt("disconnect")
+        # Keep the stored session so a reconnect can resume it
+        save_session(session)
+    logger.info("Client disconnected: %s", sid)
 
 
 @socketio.on('audio_data')
+@logged_request('audio_turn', logger)
 def handle_audio(data):
     """Handle incoming audio data"""
     sid = request.sid if hasattr(request, 'sid') else 'unknown'
-    session = sessions.get(sid)
-    
-    if not session:
-        emit('error', {'message': 'Session not found'})
-        return
+    session = get_session(sid)
+    annotate(session_id=session.session_id)
+    token = session.begin_turn()
     
     try:
         # Get audio data
@@ -267,136 +720,88 @@ def handle_audio(data):
         # Decode audio
         audio_bytes = base64.b64decode(audio_b64)
         
-        # Save to temp file
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_audio:
-            temp_audio.write(audio_bytes)
-            temp_audio_path = temp_audio.name
-        
-        try:
-            # Convert to WAV if ffmpeg available
-            wav_path = temp_audio_path.replace('.webm', '.wav')
+        # Decode and resample in-process (any rate / channel count -> 16 kHz mono),
+        # in pooled buffers held until Whisper is done with the audio
+        with audio_preprocessor.buffers() as buffers:
             try:
-                subprocess.run([
-                    'ffmpeg', '-i', temp_audio_path,
-                    '-ar', '16000', '-ac', '1', '-y', wav_path
-                ], check=True, capture_output=True, 
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-            except:
-                wav_path = temp_audio_path
-            
+                with stage('preprocess'):
+                    audio = audio_preprocessor.load(audio_bytes, token, buffers)
+            except AudioDecodeError as e:
+                logger.warning("Undecodable audio upload: %s", e)
+                emit('error', {'message': 'Could not decode audio'})
+                return
+                
             # Transcribe
             emit('status', {'message': 'Transcribing...'})
-            transcript = transcribe_audio(wav_path)
+            with stage('whisper'):
+                transcript = transcribe_audio(audio, token, session)
+            
+        if transcript and len(transcript) > 2:
+            # Send transcript to client
+            emit('transcript', {'text': transcript})
+            session.add_message("user", transcript)
             
-            if transcript and len(transcript) > 2:
-                # Send transcript to client
-                emit('transcript', {'text': transcript})
-                session.add_message("user", transcript)
+            # Detect intent with session context
+            intent = detect_intent(transcript, session)
+            annotate(intent=intent)
+            emit('intent', {'intent': intent})
+            
+            if intent == "CONFIRM":
+                # User confirmed pending tools
+                response_text = start_confirmed_tools(session)
+                emit('response_complete', {'text': response_text})
+                session.add_message("assistant", response_text)
+                
+            elif intent == "CANCEL":
+                # User cancelled pending tools
+                session.cancel_tools()
+                response_text = "Okay, I've cancelled that action."
+                emit('response_complete', {'text': response_text})
+                session.add_message("assistant", response_text)
                 
-                # Detect intent with session context
-                intent = detect_intent(transcript, session)
-                emit('intent', {'intent': intent})
+            elif intent == "TOOLS":
+                # Ask for confirmation before executing tools
+                emit('status', {'message': 'Identifying required tools...'})
+                
+                # Store pending tools
+                session.set_pending_tools({
+                    'original_text': transcript,
+                    'timestamp': time.time()
+                })
+                
+                # Ask for confirmation
+                confirmation_msg = f"I will execute tools to handle: '{transcript}'. Do you want me to proceed?"
+                emit('confirmation_request', {
+                    'text': confirmation_msg,
+                    'tools': ['Based on your request']
+                })
+                emit('response_complete', {'text': confirmation_msg})
+                session.add_message("assistant", confirmation_msg)
                 
-                if intent == "CONFIRM":
-                    # User confirmed pending tools
-                    emit('status', {'message': 'Executing confirmed tools...'})
-                    pending = session.confirm_tools()
-                    
-                    if pending:
-                        n8n_response = call_n8n_webhook(pending['original_text'], "TOOLS")
-                        response_text = n8n_response.get('output') or n8n_response.get('message', 'Tools executed')
-                    else:
-                        response_text = "No pending tools to execute."
-                    
-                    emit('response_complete', {'text': response_text})
-                    session.add_message("assistant", response_text)
-                    
-                elif intent == "CANCEL":
-                    # User cancelled pending tools
-                    session.cancel_tools()
-                    response_text = "Okay, I've cancelled that action."
-                    emit('response_complete', {'text': response_text})
-                    session.add_message("assistant", response_text)
-                    
-                elif intent == "TOOLS":
-                    # Ask for confirmation before executing tools
-                    emit('status', {'message': 'Identifying required tools...'})
-                    
-                    # Store pending tools
-                    session.set_pending_tools({
-                        'original_text': transcript,
-                        'timestamp': time.time()
-                    })
-                    
-                    # Ask for confirmation
-                    confirmation_msg = f"I will execute tools to handle: '{transcript}'. Do you want me to proceed?"
-                    emit('confirmation_request', {
-                        'text': confirmation_msg,
-                        'tools': ['Based on your request']
-                    })
-                    emit('response_complete', {'text': confirmation_msg})
-                    session.add_message("assistant", confirmation_msg)
-                    
-                else:
-                    # Use n8n for conversation (remote n8n handles Ollama)
-                    emit('status', {'message': 'Thinking...'})
-                    session.is_processing = True
-                    
-                    n8n_response = call_n8n_webhook(transcript, "CONVERSATION")
-                    
-                    response_text = n8n_response.get('output') or n8n_response.get('response') or n8n_response.get('message', 'I received your message')
-                    
-                    # Check for error
-                    if 'error' in n8n_response:
-                        response_text = f"Error: {n8n_response['error']}"
-                        emit('error', {'message': response_text})
-                    else:
-                        # Simulate streaming by sending response word by word
-                        words = response_text.split()
-                        for i, word in enumerate(words):
-                            if session.should_interrupt:
-                                emit('response_interrupted', {})
-                                break
-                            
-                            chunk = word + (' ' if i < len(words) - 1 else '')
-                            emit('response_chunk', {
-                                'chunk': chunk,
-                                'done': i == len(words) - 1
-                            })
-                            time.sleep(0.05)  # Slight delay to simulate streaming
-                        
-                        emit('response_complete', {'text': response_text})
-                    
-                    session.add_message("assistant", response_text)
-                    session.is_processing = False
             else:
-                emit('error', {'message': 'Could not transcribe audio'})
-            
-        finally:
-            # Cleanup temp files
-            try:
-                os.unlink(temp_audio_path)
-                if wav_path != temp_audio_path and os.path.exists(wav_path):
-                    os.unlink(wav_path)
-            except:
-                pass
+                # Simple turns stream from Ollama, the rest go to the n8n agent
+                answer_conversation(session, transcript)
+        else:
+            emit('error', {'message': 'Could not transcribe audio'})
     
+    except Cancelled:
+        handle_cancelled(session)
     except Exception as e:
-        print(f"Error processing audio: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing audio: %s", e)
         emit('error', {'message': str(e)})
+    finally:
+        finish_turn(session)
+        save_session(session)
 
 
 @socketio.on('text_message')
+@logged_request('text_turn', logger)
 def handle_text_message(data):
     """Handle text message from browser speech recognition"""
     sid = request.sid if hasattr(request, 'sid') else 'unknown'
-    session = sessions.get(sid)
-    
-    if not session:
-        emit('error', {'message': 'Session not found'})
-        return
+    session = get_session(sid)
+    annotate(session_id=session.session_id)
+    session.begin_turn()
     
     try:
         transcript = data.get('text', '').strip()
@@ -404,26 +809,19 @@ def handle_text_message(data):
             emit('error', {'message': 'No text provided'})
             return
         
-        print(f"[TEXT] Received from {sid}: {transcript}")
+        logger.debug("Text from %s: %s", sid, transcript)
         
         # Add user message to history
         session.add_message("user", transcript)
         
         # Detect intent with session context
         intent = detect_intent(transcript, session)
+        annotate(intent=intent)
         emit('intent', {'intent': intent})
         
         if intent == "CONFIRM":
             # User confirmed pending tools
-            emit('status', {'message': 'Executing confirmed tools...'})
-            pending = session.confirm_tools()
-            
-            if pending:
-                n8n_response = call_n8n_webhook(pending['original_text'], "TOOLS")
-                response_text = n8n_response.get('output') or n8n_response.get('message', 'Tools executed')
-            else:
-                response_text = "No pending tools to execute."
-            
+            response_text = start_confirmed_tools(session)
             emit('response_complete', {'text': response_text})
             session.add_message("assistant", response_text)
             
@@ -454,54 +852,37 @@ def handle_text_message(data):
             session.add_message("assistant", confirmation_msg)
             
         else:
-            # Use n8n for conversation (remote n8n handles Ollama)
-            emit('status', {'message': 'Thinking...'})
-            session.is_processing = True
-            
-            n8n_response = call_n8n_webhook(transcript, "CONVERSATION")
-            
-            response_text = n8n_response.get('output') or n8n_response.get('response') or n8n_response.get('message', 'I received your message')
-            
-            # Check for error
-            if 'error' in n8n_response:
-                response_text = f"Error: {n8n_response['error']}"
-                emit('error', {'message': response_text})
-            else:
-                # Simulate streaming by sending response word by word
-                words = response_text.split()
-                for i, word in enumerate(words):
-                    if session.should_interrupt:
-                        emit('response_interrupted', {})
-                        break
-                    
-                    chunk = word + (' ' if i < len(words) - 1 else '')
-                    emit('response_chunk', {
-                        'chunk': chunk,
-                        'done': i == len(words) - 1
-                    })
-                    time.sleep(0.05)  # Slight delay to simulate streaming
-                
-                emit('response_complete', {'text': response_text})
-                # TTS is handled locally by the browser - no audio needed from server
-            
-            session.add_message("assistant", response_text)
-            session.is_processing = False
+            # Simple turns stream from Ollama, the rest go to the n8n agent
+            # (TTS is handled locally by the browser - no audio needed from server)
+            answer_conversation(session, transcript)
             
+    except Cancelled:
+        handle_cancelled(session)
     except Exception as e:
-        print(f"Error processing text: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing text: %s", e)
         emit('error', {'message': str(e)})
+    finally:
+        finish_turn(session)
+        save_session(session)
+
+
+@socketio.on('tool_ack')
+def handle_tool_ack(data):
+    """Client received a tool result; stop replaying it on reconnect"""
+    job_id = (data or {}).get('job_id')
+    session = connected_sessions.get(request.sid)
+    if job_id and session and not tool_queue.ack(job_id, session.session_id):
+        logger.debug("Ignored tool_ack for job %s from session %s", job_id, session.session_id)
 
 
 @socketio.on('interrupt')
 def handle_interrupt():
     """Handle interrupt signal from client"""
     sid = request.sid if hasattr(request, 'sid') else 'unknown'
-    session = sessions.get(sid)
+    session = connected_sessions.get(sid)
     
     if session and session.is_processing:
-        print(f"Interrupting session {sid}")
+        logger.info("Interrupting session %s", sid)
         session.interrupt()
         emit('interrupted', {'message': 'Response interrupted'})
 
@@ -516,7 +897,7 @@ if __name__ == '__main__':
     print("🎙️ Real-Time Streaming Voice Assistant")
     print("="*60)
     print(f"Whisper Available: {WHISPER_AVAILABLE}")
-    print(f"Whisper Model: {WHISPER_MODEL if WHISPER_AVAILABLE else 'Not installed'}")
+    print(f"Whisper Models: {', '.join(whisper_router.models()) if whisper_router else 'Not available'}")
     print(f"Ollama Host: {OLLAMA_HOST}")
     print(f"n8n Webhook: {N8N_WEBHOOK}")
     print("="*60)
@@ -527,6 +908,8 @@ if __name__ == '__main__':
     print("  ✓ Intent detection")
     print("  ✓ n8n tool integration")
     print("="*60)
+    start_background_tasks()
+
     print("\nStarting server on http://localhost:5002")
     print("Open http://localhost:5002 in your browser!\n")
     
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Whisper model routing
+A one-word "yes" to a confirmation prompt does not need the model used for
+a dictated email. Each clip is routed by its duration and the session state
+to a model size: tiny for CONFIRM/CANCEL windows, a larger model for long
+dictation, the default model for everything else. Models stay loaded within
+a memory budget (least recently used are evicted first); a clip whose model
+is not resident is decoded with the default model while it loads in the
+background. Long clips are split at pauses and their chunks decoded in
+parallel (audio_chunking.py). Decode latency is tracked per route, and
+`bench` measures accuracy (WER) and latency per route on a labelled corpus.
+
+Usage:
+    python whisper_router.py bench corpus/     # *.wav + same-name *.txt, or manifest.jsonl
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from resilience import LatencyTracker, percentile
+from transcriber import Transcriber, Transcript
+
+logger = logging.getLogger('VoiceAssistant.whisper_router')
+
+SAMPLE_RATE = 16000
+
+# Approximate resident size (MB) of an int8 model, used to decide whether a
+# model fits before it is loaded; the measured size replaces it afterwards
+MODEL_SIZE_MB = {
+    'tiny': 75,
+    'base': 145,
+    'small': 480,
+    'medium': 1500,
+    'large': 3100,
+    'distil': 1600,
+}
+
+# First match wins; keys are route names reported in /api/metrics
+DEFAULT_ROUTES = OrderedDict([
+    ('confirmation', {'model': 'tiny.en', 'awaiting_confirmation': True, 'max_seconds': 3.0}),
+    ('dictation', {'model': 'small.en', 'min_seconds': 8.0}),
+    ('default', {'model': 'base.en'}),
+])
+
+
+def estimate_size_mb(name: str) -> float:
+    """Size estimate from the model family ('small.en' -> small)"""
+    family = re.split(r'[.\-_]', os.path.basename(name.rstrip('/\\')))[0].lower()
+    return MODEL_SIZE_MB.get(family, MODEL_SIZE_MB['base'])
+
+
+def model_loader(cpu_threads: int, num_workers: int, device: str = 'cpu',
+                 compute_type: str = 'int8') -> Callable[[str], object]:
+    """Factory for faster-whisper models sized to this process' thread plan"""
+    def load(name: str):
+        from faster_whisper import WhisperModel
+        from model_preload import local_path
+        return WhisperModel(
+            local_path(name),  # Resolved by the launcher before fork, if preloading
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=num_workers,
+        )
+    return load
+
+
+def configured_loader(whisper_config: Optional[dict], plan) -> Callable[[str], object]:
+    """model_loader() for a WorkerPlan; device / compute_type from config.yaml, env vars win"""
+    whisper_config = whisper_config or {}
+    return model_loader(
+        plan.cpu_threads,
+        plan.num_workers,
+        device=os.getenv('WHISPER_DEVICE', whisper_config.get('device', 'cpu')),
+        compute_type=os.getenv('WHISPER_COMPUTE_TYPE', whisper_config.get('compute_type', 'int8')),
+    )
+
+
+def configured_default_model(config: Optional[dict]) -> str:
+    """WHISPER_MODEL, else the default route's model in config.yaml"""
+    routes = ((config or {}).get('whisper_routing') or {}).get('routes') or DEFAULT_ROUTES
+    return os.getenv('WHISPER_MODEL') or (routes.get('default') or {}).get('model', 'base.en')
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+class Route:
+    """Conditions for one route and the model it uses"""
+
+    def __init__(self, name: str, model: str, awaiting_confirmation: Optional[bool] = None,
+                 min_seconds: float = 0.0, max_seconds: Optional[float] = None):
+        self.name = name
+        self.model = model
+        self.awaiting_confirmation = awaiting_confirmation
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.clips = 0
+        self.rerouted = 0  # Decoded with the default model because this one was not resident
+        self.audio_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.latency = LatencyTracker(window=500)
+
+    def matches(self, duration: float, awaiting_confirmation: bool) -> bool:
+        if self.awaiting_confirmation is not None and self.awaiting_confirmation != awaiting_confirmation:
+            return False
+        if duration < self.min_seconds:
+            return False
+        if self.max_seconds is not None and duration > self.max_seconds:
+            return False
+        return True
+
+
+class _Resident:
+    """A loaded model, its Transcriber and how many clips are decoding on it"""
+
+    __slots__ = ('name', 'transcriber', 'size_mb', 'in_use', 'last_used')
+
+    def __init__(self, name: str, transcriber: Transcriber, size_mb: float):
+        self.name = name
+        self.transcriber = transcriber
+        self.size_mb = size_mb
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class WhisperRouter:
+    """Routes clips to Whisper models and keeps the models within a memory budget"""
+
+    def __init__(
+        self,
+        load_model: Callable[[str], object],
+        whisper_config: Optional[dict] = None,
+        routes: Optional[Dict[str, dict]] = None,
+        memory_budget_mb: float = 1500.0,
+        enabled: bool = True,
+        default_model: Optional[str] = None,
+        chunker=None,
+    ):
+        self.load_model = load_model
+        self.chunker = chunker  # AudioChunker for long clips (None = always one call)
+        self.whisper_config = whisper_config or {}
+        self.memory_budget_mb = memory_budget_mb
+        self.enabled = enabled
+        routes = routes or DEFAULT_ROUTES
+        self.routes = [Route(name, **opts) for name, opts in routes.items()]
+        self.default = next((r for r in self.routes if r.name == 'default'), self.routes[-1])
+        if default_model:
+            self.default.model = default_model
+        if not enabled:
+            self.routes = [self.default]
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._resident: Dict[str, _Resident] = {}
+        self._loading = set()
+        self._unfit = set()  # Models that did not fit last time (warned once)
+
+    @classmethod
+    def from_config(cls, load_model: Callable[[str], object], config: Optional[dict],
+                    whisper_config: Optional[dict] = None,
+                    default_model: Optional[str] = None, chunker=None) -> "WhisperRouter":
+        """Build from the `whisper_routing` section of config.yaml"""
+        config = config or {}
+        routes = config.get('routes')
+        return cls(
+            load_model,
+            whisper_config=whisper_config,
+            routes=OrderedDict((name, dict(opts or {})) for name, opts in routes.items()) if routes else None,
+            memory_budget_mb=config.get('memory_budget_mb', 1500.0),
+            enabled=config.get('enabled', True),
+            default_model=default_model,
+            chunker=chunker,
+        )
+
+    @property
+    def default_model(self) -> str:
+        return self.default.model
+
+    def models(self) -> List[str]:
+        """Distinct route models, default first, then in route order"""
+        names = [self.default.model]
+        for route in self.routes:
+            if route.model not in names:
+                names.append(route.model)
+        return names
+
+    def preload(self) -> List[str]:
+        """Load the default model, then the other route models while they fit"""
+        loaded = []
+        for name in self.models():
+            if self._load(name, evict=False) is not None:
+                loaded.append(name)
+            elif name == self.default.model:
+                raise RuntimeError(f"Default Whisper model {name} could not be loaded")
+        return loaded
+
+    def route(self, duration: float, awaiting_confirmation: bool = False) -> Route:
+        for route in self.routes:
+            if route.matches(duration, awaiting_confirmation):
+                return route
+        return self.default
+
+    def _used_mb(self) -> float:
+        return sum(r.size_mb for r in self._resident.values())
+
+    def _make_room(self, size_mb: float, evict: bool = True) -> bool:
+        """Evict idle non-default models, least recently used first (lock held)"""
+        idle = [r for r in self._resident.values()
+                if r.in_use == 0 and r.name != self.default.model]
+        reclaimable = sum(r.size_mb for r in idle) if evict else 0.0
+        if self._used_mb() - reclaimable + size_mb > self.memory_budget_mb:
+            return False  # Would not fit even after evicting: keep what is loaded
+        while self._used_mb() + size_mb > self.memory_budget_mb:
+            victim = min(idle, key=lambda r: r.last_used)
+            idle.remove(victim)
+            del self._resident[victim.name]
+            logger.info("Evicted Whisper model %s (%.0f MB) to make room", victim.name, victim.size_mb)
+        return True
+
+    def _load(self, name: str, evict: bool = True) -> Optional[_Resident]:
+        """Load a model if it fits the budget (one load at a time); the default always loads"""
+        with self._load_lock:
+            with self._lock:
+                if name in self._resident:
+                    return self._resident[name]
+                estimate = estimate_size_mb(name)
+                if name != self.default.model and not self._make_room(estimate, evict):
+                    if name not in self._unfit:
+                        logger.warning("Whisper model %s (~%.0f MB) does not fit the %.0f MB budget",
+                                       name, estimate, self.memory_budget_mb)
+                    self._unfit.add(name)
+                    return None
+            before = _rss_mb()
+            start = time.perf_counter()
+            try:
+                model = self.load_model(name)
+            except Exception as e:
+                logger.error("Failed to load Whisper model %s: %s", name, e)
+                return None
+            after = _rss_mb()
+            measured = after - before if before is not None and after is not None else 0.0
+            resident = _Resident(
+                name,
+                Transcriber.from_config(model, self.whisper_config),
+                measured if measured > 0 else estimate,
+            )
+            with self._lock:
+                self._resident[name] = resident
+                self._unfit.discard(name)
+            logger.info("Loaded Whisper model %s in %.1fs (%.0f MB)",
+                        name, time.perf_counter() - start, resident.size_mb)
+            return resident
+
+    def _load_in_background(self, name: str):
+        with self._lock:
+            if name in self._loading:
+                return
+            self._loading.add(name)
+
+        def run():
+            try:
+                self._load(name)
+            finally:
+                with self._lock:
+                    self._loading.discard(name)
+
+        threading.Thread(target=run, name=f'whisper-load-{name}', daemon=True).start()
+
+    def _acquire(self, name: str, wait: bool) -> Optional[_Resident]:
+        with self._lock:
+            resident = self._resident.get(name)
+            if resident is not None:
+                resident.in_use += 1
+                resident.last_used = time.monotonic()
+                return resident
+        if not wait:
+            self._load_in_background(name)
+            return None
+        if self._load(name) is None:
+            return None
+        return self._acquire(name, wait=False)
+
+    def _release(self, resident: _Resident):
+        with self._lock:
+            resident.in_use -= 1
+
+    def transcribe_with(self, model: str, audio, token=None, wait: bool = True,
+                        **overrides) -> Optional[Transcript]:
+        """Decode on a specific model; None if it is not resident and wait is False"""
+        resident = self._acquire(model, wait)
+        if resident is None:
+            return None
+        try:
+            result = resident.transcriber.transcribe(audio, token, **overrides)
+        finally:
+            self._release(resident)
+        result.model = model
+        return result
+
+    def transcribe(self, audio, token=None, awaiting_confirmation: bool = False,
+                   route_models: Optional[Dict[str, str]] = None, **overrides) -> Transcript:
+        """Route and transcribe a file path or 16 kHz float32 array
+
+        route_models maps route name -> model for this clip (e.g. from the
+        degradation tier); overrides go to Transcriber.transcribe().
+        """
+        if isinstance(audio, str):
+            # Decode once: the duration picks the route, the samples are reused
+            from faster_whisper import decode_audio
+            audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+        duration = len(audio) / SAMPLE_RATE
+        route = self.route(duration, awaiting_confirmation)
+        model = (route_models or {}).get(route.name, route.model)
+
+        resident = self._acquire(model, wait=model == self.default.model)
+        rerouted = resident is None
+        if rerouted:
+            resident = self._acquire(self.default.model, wait=True)
+        try:
+            def decode(samples):
+                return resident.transcriber.transcribe(samples, token, **overrides)
+
+            if self.chunker is not None and self.chunker.should_split(duration):
+                result = self.chunker.transcribe(audio, decode, token)
+            else:
+                result = decode(audio)
+        finally:
+            self._release(resident)
+        result.model = resident.name
+        result.route = route.name
+
+        with self._lock:
+            route.clips += 1
+            route.rerouted += rerouted
+            route.audio_seconds += duration
+            route.decode_seconds += result.decode_seconds
+            route.latency.record(result.decode_seconds)
+        return result
+
+    def stats(self) -> dict:
+        """Per-route clip counts and decode latency, per-model memory and decoding stats"""
+        def ms(tracker, pct):
+            value = tracker.quantile(pct)
+            return None if value is None else round(value * 1000, 1)
+
+        with self._lock:
+            routes = {
+                route.name: {
+                    'model': route.model,
+                    'clips': route.clips,
+                    'rerouted': route.rerouted,
+                    'audio_seconds': round(route.audio_seconds, 1),
+                    'rtf': round(route.decode_seconds / route.audio_seconds, 4) if route.audio_seconds else None,
+                    'decode_ms': {'p50': ms(route.latency, 50), 'p95': ms(route.latency, 95)},
+                }
+                for route in self.routes
+            }
+            resident = list(self._resident.values())
+            used = self._used_mb()
+        return {
+            'enabled': self.enabled,
+            'memory_budget_mb': self.memory_budget_mb,
+            'memory_used_mb': round(used, 1),
+            'routes': routes,
+            'chunking': self.chunker.stats() if self.chunker is not None else None,
+            'models': {
+                r.name: {'size_mb': round(r.size_mb, 1), 'in_use': r.in_use, **r.transcriber.stats()}
+                for r in resident
+            },
+        }
+
+
+def _normalize_words(text: str) -> List[str]:
+    return re.sub(r"[^\w\s']", ' ', text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level edit distance divided by the reference length"""
+    ref = _normalize_words(reference)
+    hyp = _normalize_words(hypothesis)
+    if not ref:
+        return float(bool(hyp))
+    previous = list(range(len(hyp) + 1))
+    for i, word in enumerate(ref, 1):
+        current = [i]
+        for j, guess in enumerate(hyp, 1):
+            current.append(min(
+                previous[j] + 1,                     # Deletion
+                current[j - 1] + 1,                  # Insertion
+                previous[j - 1] + (word != guess),   # Substitution
+            ))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def load_corpus(path: str) -> List[dict]:
+    """Clips with reference text: manifest.jsonl ({audio, text, awaiting_confirmation}) or *.wav + *.txt"""
+    root = Path(path)
+    manifest = root / 'manifest.jsonl'
+    if manifest.exists():
+        clips = []
+        for line in manifest.read_text().splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                entry['audio'] = str(root / entry['audio'])
+                clips.append(entry)
+        return clips
+    return [
+        {'audio': str(audio), 'text': audio.with_suffix('.txt').read_text().strip()}
+        for audio in sorted(root.glob('*.wav'))
+        if audio.with_suffix('.txt').exists()
+    ]
+
+
+def bench(corpus_path: str, router: WhisperRouter) -> Dict[str, dict]:
+    """WER and latency per route, routed vs. every clip on the default model"""
+    from faster_whisper import decode_audio
+
+    clips = load_corpus(corpus_path)
+    if not clips:
+        raise SystemExit(f"No labelled clips in {corpus_path}")
+    router.preload()
+    results: Dict[str, dict] = {}
+    warmed = set()
+    for clip in clips:
+        audio = decode_audio(clip['audio'], sampling_rate=SAMPLE_RATE)
+        confirming = bool(clip.get('awaiting_confirmation'))
+        route = router.route(len(audio) / SAMPLE_RATE, confirming)
+        for model in {route.model, router.default_model} - warmed:
+            router.transcribe_with(model, audio)  # First decode on a model pays one-off setup
+            warmed.add(model)
+        routed = router.transcribe(audio, awaiting_confirmation=confirming)
+        baseline = router.transcribe_with(router.default_model, audio)
+        r = results.setdefault(route.name, {'model': route.model, 'clips': 0, 'wer': [],
+                                            'baseline_wer': [], 'ms': [], 'baseline_ms': []})
+        r['clips'] += 1
+        r['wer'].append(word_error_rate(clip['text'], routed.text))
+        r['baseline_wer'].append(word_error_rate(clip['text'], baseline.text))
+        r['ms'].append(routed.decode_seconds * 1000)
+        r['baseline_ms'].append(baseline.decode_seconds * 1000)
+    return results
+
+
+def _bench_main(corpus_path: str):
+    from launcher import load_config
+    from resource_planner import configure_process
+
+    config = load_config()
+    plan = configure_process(config)
+    router = WhisperRouter.from_config(
+        configured_loader(config.get('whisper'), plan),
+        config.get('whisper_routing'),
+        config.get('whisper'),
+        default_model=os.getenv('WHISPER_MODEL'),
+    )
+    results = bench(corpus_path, router)
+    print(f"baseline: every clip on {router.default_model}\n")
+    print(f"{'route':<14} {'model':<12} {'clips':>5} {'WER':>7} {'base':>7} "
+          f"{'p50 ms':>8} {'base':>8} {'p95 ms':>8} {'base':>8}")
+    for name, r in results.items():
+        print(f"{name:<14} {r['model']:<12} {r['clips']:>5} "
+              f"{sum(r['wer']) / r['clips']:>7.3f} {sum(r['baseline_wer']) / r['clips']:>7.3f} "
+              f"{percentile(r['ms'], 50):>8.0f} {percentile(r['baseline_ms'], 50):>8.0f} "
+              f"{percentile(r['ms'], 95):>8.0f} {percentile(r['baseline_ms'], 95):>8.0f}")
+    print(f"\nresident: {router.stats()['memory_used_mb']:.0f} MB of {router.memory_budget_mb:.0f} MB budget")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "bench":
+        _bench_main(sys.argv[2])
+    else:
+        print(__doc__)